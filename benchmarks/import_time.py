@@ -0,0 +1,78 @@
+"""Benchmark of the time until the server is ready after `import yacv_server`, and of the CAD modules loaded later.
+
+The heavy CAD modules (build123d, OCP, numpy, pygltflib, PIL) are only imported on first use, so that the server can
+accept connections from the frontend while they load. Each measurement runs in a fresh interpreter, and compares:
+
+- server_ready: `import yacv_server`, which returns once the server is listening.
+- cad_modules: the extra time to import the CAD modules afterward, that `import yacv_server` used to wait for.
+- first_export: the time from a fresh interpreter until the first object is shown and built.
+
+Usage: python benchmarks/import_time.py [--repeat 5] [--output results.json]
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Any
+
+HEAVY_MODULES = ('build123d', 'OCP', 'numpy', 'pygltflib', 'PIL')
+
+_MEASURE = '''
+import json, sys, time
+start = time.perf_counter()
+import yacv_server
+server_ready = time.perf_counter() - start
+loaded_early = [name for name in %r if name in sys.modules]
+import yacv_server.cad, yacv_server.gltf, yacv_server.tessellate
+cad_modules = time.perf_counter() - start - server_ready
+from build123d import Box
+yacv_server.show(Box(1, 2, 3), names='box')
+yacv_server.yacv.export('box')
+first_export = time.perf_counter() - start
+print(json.dumps({'server_ready': server_ready, 'cad_modules': cad_modules, 'first_export': first_export,
+                  'loaded_early': loaded_early}))
+sys.stdout.flush()
+import os
+os._exit(0)
+''' % (HEAVY_MODULES,)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def measure() -> Dict[str, Any]:
+    """Runs one measurement in a fresh interpreter"""
+    env = {**os.environ, 'YACV_PORT': str(_free_port()), 'YACV_GRACEFUL_SECS_CONNECT': '0'}
+    res = subprocess.run([sys.executable, '-c', _MEASURE], env=env, capture_output=True, text=True, check=True)
+    return json.loads(res.stdout.strip().splitlines()[-1])
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    return {'min': min(values), 'median': statistics.median(values), 'max': max(values)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters to measure (default: 5)')
+    parser.add_argument('--output', default=None, help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    measure()  # Warm up the OS file cache, which dominates the first run
+    runs = [measure() for _ in range(args.repeat)]
+    results = {key: _summary([run[key] for run in runs]) for key in ('server_ready', 'cad_modules', 'first_export')}
+    results['loaded_early'] = sorted({name for run in runs for name in run['loaded_early']})
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""Load test of the update fan-out and object downloads of yacv_server, using only the standard library.
+
+It starts a server in this process and opens N simulated /api/updates (SSE) subscribers and M concurrent /api/object
+downloaders with asyncio, while a producer thread calls `show()`/`remove()` at a fixed rate. It reports the latency from
+each `show()`/`remove()` call until each subscriber receives its event, the download throughput and latency, and the
+thread count and resident memory of the process, to evaluate changes to the server cores.
+
+Usage: python benchmarks/loadtest.py [--subscribers 200] [--downloaders 20] [--core asyncio] [--help for more options]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from typing import Dict, List, Tuple, Any, Optional
+
+EventKey = Tuple[str, str, bool]
+"""(name, hash, is_remove) of an update event"""
+
+
+class Stats:
+    """Measurements shared by the producer, the clients and the sampler"""
+
+    def __init__(self):
+        self.sent_at: Dict[EventKey, float] = {}
+        self.sent_events = 0
+        self.shown: Tuple[str, ...] = ()
+        """The names of the objects currently shown (replaced, not mutated, as it is read from other threads)"""
+        self.received: List[Tuple[EventKey, float]] = []
+        """Every event received by every subscriber, matched with sent_at at the end to measure the latencies"""
+        self.connected_subscribers = 0
+        self.subscriber_errors = 0
+        self.download_latencies: List[float] = []
+        self.downloaded_bytes = 0
+        self.download_errors = 0
+        self.download_not_found = 0
+        self.max_threads = 0
+        self.max_rss_bytes = 0
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    values = sorted(values)
+    res: Dict[str, Optional[float]] = {}
+    for name, q in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0)):
+        res[name] = values[min(len(values) - 1, int(q * len(values)))] if values else None
+    return res
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+async def _request(port: int, path: str) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter, int, Dict[str, str]]:
+    """Sends a GET request and reads the status and headers of the response"""
+    reader, writer = await asyncio.open_connection('localhost', port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'.encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('iso-8859-1').strip()
+        if not line:
+            break
+        key, value = line.split(':', 1)
+        headers[key.strip().lower()] = value.strip()
+    return reader, writer, status, headers
+
+
+async def _read_chunks(reader: asyncio.StreamReader, headers: Dict[str, str]):
+    """Yields the body of a response as it arrives, decoding the chunked transfer encoding if needed"""
+    if headers.get('transfer-encoding', '').lower() != 'chunked':
+        while data := await reader.read(65536):
+            yield data
+        return
+    while True:
+        size = int((await reader.readline()).split(b';')[0], 16)
+        if size == 0:
+            return
+        yield await reader.readexactly(size)
+        await reader.readexactly(2)
+
+
+async def subscriber(port: int, stats: Stats, stop: asyncio.Event):
+    """Follows the updates stream, measuring the delay of each event produced during the test"""
+    try:
+        reader, writer, status, headers = await _request(port, '/api/updates')
+    except OSError:
+        stats.subscriber_errors += 1
+        return
+    if status != 200:
+        stats.subscriber_errors += 1
+        writer.close()
+        return
+    stats.connected_subscribers += 1
+    buffer = b''
+    try:
+        async for chunk in _read_chunks(reader, headers):
+            buffer += chunk
+            while b'\n\n' in buffer:
+                message, buffer = buffer.split(b'\n\n', 1)
+                now = time.perf_counter()
+                for line in message.split(b'\n'):
+                    if not line.startswith(b'data:'):
+                        continue
+                    data = json.loads(line[5:])
+                    for event in data['batch'] if 'batch' in data else [data]:
+                        stats.received.append(((event['name'], event['hash'], bool(event['is_remove'])), now))
+            if stop.is_set():
+                break
+    except (OSError, asyncio.IncompleteReadError, ValueError):
+        if not stop.is_set():
+            stats.subscriber_errors += 1
+    finally:
+        writer.close()
+
+
+async def downloader(port: int, stats: Stats, stop: asyncio.Event):
+    """Downloads random shown objects until stopped, like viewers loading a shared scene"""
+    while not stop.is_set():
+        if not stats.shown:
+            await asyncio.sleep(0.01)
+            continue
+        name = random.choice(stats.shown)
+        start = time.perf_counter()
+        try:
+            reader, writer, status, headers = await _request(port, f'/api/object/{name}')
+            size = 0
+            async for chunk in _read_chunks(reader, headers):
+                size += len(chunk)
+            writer.close()
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            stats.download_errors += 1
+            continue
+        if status == 404:  # Removed meanwhile
+            stats.download_not_found += 1
+        elif status != 200:
+            stats.download_errors += 1
+        else:
+            stats.download_latencies.append(time.perf_counter() - start)
+            stats.downloaded_bytes += size
+
+
+def producer(args: argparse.Namespace, stats: Stats, stop: threading.Event):
+    """Shows and removes objects at a fixed rate, recording when each event was produced"""
+    from build123d import Box
+    from yacv_server import yacv
+    names = [f'obj{i}' for i in range(args.objects)]
+    period = 1 / args.rate
+    next_time = time.perf_counter()
+    counter = 0
+    while not stop.is_set():
+        name = names[counter % len(names)]
+        counter += 1
+        if args.remove_every > 0 and counter % args.remove_every == 0 and name in stats.shown:
+            entry = yacv.scene.get(name)
+            stats.shown = tuple(shown for shown in stats.shown if shown != name)
+            if entry is not None:
+                stats.sent_at[(name, entry.hash, True)] = time.perf_counter()
+                yacv.remove(name)
+        else:
+            obj = Box(1 + counter / 1000, 1, 1)  # Always a new version of the object
+            start = time.perf_counter()
+            yacv.show(obj, names=name, auto_clear=False)
+            stats.sent_at[(name, yacv.scene[name].hash, False)] = start
+            if name not in stats.shown:
+                stats.shown += (name,)
+        stats.sent_events += 1
+        next_time += period
+        stop.wait(max(0.0, next_time - time.perf_counter()))
+
+
+async def sampler(stats: Stats, stop: asyncio.Event):
+    """Tracks the peak thread count and resident memory of the process"""
+    from yacv_server.memory import rss_bytes
+    while not stop.is_set():
+        stats.max_threads = max(stats.max_threads, threading.active_count())
+        stats.max_rss_bytes = max(stats.max_rss_bytes, rss_bytes() or 0)
+        await asyncio.sleep(0.1)
+
+
+async def run(args: argparse.Namespace, port: int) -> Dict[str, Any]:
+    stats = Stats()
+    stop = asyncio.Event()
+    tasks = [asyncio.create_task(sampler(stats, stop))]
+    tasks += [asyncio.create_task(subscriber(port, stats, stop)) for _ in range(args.subscribers)]
+    # Let the subscribers connect before producing events (the server may take a while to accept all of them)
+    from yacv_server import yacv
+    start = time.perf_counter()
+    while yacv.show_events.subscriber_count() < args.subscribers and time.perf_counter() - start < args.warmup:
+        await asyncio.sleep(0.01)
+    subscribe_seconds = time.perf_counter() - start
+    tasks += [asyncio.create_task(downloader(port, stats, stop)) for _ in range(args.downloaders)]
+
+    stop_producer = threading.Event()
+    producer_thread = threading.Thread(target=producer, args=(args, stats, stop_producer), daemon=True)
+    start = time.perf_counter()
+    producer_thread.start()
+    await asyncio.sleep(args.duration)
+    stop_producer.set()
+    await asyncio.get_running_loop().run_in_executor(None, producer_thread.join)
+    await asyncio.sleep(args.drain)  # Let the last events arrive
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Only the events produced during the test count (not those replayed to the subscribers when connecting)
+    latencies = [now - stats.sent_at[key] for key, now in stats.received if key in stats.sent_at]
+    expected = stats.sent_events * stats.connected_subscribers
+    downloads = len(stats.download_latencies)
+    return {
+        'core': args.core,
+        'seconds': elapsed,
+        'events': {
+            'produced': stats.sent_events,
+            'subscribers': stats.connected_subscribers,
+            'subscribe_seconds': subscribe_seconds,
+            'subscriber_errors': stats.subscriber_errors,
+            'expected_deliveries': expected,
+            'deliveries': len(latencies),
+            'delivery_ratio': len(latencies) / expected if expected else None,
+            'deliveries_per_second': len(latencies) / elapsed,
+            'latency_seconds': _percentiles(latencies),
+        },
+        'downloads': {
+            'downloaders': args.downloaders,
+            'completed': downloads,
+            'not_found': stats.download_not_found,
+            'errors': stats.download_errors,
+            'requests_per_second': downloads / elapsed,
+            'bytes_per_second': stats.downloaded_bytes / elapsed,
+            'latency_seconds': _percentiles(stats.download_latencies),
+        },
+        'process': {
+            'max_threads': stats.max_threads,
+            'max_rss_bytes': stats.max_rss_bytes,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--subscribers', type=int, default=100, help='Simulated /api/updates clients (default: 100)')
+    parser.add_argument('--downloaders', type=int, default=10, help='Concurrent /api/object clients (default: 10)')
+    parser.add_argument('--rate', type=float, default=10, help='show()/remove() calls per second (default: 10)')
+    parser.add_argument('--objects', type=int, default=5, help='Distinct object names to cycle through (default: 5)')
+    parser.add_argument('--remove-every', type=int, default=5,
+                        help='Remove instead of show every Nth call, 0 to never remove (default: 5)')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds to produce events for (default: 10)')
+    parser.add_argument('--warmup', type=float, default=30,
+                        help='Maximum seconds to wait for all the subscribers to connect (default: 30)')
+    parser.add_argument('--drain', type=float, default=1,
+                        help='Seconds to wait for the last events after producing them (default: 1)')
+    parser.add_argument('--core', default='threading', choices=['threading', 'asyncio'],
+                        help='The server core to test (default: threading)')
+    parser.add_argument('--output', default=None, help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    port = _free_port()
+    os.environ['YACV_PORT'] = str(port)
+    os.environ['YACV_SERVER_CORE'] = args.core
+    os.environ.setdefault('YACV_GRACEFUL_SECS_CONNECT', '0')
+    import yacv_server  # Starts the server
+    assert yacv_server.yacv.server is not None, 'The server did not start'
+
+    results = asyncio.run(run(args, port))
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.stdout.flush()
+    os._exit(0)  # Do not wait for the server to shut down gracefully
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Benchmarks of showing, building and serving representative CAD workloads (see workloads.py) with yacv_server.
+
+Each workload runs in a fresh subprocess with its own server, so that caches and peak memory are not shared. For each
+one, it measures the time to generate the CAD object, the latency of `show()` and the time of each `export()` phase
+(rebuilding from scratch on each repetition), the GLB size, the peak resident memory and the HTTP throughput of serving
+the built object. The results are printed as a table and written as JSON, to track regressions across commits.
+
+Usage: python benchmarks/run.py [--workloads fillet_part,assembly] [--output results.json] [--help for more options]
+"""
+import argparse
+import concurrent.futures
+import datetime
+import json
+import os
+import platform
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from importlib import metadata
+from typing import Dict, List, Any, Optional, Tuple
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    return {'min': min(values), 'median': statistics.median(values), 'max': max(values)}
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Bytes on macOS, KiB elsewhere
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def _http_throughput(url: str, requests: int, concurrency: int) -> Dict[str, Any]:
+    """Downloads the URL the given number of times from concurrent clients"""
+
+    def download(_: int) -> Tuple[float, int]:
+        start = time.perf_counter()
+        with urllib.request.urlopen(url) as response:
+            size = len(response.read())
+        return time.perf_counter() - start, size
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(download, range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies = [latency for latency, _ in results]
+    total_bytes = sum(size for _, size in results)
+    return {'requests': requests, 'concurrency': concurrency, 'seconds': elapsed,
+            'requests_per_second': requests / elapsed, 'bytes_per_second': total_bytes / elapsed,
+            'latency_p50': _percentile(latencies, 0.5), 'latency_p95': _percentile(latencies, 0.95)}
+
+
+def run_worker(workload: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """Runs a single workload in this process, which must not have imported yacv_server yet"""
+    port = _free_port()
+    os.environ['YACV_PORT'] = str(port)
+    os.environ['YACV_SERVER_CORE'] = args.core
+    os.environ.setdefault('YACV_GRACEFUL_SECS_CONNECT', '0')
+    from workloads import WORKLOADS
+    from yacv_server import yacv
+    from yacv_server.metrics import metrics
+
+    start = time.perf_counter()
+    obj = WORKLOADS[workload](args.scale)
+    generate_seconds = time.perf_counter() - start
+
+    show_seconds, show_phases, export_seconds, export_phases = [], [], [], []
+    glb_size = 0
+    for _ in range(args.repeat):
+        yacv.remove(workload)  # Forget the previous build to measure it again
+        with metrics.timings() as timings:
+            start = time.perf_counter()
+            yacv.show(obj, names=workload, auto_clear=False)
+            show_seconds.append(time.perf_counter() - start)
+        show_phases.append(timings)
+        with metrics.timings() as timings:
+            start = time.perf_counter()
+            glb, _ = yacv.export(workload)
+            export_seconds.append(time.perf_counter() - start)
+        export_phases.append(timings)
+        glb_size = len(glb)
+
+    url = f'http://localhost:{port}/api/object/{workload}'
+    http = _http_throughput(url, args.requests, args.concurrency)
+
+    phases = sorted({phase for timings in show_phases + export_phases for phase in timings})
+    return {
+        'workload': workload,
+        'scale': args.scale,
+        'faces': len(obj.faces()),
+        'generate_seconds': generate_seconds,
+        'show_seconds': _summary(show_seconds),
+        'export_seconds': _summary(export_seconds),
+        'phase_seconds': {phase: _summary([timings[phase] for timings in show_phases + export_phases
+                                           if phase in timings]) for phase in phases},
+        'glb_bytes': glb_size,
+        'peak_rss_bytes': _peak_rss_bytes(),
+        'http': http,
+    }
+
+
+def _environment() -> Dict[str, Optional[str]]:
+    """Describes where the benchmarks ran, to only compare comparable results"""
+
+    def version(package: str) -> Optional[str]:
+        try:
+            return metadata.version(package)
+        except metadata.PackageNotFoundError:
+            return None
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BENCHMARKS_DIR, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': str(os.cpu_count()),
+        'yacv_server': version('yacv-server'),
+        'build123d': version('build123d'),
+        'ocp': version('cadquery-ocp') or version('cadquery-ocp-novtk'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workloads', default=None,
+                        help='Comma-separated workloads to run (default: all, see workloads.py)')
+    parser.add_argument('--scale', type=int, default=1, help='Size multiplier of the workloads (default: 1)')
+    parser.add_argument('--repeat', type=int, default=3, help='Builds of each workload (default: 3)')
+    parser.add_argument('--requests', type=int, default=200, help='HTTP downloads of each object (default: 200)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent HTTP clients (default: 8)')
+    parser.add_argument('--core', default='threading', choices=['threading', 'asyncio'],
+                        help='The server core to benchmark (default: threading)')
+    parser.add_argument('--output', default='benchmark-results.json', help='The JSON file to write the results to')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)  # Internal: run one workload in this process
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        json.dump(run_worker(args.worker, args), sys.stdout)
+        sys.stdout.flush()
+        os._exit(0)  # Do not wait for the server to shut down gracefully
+
+    from workloads import WORKLOADS  # Also checks that build123d is available before spawning the workers
+    names = args.workloads.split(',') if args.workloads else list(WORKLOADS)
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown:
+        parser.error(f'Unknown workloads: {", ".join(unknown)}')
+
+    results = []
+    for name in names:
+        print(f'Running {name}...', file=sys.stderr)
+        with tempfile.TemporaryFile('w+') as stderr:
+            worker = subprocess.run([sys.executable, __file__, '--worker', name, '--scale', str(args.scale),
+                                     '--repeat', str(args.repeat), '--requests', str(args.requests),
+                                     '--concurrency', str(args.concurrency), '--core', args.core],
+                                    cwd=BENCHMARKS_DIR, stdout=subprocess.PIPE, stderr=stderr, text=True)
+            if worker.returncode != 0:
+                stderr.seek(0)
+                sys.exit(f'Workload {name} failed:\n{stderr.read()}')
+        results.append(json.loads(worker.stdout))
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': _environment(), 'core': args.core, 'results': results}, f, indent=2)
+
+    print(f'{"workload":<16}{"faces":>8}{"show s":>10}{"export s":>10}{"GLB KiB":>10}{"peak MiB":>10}{"req/s":>10}')
+    for result in results:
+        print(f'{result["workload"]:<16}{result["faces"]:>8}{result["show_seconds"]["median"]:>10.3f}'
+              f'{result["export_seconds"]["median"]:>10.3f}{result["glb_bytes"] / 1024:>10.1f}'
+              f'{result["peak_rss_bytes"] / 1024 / 1024:>10.1f}{result["http"]["requests_per_second"]:>10.1f}')
+    print(f'Results written to {args.output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Representative CAD workloads for the benchmarks, each a function of a scale factor (1 is the default size)."""
+import math
+from typing import Callable, Dict
+
+from build123d import *
+from build123d import Shape
+
+
+def fillet_part(scale: int = 1) -> Part:
+    """A plate with a grid of rounded bosses, with all their top and bottom edges filleted (many small faces)"""
+    with BuildPart() as part:
+        Box(12 * 5 * scale, 40, 10)
+        with BuildSketch(part.faces().sort_by(Axis.Z)[-1]):
+            with GridLocations(10, 10, 5 * scale, 3):
+                RectangleRounded(6, 6, 1)
+        extrude(amount=4)
+        fillet(part.edges().group_by(Axis.Z)[-1], 0.8)
+        fillet(part.edges().group_by(Axis.Z)[0], 1)
+    return part.part
+
+
+def text_engraving(scale: int = 1) -> Part:
+    """A plate with engraved text (many B-spline faces)"""
+    with BuildPart() as part:
+        Box(120 * scale, 30, 5)
+        with BuildSketch(part.faces().sort_by(Axis.Z)[-1]):
+            Text(' '.join(['Yet Another CAD Viewer'] * scale), 8)
+        extrude(amount=-1, mode=Mode.SUBTRACT)
+    return part.part
+
+
+def hole_plate(scale: int = 1) -> Part:
+    """A plate with a dense pattern of holes (many cylindrical faces sharing a huge planar face)"""
+    count = 8 * scale
+    with BuildPart() as part:
+        Box(25 * count, 25 * count, 5)
+        with GridLocations(25, 25, count, count):
+            Hole(2.5)
+    return part.part
+
+
+def assembly(scale: int = 1) -> Compound:
+    """An assembly of many located copies of the same bolt-like part (shared geometry, many instances)"""
+    bolt = Cylinder(2, 10) + Cylinder(3.5, 2, align=(Align.CENTER, Align.CENTER, Align.MAX))
+    count = 20 * scale
+    return Compound(children=[bolt.moved(Location((x * 10, y * 10, 0))) for x in range(count) for y in range(count)])
+
+
+def dense_mesh(scale: int = 1) -> Shell:
+    """A sphere made of independent triangular faces, like a mesh imported from STL (thousands of planar faces)"""
+    n = 40 * scale
+
+    def point(i: int, j: int):
+        theta, phi = math.pi * i / n, 2 * math.pi * j / n
+        return 20 * math.sin(theta) * math.cos(phi), 20 * math.sin(theta) * math.sin(phi), 20 * math.cos(theta)
+
+    faces = []
+    for i in range(n):
+        for j in range(n):
+            a, b, c, d = point(i, j), point(i + 1, j), point(i + 1, j + 1), point(i, j + 1)
+            if i > 0:  # Skip the degenerate triangles at the poles
+                faces.append(Face(Wire.make_polygon([a, b, d], close=True)))
+            if i < n - 1:
+                faces.append(Face(Wire.make_polygon([b, c, d], close=True)))
+    return Shell(faces)
+
+
+WORKLOADS: Dict[str, Callable[[int], Shape]] = {
+    'fillet_part': fillet_part,
+    'text_engraving': text_engraving,
+    'hole_plate': hole_plate,
+    'assembly': assembly,
+    'dense_mesh': dense_mesh,
+}
+"""All the workloads by name, in the order they are run"""
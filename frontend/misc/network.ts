@@ -17,6 +17,13 @@ export class NetworkUpdateEventModel {
     }
 }
 
+/** A show event as sent by the updates API of the server */
+interface UpdatesApiData {
+    name: string;
+    hash: string;
+    is_remove: boolean | null;
+}
+
 export class NetworkUpdateEvent extends Event {
     models: NetworkUpdateEventModel[];
     disconnect: () => void;
@@ -37,14 +44,19 @@ export class NetworkManager extends EventTarget {
     /**
      * Tries to load a new model (.glb) from the given URL.
      *
-     * If the URL uses the websocket protocol (ws:// or wss://), the server will be continuously monitored for changes.
-     * In this case, it will only trigger updates if the name or hash of any model changes.
+     * If the URL starts with "dev+", the server will be continuously monitored for changes. In this case, it will only
+     * trigger updates if the name or hash of any model changes. Using the websocket protocol (dev+ws://host/api/ws or
+     * dev+wss://...) avoids a round trip per model if ?glb=1 is added, as the server then pushes the models directly.
      *
      * Updates will be emitted as "update" events, including the download URL and the model name.
      */
     async load(url: string | Blob) {
         if (!(url instanceof Blob) && (url.startsWith("dev+") || url.startsWith("dev "))) {
             let baseUrl = new URL(url.slice(4));
+            if (baseUrl.protocol === "ws:" || baseUrl.protocol === "wss:") {
+                await this.monitorDevServerWebSocket(baseUrl);
+                return;
+            }
             baseUrl.searchParams.set("api_updates", "true");
             await this.monitorDevServer(baseUrl);
         } else {
@@ -79,26 +91,39 @@ export class NetworkManager extends EventTarget {
     }
 
     private async monitorDevServer(url: URL, stop: () => boolean = () => false) {
+        let lastEventId: string | null = null; // To only receive missed events after reconnecting
         while (!stop()) {
             let monitorEveryMs = (await settings).monitorEveryMs;
             try {
                 // WARNING: This will spam the console logs with failed requests when the server is down
                 const controller = new AbortController();
-                let response = await fetch(url.toString(), {signal: controller.signal});
+                let monitorUrl = new URL(url);
+                // Same as the Last-Event-ID header, but avoids CORS preflight requests
+                if (lastEventId !== null) monitorUrl.searchParams.set("last_event_id", lastEventId);
+                let response = await fetch(monitorUrl.toString(), {signal: controller.signal});
                 // console.log("Monitoring", url.toString(), response);
                 if (response.status === 200) {
                     let lines = readLinesStreamings(response.body!.getReader());
+                    let eventId: string | null = null;
                     for await (let line of lines) {
                         if (stop()) break;
+                        if (line && line.startsWith("id:")) eventId = line.slice(3).trim();
                         if (!line || !line.startsWith("data:")) continue;
-                        let data: { name: string, hash: string, is_remove: boolean | null } = JSON.parse(line.slice(5));
+                        let data: UpdatesApiData | { version: number, batch: UpdatesApiData[] } = JSON.parse(line.slice(5));
+                        if (eventId !== null) lastEventId = eventId;
                         // console.debug("WebSocket message", data);
-                        let urlObj = new URL(url);
-                        urlObj.searchParams.delete("api_updates");
-                        urlObj.searchParams.set("api_object", data.name);
-                        this.foundModel(data.name, data.hash, urlObj.toString(), data.is_remove, async () => {
-                            controller.abort(); // Notify the server that we are done
-                        });
+                        // Each message (a single event or a batch) is a complete transaction of the server, so there is
+                        // no need to wait for more updates after its last event
+                        let batch = "batch" in data ? data.batch : [data];
+                        for (let i = 0; i < batch.length; i++) {
+                            let model = batch[i];
+                            let urlObj = new URL(url);
+                            urlObj.searchParams.delete("api_updates");
+                            urlObj.searchParams.set("api_object", model.name);
+                            this.foundModel(model.name, model.hash, urlObj.toString(), model.is_remove, async () => {
+                                controller.abort(); // Notify the server that we are done
+                            }, i === batch.length - 1);
+                        }
                     }
                 } else {
                     // Server is down, wait a little longer before retrying
@@ -111,8 +136,61 @@ export class NetworkManager extends EventTarget {
         }
     }
 
+    private async monitorDevServerWebSocket(url: URL, stop: () => boolean = () => false) {
+        let lastEventId: string | null = null; // To only receive missed events after reconnecting
+        let pushedModels: { [name: string]: { hash: string, glb: Blob } } = {}; // Sent before their update events
+        let objectUrl = new URL(url); // To download models that were not pushed
+        objectUrl.protocol = url.protocol === "wss:" ? "https:" : "http:";
+        objectUrl.pathname = objectUrl.pathname.replace(/api\/ws$/, "");
+        objectUrl.search = "";
+        while (!stop()) {
+            let monitorEveryMs = (await settings).monitorEveryMs;
+            let monitorUrl = new URL(url);
+            if (lastEventId !== null) monitorUrl.searchParams.set("last_event_id", lastEventId);
+            await new Promise<void>(resolve => {
+                let ws = new WebSocket(monitorUrl.toString());
+                ws.binaryType = "arraybuffer";
+                ws.onmessage = (msg: MessageEvent) => {
+                    if (stop()) return ws.close();
+                    if (msg.data instanceof ArrayBuffer) {
+                        // Pushed model: uint32 header length, JSON header and GLB
+                        let headerLength = new DataView(msg.data).getUint32(0);
+                        let header = JSON.parse(new TextDecoder().decode(new Uint8Array(msg.data, 4, headerLength)));
+                        let glb = new Blob([new Uint8Array(msg.data, 4 + headerLength)], {type: "model/gltf-binary"});
+                        pushedModels[header.name] = {hash: header.hash, glb: glb};
+                        return;
+                    }
+                    let message: { id: string, data: UpdatesApiData | { version: number, batch: UpdatesApiData[] } } =
+                        JSON.parse(msg.data);
+                    lastEventId = message.id;
+                    // Like the updates stream, each message is a complete transaction of the server
+                    let batch = "batch" in message.data ? message.data.batch : [message.data];
+                    for (let i = 0; i < batch.length; i++) {
+                        let model = batch[i];
+                        let modelUrl: string | Blob;
+                        let pushed = pushedModels[model.name];
+                        if (model.is_remove === false && pushed && pushed.hash === model.hash) {
+                            modelUrl = pushed.glb;
+                        } else {
+                            let urlObj = new URL(objectUrl);
+                            urlObj.searchParams.set("api_object", model.name);
+                            modelUrl = urlObj.toString();
+                        }
+                        if (model.is_remove !== false) delete pushedModels[model.name];
+                        this.foundModel(model.name, model.hash, modelUrl, model.is_remove, () => {
+                            ws.close(); // Notify the server that we are done
+                        }, i === batch.length - 1);
+                    }
+                };
+                ws.onclose = () => resolve();
+                ws.onerror = () => ws.close(); // Retry soon
+            });
+            await new Promise(resolve => setTimeout(resolve, monitorEveryMs));
+        }
+    }
+
     private foundModel(name: string, hash: string | null, url: string | Blob, isRemove: boolean | null, disconnect: () => void = () => {
-    }) {
+    }, endOfBatch: boolean = false) {
         // console.debug("Found model", name, "with hash", hash, "at", url, "isRemove", isRemove);
 
         // We only care about the latest update per model name
@@ -123,37 +201,42 @@ export class NetworkManager extends EventTarget {
         this.bufferedUpdates.push(upd);
         this.dispatchEvent(new CustomEvent("update-early", {detail: this.bufferedUpdates}));
 
-        // Optimization: try to batch updates automatically for faster rendering
+        // Optimization: try to batch updates automatically for faster rendering (unless the server marked the end)
         if (this.batchTimeout !== null) clearTimeout(this.batchTimeout);
-        this.batchTimeout = setTimeout(() => {
-            // Update known hashes for minimal updates
-            for (let model of this.bufferedUpdates) {
-                if (model.isRemove == false && model.hash && model.hash === this.knownObjectHashes[model.name]) {
-                    // Delete this useless update
-                    let foundFirst = false;
-                    this.bufferedUpdates = this.bufferedUpdates.filter(m => {
-                        if (m === model) {
-                            if (!foundFirst) { // Remove only first full match
-                                foundFirst = true;
-                                return false;
-                            }
+        this.batchTimeout = null;
+        if (endOfBatch) this.dispatchUpdates(disconnect);
+        else this.batchTimeout = setTimeout(() => this.dispatchUpdates(disconnect), batchTimeout);
+    }
+
+    private dispatchUpdates(disconnect: () => void) {
+        this.batchTimeout = null;
+        // Update known hashes for minimal updates
+        for (let model of this.bufferedUpdates) {
+            if (model.isRemove == false && model.hash && model.hash === this.knownObjectHashes[model.name]) {
+                // Delete this useless update
+                let foundFirst = false;
+                this.bufferedUpdates = this.bufferedUpdates.filter(m => {
+                    if (m === model) {
+                        if (!foundFirst) { // Remove only first full match
+                            foundFirst = true;
+                            return false;
                         }
-                        return true;
-                    })
-                } else {
-                    // Keep this update and update the last known hash
-                    if (model.isRemove == true) {
-                        if (model.name in this.knownObjectHashes) delete this.knownObjectHashes[model.name];
-                    } else if (model.isRemove == false) {
-                        this.knownObjectHashes[model.name] = model.hash;
                     }
+                    return true;
+                })
+            } else {
+                // Keep this update and update the last known hash
+                if (model.isRemove == true) {
+                    if (model.name in this.knownObjectHashes) delete this.knownObjectHashes[model.name];
+                } else if (model.isRemove == false) {
+                    this.knownObjectHashes[model.name] = model.hash;
                 }
             }
+        }
 
-            // Dispatch the event to actually update the models
-            this.dispatchEvent(new NetworkUpdateEvent(this.bufferedUpdates, disconnect));
-            this.bufferedUpdates = [];
-        }, batchTimeout);
+        // Dispatch the event to actually update the models
+        this.dispatchEvent(new NetworkUpdateEvent(this.bufferedUpdates, disconnect));
+        this.bufferedUpdates = [];
     }
 }
 
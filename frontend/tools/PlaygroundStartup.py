@@ -74,6 +74,12 @@ await bootstrap(
 )
 
 # Preimport the yacv_server package to ensure it is available in the global scope, and mock the ocp_vscode package.
+# Revision 2 of the STDERR protocol avoids resending unchanged models and splits big ones in chunks (older
+# yacv_server versions ignore it and keep using revision 1, which is also supported by the frontend).
+import os
+
+os.environ.setdefault("YACV_STDERR_PROTOCOL", "2")
+
 from yacv_server import *
 
 micropip.add_mock_package(
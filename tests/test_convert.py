@@ -0,0 +1,22 @@
+import os
+
+os.environ.setdefault('YACV_DISABLE_SERVER', '1')
+
+from yacv_server import convert
+from yacv_server.convert import CADFileCache
+from yacv_server.yacv import YACV
+
+
+def test_cad_file_hash_covers_version_and_default_style(tmp_path, monkeypatch):
+    path = tmp_path / 'part.step'
+    path.write_text('not parsed')
+    cache = CADFileCache(str(tmp_path / 'cache'))
+    options = YACV()._tessellate_options({'tolerance': 0.1})
+    _hash = cache.hash(str(path), options)
+    assert cache.hash(str(path), dict(options)) == _hash
+
+    monkeypatch.setenv('YACV_COLOR_FACES', '#ff0000')
+    assert cache.hash(str(path), YACV()._tessellate_options({'tolerance': 0.1})) != _hash
+
+    monkeypatch.setattr(convert, 'get_version', lambda: 'other')
+    assert cache.hash(str(path), options) != _hash
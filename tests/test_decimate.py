@@ -0,0 +1,100 @@
+import os
+
+os.environ.setdefault('YACV_DISABLE_SERVER', '1')
+
+import numpy as np
+from build123d import Compound, Cylinder, Pos, Sphere
+
+from yacv_server import decimate
+from yacv_server.gltf import GLTFMgr
+from yacv_server.tessellate import _mesh_faces, _tessellate_face
+
+
+def _mgr() -> GLTFMgr:
+    """The finely meshed faces of a cylinder (two planar caps and a periodic side) and a sphere (with a seam)"""
+    faces = Compound([Cylinder(10, 20), Pos(40, 0, 0) * Sphere(10)]).faces()
+    _mesh_faces([face.wrapped for face in faces], [0.01] * len(faces), 0.05, False, None)
+    mgr = GLTFMgr()
+    for face in faces:
+        _tessellate_face(mgr, face.wrapped, (1.0, 1.0, 1.0, 1.0))
+    return mgr
+
+
+def _mesh(mgr: GLTFMgr):
+    positions = np.array(mgr.face_positions).reshape(-1, 3)
+    triangles = np.array(mgr.face_indices).reshape(-1, 3)
+    triangles_end = np.array(mgr._faces_primitive.extras['face_triangles_end']) // 3
+    return positions, triangles, triangles_end
+
+
+def _points(positions: np.ndarray, vertices: np.ndarray) -> set:
+    return {tuple(point) for point in positions[vertices.ravel()]}
+
+
+def _non_degenerate(positions: np.ndarray, triangles: np.ndarray) -> np.ndarray:
+    p0, p1, p2 = (positions[triangles[:, k]] for k in range(3))
+    return np.any(p0 != p1, axis=1) & np.any(p1 != p2, axis=1) & np.any(p2 != p0, axis=1)
+
+
+def _boundary_vertices(triangles: np.ndarray) -> np.ndarray:
+    """The vertices of the edges used by a single triangle (the boundary and seam of a face)"""
+    a, b = triangles.ravel(), triangles[:, [1, 2, 0]].ravel()
+    keys, counts = np.unique(np.stack([np.minimum(a, b), np.maximum(a, b)], axis=1), axis=0, return_counts=True)
+    return np.unique(keys[counts == 1])
+
+
+def test_gltf_decimate_respects_budget_and_faces():
+    mgr = _mgr()
+    original_positions, original_triangles, original_end = _mesh(mgr)
+    budget = len(original_triangles) // 5
+    mgr.decimate(budget)
+    positions, triangles, triangles_end = _mesh(mgr)
+
+    assert 0 < len(triangles) <= budget
+    assert len(positions) == len(mgr.face_normals) // 3 == len(mgr.face_tex_coords) // 2 == len(mgr.face_colors) // 4
+    assert np.all(np.diff(triangles_end, prepend=0) >= 0) and triangles_end[-1] == len(triangles)
+    assert set(np.unique(triangles)) == set(range(len(positions)))  # Unused vertices were dropped
+    # Vertices are only removed, never moved
+    assert _points(positions, np.arange(len(positions))) <= _points(original_positions, original_triangles)
+
+    # Each face keeps its own vertices, and the vertices of its boundary (and seam) stay on it
+    original_starts = np.concatenate([[0], original_end[:-1]])
+    starts = np.concatenate([[0], triangles_end[:-1]])
+    assert len(starts) == len(original_starts)
+    for start, end, original_start, original_end in zip(starts, triangles_end, original_starts, original_end):
+        face_points = _points(positions, triangles[start:end])
+        face_original_triangles = original_triangles[original_start:original_end]
+        # Except for the degenerate triangles at the poles of the sphere, which are dropped
+        face_original_triangles = face_original_triangles[_non_degenerate(original_positions, face_original_triangles)]
+        assert face_points <= _points(original_positions, face_original_triangles)
+        boundary = _points(positions, _boundary_vertices(triangles[start:end]))
+        assert boundary <= _points(original_positions, _boundary_vertices(face_original_triangles))
+
+    # The faces are still stitched together: every welded edge has exactly two triangles
+    _, welded = np.unique(positions.round(9), axis=0, return_inverse=True)
+    welded_triangles = welded.reshape(-1)[triangles]
+    a, b = welded_triangles.ravel(), welded_triangles[:, [1, 2, 0]].ravel()
+    _, counts = np.unique(np.minimum(a, b) * len(positions) + np.maximum(a, b), return_counts=True)
+    assert np.all(counts == 2)
+
+
+def test_decimate_keeps_face_order():
+    positions, triangles, triangles_end = _mesh(_mgr())
+    face_ids = np.repeat(np.arange(len(triangles_end)), np.diff(triangles_end, prepend=0))
+    new_triangles, new_face_ids = decimate.decimate(positions, triangles, face_ids, len(triangles) // 2)
+    assert len(new_triangles) == len(new_face_ids) <= len(triangles) // 2
+    assert np.all(np.diff(new_face_ids) >= 0)
+    assert set(new_face_ids) == set(face_ids)
+
+
+def test_decimate_skips_passes_with_rejected_collapses(monkeypatch):
+    positions, triangles, triangles_end = _mesh(_mgr())
+    face_ids = np.repeat(np.arange(len(triangles_end)), np.diff(triangles_end, prepend=0))
+    # Some collapse is rejected in every check round, so no pass is ever validated
+    monkeypatch.setattr(decimate, '_bad_collapses',
+                        lambda positions, triangles, new_triangles, welded, target_of:
+                        np.nonzero(target_of >= 0)[0][:1])
+    monkeypatch.setattr(decimate, '_MAX_PASSES', 5)
+    new_triangles, new_face_ids = decimate.decimate(positions, triangles, face_ids, len(triangles) // 2)
+    assert np.array_equal(new_triangles, triangles)
+    assert np.array_equal(new_face_ids, face_ids)
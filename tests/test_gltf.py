@@ -0,0 +1,120 @@
+import os
+
+os.environ.setdefault('YACV_DISABLE_SERVER', '1')
+
+import base64
+import json
+
+import pytest
+
+from yacv_server.gltf import GLBSceneComposer, _glb_load, _glb_load_single_buffer, _glb_pack, _remap_indices
+
+
+def _glb(doc: dict, blob: bytes = b'') -> bytes:
+    return _glb_pack(json.dumps(doc).encode('utf-8'), blob)
+
+
+def _object_glb(data: bytes, accessors: int = 1) -> bytes:
+    """A GLB with a node, whose mesh has a primitive for each accessor of (a slice of) the data"""
+    return _glb({
+        'scene': 0, 'scenes': [{'nodes': [0]}],
+        'nodes': [{'mesh': 0}],
+        'meshes': [{'primitives': [{'attributes': {'POSITION': i}} for i in range(accessors)]}],
+        'accessors': [{'bufferView': i, 'count': 1} for i in range(accessors)],
+        'bufferViews': [{'buffer': 0, 'byteOffset': i * len(data) // accessors, 'byteLength': len(data) // accessors}
+                        for i in range(accessors)],
+        'buffers': [{'byteLength': len(data)}],
+    }, data)
+
+
+def _object_data(glb: bytes, name: str) -> bytes:
+    """The data of every primitive of the node of an object in a composed scene"""
+    doc, blob = _glb_load(glb)
+    node = next(node for node in doc['nodes'] if node.get('name') == name)
+    data = b''
+    for child in node['children']:
+        for primitive in doc['meshes'][doc['nodes'][child]['mesh']]['primitives']:
+            view = doc['bufferViews'][doc['accessors'][primitive['attributes']['POSITION']]['bufferView']]
+            data += blob[view['byteOffset']:view['byteOffset'] + view['byteLength']]
+    return data
+
+
+def test_remap_indices():
+    doc = {
+        'scenes': [{'nodes': [0]}],
+        'nodes': [{'children': [1], 'mesh': 0}, {'skin': 0, 'camera': 0}],
+        'meshes': [{'primitives': [{'attributes': {'POSITION': 0}, 'indices': 1, 'material': 0,
+                                    'targets': [{'POSITION': 2}]}]}],
+        'accessors': [{'bufferView': 0}, {'bufferView': 1, 'sparse': {'indices': {'bufferView': 2},
+                                                                      'values': {'bufferView': 3}}}],
+        'bufferViews': [{'byteOffset': 4}, {}],
+        'materials': [{'pbrMetallicRoughness': {'baseColorTexture': {'index': 0}}, 'normalTexture': {'index': 1}}],
+        'textures': [{'source': 0, 'sampler': 0}],
+        'images': [{'bufferView': 1}],
+        'skins': [{'inverseBindMatrices': 0, 'skeleton': 0, 'joints': [0, 1]}],
+        'animations': [{'channels': [{'target': {'node': 1}}], 'samplers': [{'input': 0, 'output': 1}]}],
+    }
+    base = {'nodes': 10, 'meshes': 20, 'accessors': 30, 'bufferViews': 40, 'materials': 50, 'textures': 60,
+            'images': 70, 'samplers': 80, 'skins': 90, 'cameras': 100}
+    doc = _remap_indices(doc, base, 1000)
+    assert doc['scenes'] == [{'nodes': [10]}]
+    assert doc['nodes'] == [{'children': [11], 'mesh': 20}, {'skin': 90, 'camera': 100}]
+    assert doc['meshes'][0]['primitives'] == [{'attributes': {'POSITION': 30}, 'indices': 31, 'material': 50,
+                                               'targets': [{'POSITION': 32}]}]
+    assert doc['accessors'] == [{'bufferView': 40}, {'bufferView': 41, 'sparse': {'indices': {'bufferView': 42},
+                                                                                  'values': {'bufferView': 43}}}]
+    assert doc['bufferViews'] == [{'byteOffset': 1004}, {'byteOffset': 1000}]
+    assert doc['materials'] == [{'pbrMetallicRoughness': {'baseColorTexture': {'index': 60}},
+                                 'normalTexture': {'index': 61}}]
+    assert doc['textures'] == [{'source': 70, 'sampler': 80}]
+    assert doc['images'] == [{'bufferView': 41}]
+    assert doc['skins'] == [{'inverseBindMatrices': 30, 'skeleton': 10, 'joints': [10, 11]}]
+    assert doc['animations'] == [{'channels': [{'target': {'node': 11}}], 'samplers': [{'input': 30, 'output': 31}]}]
+
+
+def test_glb_load_single_buffer():
+    embedded = b'xyz'
+    glb = _glb({
+        'buffers': [{'byteLength': 5}, {'byteLength': 3,
+                                        'uri': 'data:application/octet-stream;base64,' +
+                                               base64.b64encode(embedded).decode()}],
+        'bufferViews': [{'buffer': 0, 'byteOffset': 1, 'byteLength': 4}, {'buffer': 1, 'byteLength': 3}],
+    }, b'abcde')
+    doc, blob = _glb_load_single_buffer(glb)
+    assert blob[:5] == b'abcde' and blob[8:] == embedded  # Each buffer is aligned to 4 bytes
+    assert 'buffers' not in doc
+    assert doc['bufferViews'] == [{'buffer': 0, 'byteOffset': 1, 'byteLength': 4},
+                                  {'buffer': 0, 'byteOffset': 8, 'byteLength': 3}]
+
+    with pytest.raises(ValueError):
+        _glb_load_single_buffer(_glb({'buffers': [{'byteLength': 1, 'uri': 'external.bin'}]}))
+
+
+def test_compose_partial_update():
+    composer = GLBSceneComposer()
+    data = {'a': b'a' * 6, 'b': b'b' * 8, 'c': b'c' * 12}
+    objects = [(name, name, _object_glb(value)) for name, value in data.items()]
+    glb, _hash = composer.compose(objects)
+    doc, _ = _glb_load(glb)
+    assert [doc['nodes'][i]['name'] for i in doc['scenes'][0]['nodes']] == ['a', 'b', 'c']
+    assert all(_object_data(glb, name) == value for name, value in data.items())
+    assert composer.compose(objects) == (glb, _hash)
+
+    # Changing the first object moves the references of all the others
+    data['a'] = b'A' * 10
+    objects[0] = ('a', 'A', _object_glb(data['a'], accessors=2))
+    glb, new_hash = composer.compose(objects)
+    assert new_hash != _hash
+    doc, blob = _glb_load(glb)
+    assert [doc['nodes'][i]['name'] for i in doc['scenes'][0]['nodes']] == ['a', 'b', 'c']
+    assert len(doc['accessors']) == len(doc['bufferViews']) == 4
+    assert doc['buffers'] == [{'byteLength': len(blob)}]
+    assert all(_object_data(glb, name) == value for name, value in data.items())
+
+    # Removing one and adding another
+    data['d'] = b'd' * 4
+    del data['b']
+    glb, _ = composer.compose([objects[0], objects[2], ('d', 'd', _object_glb(data['d']))])
+    doc, _ = _glb_load(glb)
+    assert [doc['nodes'][i]['name'] for i in doc['scenes'][0]['nodes']] == ['a', 'c', 'd']
+    assert all(_object_data(glb, name) == value for name, value in data.items())
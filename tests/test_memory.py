@@ -0,0 +1,26 @@
+import os
+
+os.environ.setdefault('YACV_DISABLE_SERVER', '1')
+
+from yacv_server import memory
+from yacv_server.memory import GLBCache
+
+
+def test_rss_budget_evicts_only_what_helps(monkeypatch):
+    reads = []
+    monkeypatch.setattr(memory, 'rss_bytes', lambda: reads.append(1) or rss)
+    cache = GLBCache(max_rss=1000)
+    rss = 900
+    for name in 'abcd':
+        cache.put(name, 'hash', b'x' * 100)
+    assert len(cache) == 4
+
+    rss = 1150  # Evicting the two oldest GLBs is enough
+    reads.clear()
+    cache.put('e', 'hash', b'x' * 100)
+    assert [name for name in 'abcde' if cache.get(name, 'hash') is not None] == ['c', 'd', 'e']
+    assert len(reads) == 1
+
+    rss = 5000  # Mostly other memory, evicting everything would not help
+    cache.put('f', 'hash', b'x' * 100)
+    assert len(cache) == 4
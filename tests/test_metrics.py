@@ -0,0 +1,72 @@
+import os
+
+os.environ.setdefault('YACV_DISABLE_SERVER', '1')
+
+import gc
+import threading
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+from build123d import Box
+
+from yacv_server.metrics import metrics
+from yacv_server.myasynchttp import AsyncHTTPServer
+from yacv_server.myhttp import HTTPHandler, METRICS_CONTENT_TYPE
+from yacv_server.yacv import YACV
+
+
+def test_gauges_add_up_live_instances():
+    first, second = YACV(), YACV()
+    base = metrics.stats()['yacv_scene_objects']
+    first.show(Box(1, 1, 1), names='a')
+    second.show(Box(1, 1, 1), Box(2, 2, 2), names=['a', 'b'])
+    assert metrics.stats()['yacv_scene_objects'] == base + 3
+
+    del second
+    gc.collect()
+    assert metrics.stats()['yacv_scene_objects'] == base + 1
+    assert first.stats()['yacv_scene_objects'] == base + 1
+
+
+def test_stats():
+    yacv = YACV()
+    shows = yacv.stats().get('yacv_shows_total', 0)
+    yacv.show(Box(1, 1, 1), names='a')
+    misses = yacv.glb_cache.misses
+    yacv.export('a')
+    yacv.export('a')
+    stats = yacv.stats()
+    assert stats['yacv_shows_total'] == shows + 1
+    assert stats['yacv_glb_cache_misses_total'] >= misses + 1
+    assert stats['yacv_glb_cache_hits_total'] >= 1
+    hashcode = stats['yacv_phase_seconds{phase="hashcode"}']
+    assert hashcode['count'] >= 1 and hashcode['buckets']['+Inf'] == hashcode['count']
+    assert stats['yacv_resident_memory_bytes'] > 0
+
+
+@pytest.mark.parametrize('core', ['threading', 'asyncio'])
+def test_api_metrics(core):
+    yacv = YACV()
+    yacv.show(Box(1, 1, 1), names='a')
+    yacv.export('a')
+    if core == 'asyncio':
+        server = AsyncHTTPServer(('localhost', 0), yacv=yacv)
+    else:
+        server = ThreadingHTTPServer(('localhost', 0), lambda a, b, c: HTTPHandler(a, b, c, yacv=yacv))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with urllib.request.urlopen(f'http://localhost:{server.server_port}/api/metrics', timeout=10) as response:
+            assert response.headers['Content-Type'] == METRICS_CONTENT_TYPE
+            text = response.read().decode('utf-8')
+    finally:
+        server.shutdown()
+        thread.join(10)
+    lines = text.splitlines()
+    assert '# TYPE yacv_scene_objects gauge' in lines
+    assert '# HELP yacv_glb_cache_bytes Total size of the GLB cache' in lines
+    assert '# TYPE yacv_phase_seconds histogram' in lines
+    assert 'yacv_phase_seconds_bucket{phase="hashcode",le="+Inf"}' in {line.rsplit(' ', 1)[0] for line in lines}
+    scene_objects = next(line for line in lines if line.startswith('yacv_scene_objects '))
+    assert int(scene_objects.split()[1]) >= 1
@@ -0,0 +1,25 @@
+import os
+
+os.environ.setdefault('YACV_DISABLE_SERVER', '1')
+
+from yacv_server.pubsub import BufferedPubSub
+
+
+def test_big_batch_to_caught_up_subscriber():
+    pubsub = BufferedPubSub(max_pending=3)
+    subscription = pubsub.subscribe(include_buffered=False, yield_timeout=0, batched=True)
+    assert next(subscription) is None  # Subscribed, nothing pending
+    events = [object() for _ in range(pubsub.max_pending + 1)]
+    pubsub.publish_many(events)
+    assert [event for _, event in next(subscription)] == events
+    assert next(subscription) is None  # Still connected
+    subscription.close()
+
+
+def test_lagging_subscriber_is_disconnected():
+    pubsub = BufferedPubSub(max_pending=3)
+    subscription = pubsub.subscribe(include_buffered=False, yield_timeout=0, batched=True)
+    assert next(subscription) is None
+    pubsub.publish_many([object() for _ in range(pubsub.max_pending + 1)])
+    pubsub.publish(object())  # Before reading the previous batch
+    assert list(subscription) == []
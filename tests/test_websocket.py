@@ -0,0 +1,112 @@
+import os
+
+os.environ.setdefault('YACV_DISABLE_SERVER', '1')
+
+import asyncio
+import io
+import struct
+
+import pytest
+
+from yacv_server.myasynchttp import _ws_read_frame
+from yacv_server.myhttp import (WS_OPCODE_BINARY, WS_OPCODE_CLOSE, WS_OPCODE_PING, WS_OPCODE_TEXT, ws_accept_key,
+                                ws_frame_header, ws_read_frame)
+
+MASK = b'\x37\xfa\x21\x3d'
+
+
+def _client_frame(opcode: int, payload: bytes, mask: bytes = MASK, fin: bool = True) -> bytes:
+    """A frame as sent by a browser (masked, unless the mask is empty)"""
+    mask_bit = 0x80 if mask else 0
+    if len(payload) < 126:
+        header = struct.pack('!BB', (0x80 if fin else 0) | opcode, mask_bit | len(payload))
+    elif len(payload) < 1 << 16:
+        header = struct.pack('!BBH', (0x80 if fin else 0) | opcode, mask_bit | 126, len(payload))
+    else:
+        header = struct.pack('!BBQ', (0x80 if fin else 0) | opcode, mask_bit | 127, len(payload))
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return header + mask + payload
+
+
+class _Stream:
+    """A blocking socket that counts the bytes read"""
+
+    def __init__(self, data: bytes):
+        self.stream = io.BytesIO(data)
+
+    def read_exactly(self, n: int) -> bytes:
+        data = self.stream.read(n)
+        if len(data) < n:
+            raise ConnectionResetError('Disconnected')
+        return data
+
+    def left(self) -> int:
+        return len(self.stream.getbuffer()) - self.stream.tell()
+
+
+def test_accept_key():
+    # The example of RFC 6455
+    assert ws_accept_key('dGhlIHNhbXBsZSBub25jZQ==') == 's3pPLMBiTxaQ9kYGzzhZRbK+xOo='
+
+
+@pytest.mark.parametrize('length, header_length', [(0, 2), (125, 2), (126, 4), ((1 << 16) - 1, 4),
+                                                   (1 << 16, 10)])
+def test_frame_round_trip(length, header_length):
+    payload = bytes(i % 251 for i in range(length))
+
+    # Server frames are unmasked, which clients would not send, but the parser accepts
+    header = ws_frame_header(WS_OPCODE_BINARY, length)
+    assert len(header) == header_length
+    stream = _Stream(header + payload)
+    assert ws_read_frame(stream.read_exactly) == (WS_OPCODE_BINARY, payload)
+    assert stream.left() == 0
+
+    frame = _client_frame(WS_OPCODE_BINARY, payload)
+    assert frame[:header_length] == bytes([header[0], header[1] | 0x80]) + header[2:]
+    stream = _Stream(frame + _client_frame(WS_OPCODE_TEXT, b'next'))
+    assert ws_read_frame(stream.read_exactly) == (WS_OPCODE_BINARY, payload)
+    assert ws_read_frame(stream.read_exactly) == (WS_OPCODE_TEXT, b'next')
+    assert stream.left() == 0
+
+
+def test_64_bit_header():
+    assert ws_frame_header(WS_OPCODE_BINARY, 1 << 32) == b'\x82\x7f' + struct.pack('!Q', 1 << 32)
+
+
+def test_fragmented_and_control_frames():
+    stream = _Stream(_client_frame(WS_OPCODE_TEXT, b'Hel', fin=False) +
+                     _client_frame(WS_OPCODE_PING, b'ping') +  # Control frames may come between fragments
+                     _client_frame(0, b'lo') +
+                     _client_frame(WS_OPCODE_CLOSE, struct.pack('!H', 1000)))
+    assert ws_read_frame(stream.read_exactly) == (WS_OPCODE_TEXT, b'Hel')
+    assert ws_read_frame(stream.read_exactly) == (WS_OPCODE_PING, b'ping')
+    assert ws_read_frame(stream.read_exactly) == (0, b'lo')
+    assert ws_read_frame(stream.read_exactly) == (WS_OPCODE_CLOSE, b'\x03\xe8')
+
+    with pytest.raises(ValueError):
+        ws_read_frame(_Stream(_client_frame(WS_OPCODE_PING, b'ping', fin=False)).read_exactly)
+    with pytest.raises(ValueError):
+        ws_read_frame(_Stream(_client_frame(WS_OPCODE_PING, b'p' * 126)).read_exactly)
+
+
+def test_oversized_frames_are_rejected_before_reading_them():
+    for length in ((1 << 16) + 1, 1 << 40):
+        header = _client_frame(WS_OPCODE_BINARY, b'')[:1] + struct.pack('!BQ', 0x80 | 127, length) + MASK
+        stream = _Stream(header + b'\0' * 16)
+        with pytest.raises(ValueError):
+            ws_read_frame(stream.read_exactly)
+        assert stream.left() == 16 + len(MASK)  # Only the length was read
+
+
+def test_async_parser():
+    payload = b'x' * 300
+    stream = _Stream(_client_frame(WS_OPCODE_BINARY, payload) + _client_frame(WS_OPCODE_PING, b''))
+
+    async def read_exactly(n: int) -> bytes:
+        return stream.read_exactly(n)
+
+    async def read_two():
+        return await _ws_read_frame(read_exactly), await _ws_read_frame(read_exactly)
+
+    assert asyncio.run(read_two()) == ((WS_OPCODE_BINARY, payload), (WS_OPCODE_PING, b''))
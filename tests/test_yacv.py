@@ -0,0 +1,47 @@
+import os
+
+os.environ.setdefault('YACV_DISABLE_SERVER', '1')
+
+import sys
+import threading
+
+from build123d import Box, Sphere
+
+from yacv_server.yacv import YACV
+
+yacv_module = sys.modules['yacv_server.yacv']  # yacv_server.yacv is also the global instance
+
+
+def test_slow_show_does_not_block_the_scene(monkeypatch):
+    yacv = YACV()
+    yacv.show(Box(1, 1, 1), names='box')
+    preprocessing, resume = threading.Event(), threading.Event()
+    preprocess_cad = yacv_module._preprocess_cad
+
+    def slow_preprocess_cad(obj, **kwargs):
+        if threading.current_thread().name == 'slow':
+            preprocessing.set()
+            assert resume.wait(10)
+        return preprocess_cad(obj, **kwargs)
+
+    monkeypatch.setattr(yacv_module, '_preprocess_cad', slow_preprocess_cad)
+    slow = threading.Thread(target=yacv.show, args=(Sphere(1),), name='slow',
+                            kwargs=dict(names='obj', auto_clear=False, tolerance=0.2))
+    slow.start()
+    assert preprocessing.wait(10)
+
+    # While the first show is preprocessing, objects can be exported and later shows prepared
+    assert yacv.export('box') is not None
+    later = threading.Thread(target=yacv.show, args=(Box(2, 2, 2),),
+                             kwargs=dict(names='obj', auto_clear=False, tolerance=0.3))
+    later.start()
+    later.join(0.5)
+    assert later.is_alive()  # But published after the first one
+    assert yacv.shown_object_names() == ['box']
+
+    resume.set()
+    slow.join(10)
+    later.join(10)
+    assert yacv.shown_object_names() == ['box', 'obj']
+    assert yacv._show_events('obj')[0].kwargs['tolerance'] == 0.3
+    assert yacv._shows_published == yacv._show_tickets == 3
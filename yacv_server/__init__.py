@@ -1,12 +1,17 @@
 import os
+import sys
 
-from yacv_server.cad import image_to_gltf
 from yacv_server.yacv import YACV
 
 yacv = YACV()
 """The server instance. This is the main entry point to serve CAD objects and other data to the frontend."""
 
-if 'YACV_DISABLE_SERVER' not in os.environ:
+# The headless commands of `python -m yacv_server` (which imports this package before parsing its arguments, so the
+# options before the command are skipped here) do not serve anything
+_headless_command = sys.argv[:1] == ['-m'] and \
+                    next((arg for arg in sys.argv[1:] if arg not in ('-v', '--verbose')), None) == 'convert'
+
+if 'YACV_DISABLE_SERVER' not in os.environ and not _headless_command:
     # Start a new server ASAP to let the polling client connect while still building CAD objects
     # This is a bit of a hack, but it is seamless to the user. This behavior can be disabled by setting
     # the environment variable YACV_DISABLE_SERVER to a non-empty value
@@ -15,7 +20,14 @@ if 'YACV_DISABLE_SERVER' not in os.environ:
 # Expose some nice aliases using the default server instance
 show = yacv.show
 show_all = yacv.show_cad_all
-image_to_gltf = image_to_gltf
 export_all = yacv.export_all
+export_scene = yacv.export_scene
 remove = yacv.remove
 clear = yacv.clear
+flush = yacv.flush
+
+
+def image_to_gltf(*args, **kwargs):
+    """See `yacv_server.cad.image_to_gltf`, which is only imported when first used to keep `import yacv_server` fast"""
+    from yacv_server.cad import image_to_gltf as _image_to_gltf
+    return _image_to_gltf(*args, **kwargs)
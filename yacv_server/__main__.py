@@ -0,0 +1,74 @@
+"""Command line interface of yacv_server, see `python -m yacv_server --help`."""
+import argparse
+import logging
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m yacv_server', description='Yet Another CAD Viewer (server)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log debug messages')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    watch_parser = commands.add_parser(
+        'watch', help='Serve a model script, re-running it whenever it changes',
+        description='Serve the objects shown by a model script, re-running it in a pre-warmed worker (with the CAD '
+                    'modules already imported) whenever it changes, and only publishing the changed objects.')
+    watch_parser.add_argument('script', help='The model script to run')
+    watch_parser.add_argument('script_args', nargs=argparse.REMAINDER, help='Arguments for the script')
+    watch_parser.add_argument('--watch', action='append', default=[], metavar='PATH',
+                              help='Other files to watch for changes (e.g. imported modules), can be repeated')
+    watch_parser.add_argument('--workers', type=int, default=1,
+                              help='Idle workers to keep warm, for changes that arrive while running (default: 1)')
+    watch_parser.add_argument('--interval', type=float, default=0.3,
+                              help='Seconds between checks for changes (default: 0.3)')
+
+    convert_parser = commands.add_parser(
+        'convert', help='Convert STEP/BREP files to GLB files',
+        description='Convert STEP/BREP files to GLB files with the same tessellation as the viewer, in parallel, '
+                    'skipping the files that did not change since the previous conversion to the same output.')
+    convert_parser.add_argument('inputs', nargs='+', metavar='INPUT',
+                                help='CAD files, globs (** matches any subfolders) or folders with CAD files')
+    convert_parser.add_argument('-o', '--output', default='export',
+                                help='Output folder, or .zip/.tar/.tar.gz archive (default: export)')
+    convert_parser.add_argument('--workers', type=int, default=0,
+                                help='Worker processes converting files in parallel (default: 0, one per CPU)')
+    convert_parser.add_argument('--force', action='store_true', help='Convert even the unchanged files')
+    convert_parser.add_argument('--tolerance', type=float, default=0.1, help='Tessellation tolerance (default: 0.1)')
+    convert_parser.add_argument('--angular-tolerance', type=float,
+                                help='Tessellation angular tolerance (default: 0.1, or 0.5 with --relative-tolerance)')
+    convert_parser.add_argument('--relative-tolerance', type=float,
+                                help='Tessellation tolerance as a fraction of the size of each object (e.g. 0.001), '
+                                     'instead of --tolerance')
+    convert_parser.add_argument('--relative-to', choices=('object', 'face'), default='object',
+                                help='Whether --relative-tolerance follows the size of each object or of each face '
+                                     '(default: object)')
+    convert_parser.add_argument('--max-triangles', type=int,
+                                help='Tessellate the objects with more triangles again with coarser tolerances, '
+                                     'and then decimate them')
+    for primitive in ('faces', 'edges', 'vertices'):
+        convert_parser.add_argument(f'--no-{primitive}', dest=primitive, action='store_false',
+                                    help=f'Do not include the {primitive}')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    if args.command == 'watch':
+        from yacv_server.watch import watch
+        watch(args.script, args.script_args, args.watch, spares=args.workers, interval=args.interval)
+    elif args.command == 'convert':
+        from yacv_server.convert import convert
+        try:
+            options = dict(tolerance=args.tolerance, angular_tolerance=args.angular_tolerance,
+                           relative_tolerance=args.relative_tolerance, max_triangles=args.max_triangles,
+                           faces=args.faces, edges=args.edges, vertices=args.vertices)
+            if args.relative_tolerance is not None:
+                options['relative_to'] = args.relative_to
+            failed = convert(args.inputs, args.output, workers=args.workers, force=args.force,
+                             **{k: v for k, v in options.items() if v is not None})
+        except ValueError as e:
+            parser.error(str(e))
+        sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -48,6 +48,12 @@ def get_color(obj: Any) -> Optional[ColorTuple]:
             return (clamp(wrapped.Red()), clamp(wrapped.Green()), clamp(wrapped.Blue()), clamp(wrapped.Alpha()))
         except Exception:
             pass
+    if hasattr(wrapped, "GetRGB") and hasattr(wrapped, "Alpha"):  # e.g. build123d Color and imported STEP colors
+        try:
+            rgb = wrapped.GetRGB()
+            return (clamp(rgb.Red()), clamp(rgb.Green()), clamp(rgb.Blue()), clamp(wrapped.Alpha()))
+        except Exception:
+            pass
 
     return None
 
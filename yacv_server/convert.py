@@ -0,0 +1,224 @@
+"""Import of STEP/BREP files, and their headless conversion to GLB: `python -m yacv_server convert`.
+
+Each file is imported and tessellated in a pool of worker processes with the same pipeline as `show()`, so the GLBs
+have the same face/edge/vertex primitives and metadata as the ones served to the frontend. The output folder gets a
+manifest.json (see `yacv_server.exporting`) whose hashes cover the contents of each input file and the conversion
+options, so that the inputs that did not change since the previous conversion to the same folder are skipped.
+
+Files passed to `show()` are instead cached by path, modification time and size (see `CADFileCache`).
+"""
+import concurrent.futures
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import List, Dict, Optional, Tuple, TYPE_CHECKING
+
+from yacv_server.exporting import ExportWriter, read_manifest, ARCHIVE_SUFFIXES
+from yacv_server.memory import ShapeSpill, shape_to_brep
+from yacv_server.mylogger import logger
+from yacv_server.version import get_version
+from yacv_server.workers import WorkerPool
+
+if TYPE_CHECKING:
+    from yacv_server.cad import CADLike, ColorTuple
+
+CAD_FILE_SUFFIXES = ('.step', '.stp', '.brep', '.brp')
+"""The extensions of the CAD files that `import_cad_file` can read"""
+
+
+def import_cad_file(path: str) -> 'CADLike':
+    """Imports a STEP file (keeping its colors) or an OCCT BREP file"""
+    from build123d import import_step, import_brep
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix in ('.step', '.stp'):
+        return import_step(path)
+    if suffix in ('.brep', '.brp'):
+        return import_brep(path)
+    raise ValueError(f'Unsupported CAD file {path}, expected one of {", ".join(CAD_FILE_SUFFIXES)}')
+
+
+class CADFileCache:
+    """Disk cache of imported CAD files and their builds, keyed by the path, modification time and size of each file
+    (and the version and tessellation options, for builds), so that showing an unchanged file again neither parses nor
+    tessellates it. Each file has its own folder, which is
+    emptied when a new version of the file is imported."""
+
+    directory: Optional[str]
+    """Where to keep the imported shapes (binary BRep and color) and their builds (GLB), or None to disable the cache"""
+
+    def __init__(self, directory: Optional[str]):
+        self.directory = directory
+
+    @staticmethod
+    def key(path: str) -> str:
+        """Identifies the current version of a file, without reading it"""
+        stat = os.stat(path)
+        return f'{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}'
+
+    def hash(self, path: str, options: Dict[str, any]) -> str:
+        """The hash of an object shown from the current version of a file with these options of `tessellate` (like
+        `_hashcode`), which is known before importing it. As the cached builds outlive the process, it also covers the
+        version of yacv and the default style that the options were resolved with."""
+        hasher = hashlib.md5(usedforsecurity=False)
+        hasher.update(get_version().encode())
+        for k, v in options.items():
+            hasher.update(str(k).encode())
+            hasher.update(str(v).encode())
+        hasher.update(self.key(path).encode())
+        return hasher.hexdigest()
+
+    def _folder(self, path: str) -> str:
+        path_hash = hashlib.md5(os.path.abspath(path).encode(), usedforsecurity=False).hexdigest()
+        return os.path.join(self.directory, path_hash)
+
+    def load(self, path: str) -> Tuple['CADLike', Optional['ColorTuple']]:
+        """Imports a CAD file, or reads back its shape and color if it did not change since it was last imported"""
+        from yacv_server.cad import get_color, get_shape
+        if self.directory is None:
+            obj = import_cad_file(path)
+            return obj, get_color(obj)
+        version = hashlib.md5(self.key(path).encode(), usedforsecurity=False).hexdigest()
+        folder = self._folder(path)
+        brep_path = os.path.join(folder, f'{version}.brep')
+        try:
+            with open(os.path.join(folder, f'{version}.json'), 'rb') as f:
+                color = json.load(f)['color']
+            shape = ShapeSpill.load(brep_path)
+            logger.debug('Loaded %s from the cache', path)
+            return shape, tuple(color) if color is not None else None
+        except (OSError, ValueError, KeyError):
+            pass  # Not cached yet
+
+        obj = import_cad_file(path)
+        color = get_color(obj)
+        try:
+            shutil.rmtree(folder, ignore_errors=True)  # Previous versions of the file
+            _write_atomic(brep_path, shape_to_brep(get_shape(obj)))
+            _write_atomic(os.path.join(folder, f'{version}.json'), json.dumps({'color': color}).encode())
+        except OSError as e:
+            logger.warning('Could not cache the import of %s: %s', path, e)
+        return obj, color
+
+    def get_glb(self, path: str, _hash: str) -> Optional[bytes]:
+        """Returns the cached build of this version of a CAD file, if any"""
+        if self.directory is None:
+            return None
+        try:
+            with open(os.path.join(self._folder(path), f'{_hash}.glb'), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put_glb(self, path: str, _hash: str, glb: bytes):
+        """Caches the build of a CAD file"""
+        if self.directory is None:
+            return
+        try:
+            _write_atomic(os.path.join(self._folder(path), f'{_hash}.glb'), glb)
+        except OSError as e:
+            logger.warning('Could not cache the build of %s: %s', path, e)
+
+
+def _write_atomic(path: str, data: bytes):
+    """Writes a file that other processes never see half-written"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def find_inputs(inputs: List[str]) -> List[str]:
+    """Expands the given files, globs (** is recursive) and folders (all their CAD files) to a sorted list of files"""
+    paths = set()
+    for _input in inputs:
+        if os.path.isdir(_input):
+            matches = glob.glob(os.path.join(_input, '**', '*'), recursive=True)
+        elif glob.has_magic(_input):
+            matches = glob.glob(_input, recursive=True)
+        elif os.path.isfile(_input):
+            paths.add(_input)
+            continue
+        else:
+            raise ValueError(f'No such file: {_input}')
+        matches = [match for match in matches if os.path.isfile(match) and match.lower().endswith(CAD_FILE_SUFFIXES)]
+        if not matches:
+            raise ValueError(f'No CAD files match {_input}')
+        paths.update(matches)
+    return sorted(paths)
+
+
+def object_names(paths: List[str]) -> List[str]:
+    """The name of the object of each file: its path relative to the common folder of all of them, without extension"""
+    folders = [os.path.dirname(os.path.abspath(path)) for path in paths]
+    common = os.path.commonpath(folders) if folders else ''
+    names = [os.path.splitext(os.path.relpath(os.path.abspath(path), common))[0].replace(os.sep, '/') for path in paths]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f'Several inputs would be converted to the same file: {", ".join(duplicates)}')
+    return names
+
+
+def source_hash(path: str, options: Dict[str, any]) -> str:
+    """Hash of the contents of an input file, the conversion options and the version of the converter"""
+    hasher = hashlib.md5(usedforsecurity=False)
+    hasher.update(json.dumps({'version': get_version(), 'options': options}, sort_keys=True).encode())
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def convert_file(path: str, options: Dict[str, any]) -> bytes:
+    """Imports a CAD file and builds its GLB like `show(obj, **options)` would (in the worker processes)"""
+    from yacv_server.cad import get_color
+    from yacv_server.tessellate import tessellate
+    from yacv_server.yacv import _preprocess_cad, _default_style, _tessellate_options
+    obj = import_cad_file(path)
+    options = dict(options)
+    obj_color = get_color(obj)
+    if obj_color is not None:
+        options['color_obj'] = obj_color
+    shape = _preprocess_cad(obj, **options)
+    return b''.join(tessellate(shape, **_tessellate_options(options, _default_style())).save_to_bytes())
+
+
+def convert(inputs: List[str], output: str, workers: int = 0, force: bool = False, **options) -> List[str]:
+    """Converts the CAD files matching the inputs to GLB files in the output folder (or archive, which is always
+    rewritten), using up to `workers` processes (0 for one per CPU). The options are those of `show()`, like tolerance.
+
+    Returns the inputs that could not be converted, which are logged and left out of the manifest."""
+    start = time.time()
+    paths = find_inputs(inputs)
+    names = object_names(paths)
+    workers = workers if workers > 0 else os.cpu_count() or 1
+    previous = read_manifest(output) if not force and not output.endswith(ARCHIVE_SUFFIXES) else {}
+    failed = []
+    skipped = 0
+    with ExportWriter(output) as writer, WorkerPool(min(workers, len(paths))) as pool:
+        futures = {}
+        for path, name in zip(paths, names):
+            _hash = source_hash(path, options)
+            entry = previous.get(name)
+            if entry is not None and entry['hash'] == _hash and os.path.isfile(os.path.join(output, entry['file'])):
+                writer.reuse(entry)
+                skipped += 1
+                continue
+            futures[pool.submit(convert_file, os.path.abspath(path), options)] = (path, name, _hash)
+        for future in concurrent.futures.as_completed(futures):
+            path, name, _hash = futures[future]
+            try:
+                glb = future.result()
+            except (RuntimeError, EOFError) as e:
+                logger.error('Could not convert %s: %s', path, e)
+                failed.append(path)
+                continue
+            writer.write(name, _hash, glb)
+            logger.info('Converted %s (%d bytes)', path, len(glb))
+    logger.info('Converted %d files in %.3f seconds (%d unchanged, %d failed)', len(paths) - skipped - len(failed),
+                time.time() - start, skipped, len(failed))
+    return failed
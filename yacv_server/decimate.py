@@ -0,0 +1,283 @@
+"""Vectorized quadric error metric (QEM) decimation of the face meshes built by `tessellate`.
+
+Every face of a shape is triangulated on its own copies of the vertices, so the mesh is first welded by position: the
+boundaries of the faces (and the seams of periodic faces) become the feature edges of a single closed mesh. Vertices are
+removed by half-edge collapses (merged into a neighbour, whose normal, UV and color are kept in each face), chosen by
+the quadric error of Garland and Heckbert:
+
+- Interior vertices of a face collapse into any neighbour of the same face.
+- Vertices in the middle of a face boundary only slide along it, into the next vertex of the same boundary, in every
+  face that shares it (so that the faces stay watertight). Extra quadrics perpendicular to the faces keep the boundaries
+  close to the edge polylines, which are left untouched.
+- Vertices where boundaries meet (like the vertices of the shape) and the vertices of open or non-manifold edges stay.
+
+Instead of collapsing one edge at a time from a priority queue, each pass collapses, in bulk, an independent set of the
+cheapest collapses (no two of them change the same triangle), skipping the ones that would flip a triangle or break the
+topology of the mesh.
+"""
+from typing import Tuple
+
+import numpy as np
+
+from yacv_server.mylogger import logger
+
+_MAX_PASSES = 100
+"""The maximum number of bulk collapse passes (each one removes a fraction of the remaining vertices)"""
+
+_PASS_FRACTION = 0.5
+"""The fraction of the cheapest candidate collapses considered in each pass, so that costly ones wait for later"""
+
+_SELECTION_ROUNDS = 16
+"""The maximum number of rounds to select the independent collapses of a pass"""
+
+_MIN_NORMAL_COSINE = 0.2
+"""Collapses that rotate the normal of a triangle further than this (cosine of the angle) are rejected"""
+
+_BOUNDARY_WEIGHT = 100.0
+"""The weight of the quadrics that keep the boundaries of the faces in place, relative to the faces themselves"""
+
+_WELD_TOLERANCE = 1e-9
+"""Vertices closer than this fraction of the size of the mesh are the same vertex"""
+
+_INVALID_RANK = np.iinfo(np.int64).max
+
+
+def decimate(positions: np.ndarray, triangles: np.ndarray, face_ids: np.ndarray, max_triangles: int) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """Simplifies the (N, 3) positions and (T, 3) triangles (with the (T,) face of each triangle) to at most
+    max_triangles, if possible without moving the boundaries of the faces away from the edges.
+
+    Returns the remaining triangles (still indexing the given positions) and their faces, in the original order."""
+    triangles = np.asarray(triangles, dtype=np.int64)
+    face_ids = np.asarray(face_ids)
+    original_triangles = len(triangles)
+    welded = _weld(positions)
+    quadrics = _quadrics(positions, triangles, welded)
+    deferred = np.zeros(len(quadrics), dtype=bool)  # Collapses that failed last pass, to give the others a chance
+
+    for _ in range(_MAX_PASSES):
+        if len(triangles) <= max_triangles:
+            break
+        movable, sliding = _movable_vertices(triangles, welded, len(quadrics))
+        removed, targets = _independent_collapses(positions, triangles, welded, quadrics, movable & ~deferred,
+                                                  sliding)
+        deferred[:] = False
+        # Each collapse removes about 2 triangles: do not undershoot the budget much, even if some collapses fail
+        keep = len(triangles) - max_triangles
+        removed, targets = removed[:keep], targets[:keep]
+        if len(removed) == 0:
+            break
+
+        target_of = np.full(len(quadrics), -1)
+        target_of[removed] = targets
+        for _check in range(3):
+            mapping, missing = _copy_mapping(triangles, welded, target_of)
+            new_triangles = mapping[triangles]
+            rejected = np.concatenate([missing, _bad_collapses(positions, triangles, new_triangles, welded, target_of)])
+            if len(rejected) == 0:
+                break
+            target_of[rejected] = -1
+            deferred[rejected] = True
+        else:  # Dropping the last rejected collapses may have broken others, so only apply validated collapses
+            continue
+
+        applied = removed[target_of[removed] >= 0]
+        if len(applied) == 0:
+            continue
+        np.add.at(quadrics, target_of[applied], quadrics[applied])
+        alive = _non_degenerate(welded[new_triangles])
+        triangles, face_ids = new_triangles[alive], face_ids[alive]
+
+    if len(triangles) > max_triangles:
+        logger.warning('Could only decimate %d to %d triangles (max_triangles=%d)', original_triangles,
+                       len(triangles), max_triangles)
+    return triangles, face_ids
+
+
+def _weld(positions: np.ndarray) -> np.ndarray:
+    """The welded vertex of each vertex, the same for all the vertices at the same position"""
+    if len(positions) == 0:
+        return np.zeros(0, dtype=np.int64)
+    size = max(float(np.ptp(positions, axis=0).max()), 1e-30)
+    keys = np.round(positions / (size * _WELD_TOLERANCE)).astype(np.int64)
+    _, welded = np.unique(keys, axis=0, return_inverse=True)
+    return welded.reshape(-1)
+
+
+def _half_edges(triangles: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """The (from, to) vertices of the 3 half-edges of each triangle, in triangle order"""
+    return triangles.ravel(), triangles[:, [1, 2, 0]].ravel()
+
+
+def _edge_keys(a: np.ndarray, b: np.ndarray, n: int) -> np.ndarray:
+    """A key of each undirected edge"""
+    return np.minimum(a, b) * n + np.maximum(a, b)
+
+
+def _non_degenerate(triangles: np.ndarray) -> np.ndarray:
+    return ((triangles[:, 0] != triangles[:, 1]) & (triangles[:, 1] != triangles[:, 2]) &
+            (triangles[:, 2] != triangles[:, 0]))
+
+
+def _boundary_half_edges(triangles: np.ndarray, n: int) -> np.ndarray:
+    """Whether each half-edge is on the boundary of its face (not shared with another triangle of the same copies)"""
+    a, b = _half_edges(triangles)
+    _, inverse, counts = np.unique(_edge_keys(a, b, n), return_inverse=True, return_counts=True)
+    return counts[inverse.reshape(-1)] == 1
+
+
+def _quadrics(positions: np.ndarray, triangles: np.ndarray, welded: np.ndarray) -> np.ndarray:
+    """The (W, 10) quadrics (upper triangle of the 4x4 matrix) of each welded vertex: the area-weighted planes of its
+    triangles, plus the weighted planes perpendicular to them along its face boundaries"""
+    p0, p1, p2 = (positions[triangles[:, k]] for k in range(3))
+    normals = np.cross(p1 - p0, p2 - p0)
+    areas = np.linalg.norm(normals, axis=1)
+    normals = normals / np.maximum(areas, 1e-30)[:, None]
+    quadrics = np.zeros((int(welded.max()) + 1 if len(welded) > 0 else 0, 10))
+    _add_plane_quadrics(quadrics, welded[triangles], normals, p0, areas)
+
+    a, b = _half_edges(triangles)
+    boundary = _boundary_half_edges(triangles, len(positions))
+    a, b = a[boundary], b[boundary]
+    edges = positions[b] - positions[a]
+    lengths = np.linalg.norm(edges, axis=1)
+    side_normals = np.cross(edges, np.repeat(normals, 3, axis=0)[boundary])
+    side_normals /= np.maximum(np.linalg.norm(side_normals, axis=1), 1e-30)[:, None]
+    _add_plane_quadrics(quadrics, welded[np.stack([a, b], axis=1)], side_normals, positions[a],
+                        lengths * lengths * _BOUNDARY_WEIGHT)
+    return quadrics
+
+
+def _add_plane_quadrics(quadrics: np.ndarray, vertices: np.ndarray, normals: np.ndarray, points: np.ndarray,
+                        weights: np.ndarray):
+    """Adds the weighted quadric of each plane (normal and point) to each of its (M, K) vertices"""
+    planes = np.concatenate([normals, -np.einsum('ij,ij->i', normals, points)[:, None]], axis=1)
+    rows, cols = np.triu_indices(4)
+    plane_quadrics = planes[:, rows] * planes[:, cols] * weights[:, None]
+    for k in range(vertices.shape[1]):
+        for c in range(10):
+            quadrics[:, c] += np.bincount(vertices[:, k], weights=plane_quadrics[:, c], minlength=len(quadrics))
+
+
+def _quadric_error(quadrics: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """Evaluates each quadric at its point"""
+    x, y, z = points[:, 0], points[:, 1], points[:, 2]
+    q = quadrics.T
+    return (q[0] * x * x + 2 * q[1] * x * y + 2 * q[2] * x * z + 2 * q[3] * x + q[4] * y * y + 2 * q[5] * y * z +
+            2 * q[6] * y + q[7] * z * z + 2 * q[8] * z + q[9])
+
+
+def _movable_vertices(triangles: np.ndarray, welded: np.ndarray, w: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Which of the w welded vertices can be removed, and which of those can only slide along a face boundary (in the
+    middle of one, with exactly two boundary neighbours)"""
+    welded_triangles = welded[triangles]
+    a, b = _half_edges(welded_triangles)
+    keys = _edge_keys(a, b, w)
+    unique_keys, counts = np.unique(keys, return_counts=True)
+    movable = np.ones(w, dtype=bool)
+    open_keys = unique_keys[counts != 2]  # Open or non-manifold edges
+    movable[open_keys // w] = False
+    movable[open_keys % w] = False
+    movable[welded_triangles[~_non_degenerate(welded_triangles)].ravel()] = False
+
+    boundary_keys = np.unique(keys[_boundary_half_edges(triangles, len(welded))])
+    degree = np.bincount(np.concatenate([boundary_keys // w, boundary_keys % w]), minlength=w)
+    movable &= (degree == 0) | (degree == 2)
+    return movable, degree == 2
+
+
+def _independent_collapses(positions: np.ndarray, triangles: np.ndarray, welded: np.ndarray, quadrics: np.ndarray,
+                           movable: np.ndarray, sliding: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Chooses the cheapest collapse of each movable welded vertex, and keeps the cheap ones that do not change the same
+    triangles as a cheaper one. Returns the removed welded vertices and their targets, cheapest first."""
+    w = len(quadrics)
+    welded_triangles = welded[triangles]
+    a, b = _half_edges(welded_triangles)
+    removed = np.concatenate([a, b])
+    targets = np.concatenate([b, a])
+    candidates = movable[removed]
+    if np.any(sliding):  # Along the boundary only
+        boundary_keys = _edge_keys(a, b, w)[_boundary_half_edges(triangles, len(welded))]
+        candidates &= ~sliding[removed] | np.isin(_edge_keys(removed, targets, w), boundary_keys)
+    removed, targets = removed[candidates], targets[candidates]
+    if len(removed) == 0:
+        return removed, targets
+    points = np.zeros((w, 3))
+    points[welded] = positions
+    costs = _quadric_error(quadrics[removed] + quadrics[targets], points[targets])
+
+    # The cheapest collapse of each vertex, and then only the cheapest of those
+    order = np.lexsort((costs, removed))
+    _, first = np.unique(removed[order], return_index=True)
+    best = order[first]
+    best = best[np.argsort(costs[best], kind='stable')]
+    best = best[:max(1, int(len(best) * _PASS_FRACTION))]
+    removed, targets = removed[best], targets[best]
+
+    # Select, in rounds, the collapses that are the cheapest of every triangle around their removed vertex, dropping the
+    # ones that share a triangle with those (as costs vary smoothly, there are few such local minima in each round)
+    rank = np.full(w, _INVALID_RANK)
+    rank[removed] = np.arange(len(removed))
+    selected = np.zeros(w, dtype=bool)
+    for _ in range(_SELECTION_ROUNDS):
+        triangle_ranks = rank[welded_triangles]
+        cheapest = triangle_ranks.min(axis=1)
+        lost = np.zeros(w, dtype=bool)
+        for k in range(3):
+            pending = triangle_ranks[:, k] != _INVALID_RANK
+            lost[welded_triangles[pending & (triangle_ranks[:, k] != cheapest), k]] = True
+        winners = (rank != _INVALID_RANK) & ~lost
+        if not np.any(winners):
+            break
+        selected |= winners
+        touched = np.zeros(w, dtype=bool)
+        touched[welded_triangles[np.any(winners[welded_triangles], axis=1)].ravel()] = True
+        rank[touched] = _INVALID_RANK
+    independent = selected[removed]
+    return removed[independent], targets[independent]
+
+
+def _copy_mapping(triangles: np.ndarray, welded: np.ndarray, target_of: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Maps each copy of the removed welded vertices to the neighbouring copy of its target. Returns the mapping of all
+    the vertices and the removed welded vertices with some copy that has no such neighbour (not collapsible)."""
+    a, b = _half_edges(triangles)
+    a, b = np.concatenate([a, b]), np.concatenate([b, a])
+    matches = target_of[welded[a]] == welded[b]
+    mapping = np.arange(len(welded))
+    mapping[a[matches]] = b[matches]
+    copies = np.unique(triangles)
+    copies = copies[target_of[welded[copies]] >= 0]
+    missing = np.unique(welded[copies[mapping[copies] == copies]])
+    stay = copies[np.isin(welded[copies], missing)]
+    mapping[stay] = stay
+    return mapping, missing
+
+
+def _bad_collapses(positions: np.ndarray, triangles: np.ndarray, new_triangles: np.ndarray, welded: np.ndarray,
+                   target_of: np.ndarray) -> np.ndarray:
+    """The removed welded vertices whose collapse would flip (or squash) a triangle, or make the mesh non-manifold"""
+    alive = _non_degenerate(welded[new_triangles])
+    changed = np.any(new_triangles != triangles, axis=1) & alive
+    old, new = triangles[changed], new_triangles[changed]
+    old_normals = np.cross(positions[old[:, 1]] - positions[old[:, 0]], positions[old[:, 2]] - positions[old[:, 0]])
+    new_normals = np.cross(positions[new[:, 1]] - positions[new[:, 0]], positions[new[:, 2]] - positions[new[:, 0]])
+    dots = np.einsum('ij,ij->i', old_normals, new_normals)
+    norms = np.linalg.norm(old_normals, axis=1) * np.linalg.norm(new_normals, axis=1)
+    flipped = welded[old[dots <= _MIN_NORMAL_COSINE * norms]].ravel()
+    # Each changed triangle has a single removed vertex, as the collapses are independent
+    bad = [flipped[target_of[flipped] >= 0]]
+
+    # Collapses that fold the mesh onto itself leave duplicate triangles or edges with more than two triangles
+    w = len(target_of)
+    welded_triangles = welded[new_triangles[alive]]
+    a, b = _half_edges(welded_triangles)
+    keys, counts = np.unique(_edge_keys(a, b, w), return_counts=True)
+    overused = keys[counts > 2]
+    sorted_triangles = np.sort(welded_triangles, axis=1)
+    _, inverse, counts = np.unique(sorted_triangles, axis=0, return_inverse=True, return_counts=True)
+    duplicated = sorted_triangles[counts[inverse.reshape(-1)] > 1].ravel()
+    involved = np.concatenate([overused // w, overused % w, duplicated])
+    if len(involved) > 0:
+        removed = np.nonzero(target_of >= 0)[0]
+        bad.append(removed[np.isin(target_of[removed], involved)])
+    return np.unique(np.concatenate(bad))
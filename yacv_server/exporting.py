@@ -0,0 +1,91 @@
+"""Output of `YACV.export_all`: a folder or a zip/tar archive of GLB files with a manifest, for static hosting."""
+import io
+import json
+import os
+import tarfile
+import time
+import zipfile
+from typing import Optional, List, Dict, Any
+
+from yacv_server.version import get_version
+
+MANIFEST_NAME = 'manifest.json'
+"""The file listing the exported objects, written last"""
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz')
+"""Export paths ending with these are written as a single archive instead of a folder"""
+
+
+def read_manifest(folder: str) -> Dict[str, Dict[str, Any]]:
+    """The objects listed in the manifest of a previous export to this folder by name, if any"""
+    try:
+        with open(os.path.join(folder, MANIFEST_NAME), 'rb') as f:
+            return {entry['name']: entry for entry in json.load(f)['objects']}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+class ExportWriter:
+    """Writes exported objects as they are ready to a folder, or streams them into a single archive, and finally writes
+    the manifest with the name, hash, file and size of each object."""
+
+    path: str
+    objects: List[Dict[str, Any]]
+    """The manifest entries of the objects written so far"""
+    _zip: Optional[zipfile.ZipFile]
+    _tar: Optional[tarfile.TarFile]
+
+    def __init__(self, path: str):
+        self.path = path
+        self.objects = []
+        self._zip = None
+        self._tar = None
+        if path.endswith(ARCHIVE_SUFFIXES):
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            if path.endswith('.zip'):
+                self._zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+            else:
+                self._tar = tarfile.open(path, 'w' if path.endswith('.tar') else 'w:gz')
+        else:
+            os.makedirs(path, exist_ok=True)
+
+    def write(self, name: str, _hash: str, glb: bytes):
+        """Writes the GLB of an object and adds it to the manifest"""
+        file_name = f'{name}.glb'
+        self._write_file(file_name, glb)
+        self.objects.append({'name': name, 'hash': _hash, 'file': file_name, 'size': len(glb)})
+
+    def reuse(self, entry: Dict[str, Any]):
+        """Keeps an unchanged object written by a previous export to the same folder in the manifest"""
+        self.objects.append(entry)
+
+    def _write_file(self, file_name: str, data: bytes):
+        if self._zip is not None:
+            self._zip.writestr(file_name, data)
+        elif self._tar is not None:
+            info = tarfile.TarInfo(file_name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self._tar.addfile(info, io.BytesIO(data))
+        else:
+            file_path = os.path.join(self.path, file_name)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'wb') as f:
+                f.write(data)
+
+    def close(self, complete: bool = True):
+        """Writes the manifest (objects sorted by name) if complete and finishes the archive, if any"""
+        if complete:
+            manifest = {'generator': f'yacv-server {get_version()}',
+                        'objects': sorted(self.objects, key=lambda entry: entry['name'])}
+            self._write_file(MANIFEST_NAME, json.dumps(manifest, indent=2).encode())
+        if self._zip is not None:
+            self._zip.close()
+        if self._tar is not None:
+            self._tar.close()
+
+    def __enter__(self) -> 'ExportWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(complete=exc_type is None)
@@ -1,15 +1,16 @@
-import importlib.metadata
+import base64
+import copy
+import hashlib
+import json
+import re
+import struct
+import threading
 
 import numpy as np
 from build123d import Location, Plane, Vector
 from pygltflib import *
 
-
-def get_version() -> str:
-    try:
-        return importlib.metadata.version("yacv_server")
-    except importlib.metadata.PackageNotFoundError:
-        return "unknown"
+from yacv_server.version import get_version
 
 
 class GLTFMgr:
@@ -89,6 +90,27 @@ class GLTFMgr:
         self.face_colors.extend([col for _ in range(len(vertices_raw)) for col in color])
         self._faces_primitive.extras["face_triangles_end"].append(len(self.face_indices))
 
+    def decimate(self, max_triangles: int):
+        """Simplify the faces to at most max_triangles (if possible), keeping the boundaries of each face"""
+        from yacv_server.decimate import decimate
+        triangles_end = np.array(self._faces_primitive.extras["face_triangles_end"], dtype=np.int64) // 3
+        face_ids = np.repeat(np.arange(len(triangles_end)), np.diff(triangles_end, prepend=0))
+        positions = np.array(self.face_positions, dtype=np.float64).reshape(-1, 3)
+        triangles = np.array(self.face_indices, dtype=np.int64).reshape(-1, 3)
+        triangles, face_ids = decimate(positions, triangles, face_ids, max_triangles)
+
+        # Drop the vertices that are no longer used, and count the remaining triangles of each face
+        used = np.unique(triangles)
+        remap = np.zeros(len(positions), dtype=np.int64)
+        remap[used] = np.arange(len(used))
+        self.face_indices = remap[triangles].ravel().tolist()
+        self.face_positions = positions[used].ravel().tolist()
+        self.face_normals = np.array(self.face_normals).reshape(-1, 3)[used].ravel().tolist()
+        self.face_tex_coords = np.array(self.face_tex_coords).reshape(-1, 2)[used].ravel().tolist()
+        self.face_colors = np.array(self.face_colors).reshape(-1, 4)[used].ravel().tolist()
+        self._faces_primitive.extras["face_triangles_end"] = \
+            (np.cumsum(np.bincount(face_ids, minlength=len(triangles_end))) * 3).tolist()
+
     def add_edge(self, vertices_raw: List[Tuple[Tuple[float, float, float], Tuple[float, float, float]]],
                  color: Tuple[float, float, float, float]):
         """Add an edge to the GLTF mesh"""
@@ -207,3 +229,268 @@ def _gen_buffer_metadata(data: List[any], chunk: int) -> Tuple[Accessor, BufferV
     ), BufferView(
         target={1: ELEMENT_ARRAY_BUFFER, 2: ARRAY_BUFFER, 3: ARRAY_BUFFER, 4: ARRAY_BUFFER}[chunk],
     ), np.array(data, dtype={1: np.uint32, 2: np.float32, 3: np.float32, 4: np.float32}[chunk]).tobytes()
+
+
+_GLB_MAGIC = b'glTF'
+_GLB_CHUNK_JSON = 0x4E4F534A
+_GLB_CHUNK_BIN = 0x004E4942
+_GLTF_ARRAYS = ('accessors', 'animations', 'bufferViews', 'cameras', 'images', 'materials', 'meshes', 'nodes',
+                'samplers', 'skins', 'textures')
+_EXTRAS_NAME_KEY = '__yacv_name'  # Same as extrasNameKey in the frontend
+
+
+class GLBSceneComposer:
+    """Composes many GLB blobs into a single GLB scene with one node per object.
+
+    Each object is parsed once per hash into a fragment whose JSON is serialized with symbolic indices (see
+    `_GLBFragment`), so composing the scene only renders the indices of the objects that moved and concatenates the
+    fragments, no matter which objects changed."""
+
+    _fragments: Dict[str, '_GLBFragment']
+    _composed_key: Optional[List[Tuple[str, str]]]
+    """The (name, hash) of each object of the last composition"""
+    _composed_glb: Optional[Tuple[bytes, str]]
+    _lock: threading.Lock
+
+    def __init__(self):
+        self._fragments = {}
+        self._composed_key = None
+        self._composed_glb = None
+        self._lock = threading.Lock()
+
+    def compose(self, objects: List[Tuple[str, str, bytes]]) -> Tuple[bytes, str]:
+        """Compose the given (name, hash, glb) objects into a single GLB, returning it along with its hash"""
+        with self._lock:
+            key = [(name, _hash) for name, _hash, _ in objects]
+            if self._composed_glb is not None and key == self._composed_key:
+                return self._composed_glb
+
+            # Update the fragment cache, parsing only new or changed objects
+            for name, _hash, glb in objects:
+                if name not in self._fragments or self._fragments[name].hash != _hash:
+                    self._fragments[name] = _GLBFragment(name, _hash, glb)
+            for name in set(self._fragments.keys()) - set(name for name, _ in key):
+                del self._fragments[name]
+
+            self._composed_key = key
+            self._composed_glb = self._build(key), hashlib.md5(
+                ';'.join(f'{name}:{_hash}' for name, _hash in key).encode(), usedforsecurity=False).hexdigest()
+            return self._composed_glb
+
+    def _build(self, key: List[Tuple[str, str]]) -> bytes:
+        """Concatenate the fragments of the given objects into the final GLB"""
+        out = {'asset': {'version': '2.0', 'generator': f"yacv_server@{get_version()}"}, 'scene': 0,
+               'scenes': [{'nodes': []}]}
+        arrays: Dict[str, List[str]] = {k: [] for k in _GLTF_ARRAYS}
+        blobs = []
+        base = {k: 0 for k in _GLTF_ARRAYS + ('blob',)}
+        for name, _ in key:
+            fragment = self._fragments[name]
+            for k, text in fragment.render(base).items():
+                arrays[k].append(text)
+            for k in _GLTF_ARRAYS:
+                base[k] += fragment.counts[k]
+            out['scenes'][0]['nodes'].append(base['nodes'] - 1)  # The object node is the last one of each fragment
+            blobs.append(fragment.blob)
+            base['blob'] += len(fragment.blob)
+            for k in ('extensionsUsed', 'extensionsRequired'):
+                for ext in fragment.extensions.get(k, []):
+                    if ext not in out.setdefault(k, []):
+                        out[k].append(ext)
+        if base['blob'] > 0:
+            out['buffers'] = [{'byteLength': base['blob']}]
+        doc_text = json.dumps(out, separators=(',', ':'))[:-1] + ''.join(
+            f',"{k}":[{",".join(texts)}]' for k, texts in arrays.items() if len(texts) > 0) + '}'
+        return _glb_pack(doc_text.encode('utf-8'), b''.join(blobs))
+
+
+class _GLBFragment:
+    """An object of a composed scene: its JSON arrays (with an extra node named after the object, holding its scene) and
+    its binary buffer. The arrays are serialized once, as templates of the text between the cross-references and the
+    references themselves, which are rendered for the position of the object in each composition."""
+
+    hash: str
+    counts: Dict[str, int]
+    """The length of each array"""
+    blob: bytes
+    """The binary buffer, padded to 4 bytes"""
+    extensions: Dict[str, List[str]]
+    """The extensionsUsed and extensionsRequired"""
+    _templates: Dict[str, Tuple[List[str], List[Tuple[str, int]]]]
+    """The text pieces of each non-empty array (without brackets), and the (kind, index) reference between each two"""
+    _rendered: Optional[Tuple[Dict[str, int], Dict[str, str]]]
+    """The base of each kind of reference of the last render, and the rendered arrays"""
+
+    def __init__(self, name: str, _hash: str, glb: bytes):
+        self.hash = _hash
+        doc, blob = _glb_load_single_buffer(glb)
+        roots = _scene_roots(doc, 0)
+        _remap_indices(doc, {k: _Offset(k) for k in _GLTF_ARRAYS}, _Offset('blob'))
+        doc.setdefault('nodes', []).append({'name': name, 'children': [_Ref('nodes', root) for root in roots],
+                                            'extras': {_EXTRAS_NAME_KEY: name}})
+        self.counts = {k: len(doc.get(k, [])) for k in _GLTF_ARRAYS}
+        self.blob = blob + b'\0' * (-len(blob) % 4)
+        self.extensions = {k: doc[k] for k in ('extensionsUsed', 'extensionsRequired') if k in doc}
+        self._templates = {k: _template(doc[k]) for k in _GLTF_ARRAYS if len(doc.get(k, [])) > 0}
+        self._rendered = None
+
+    def render(self, base: Dict[str, int]) -> Dict[str, str]:
+        """The serialized elements of each non-empty array, with the references offset by the given bases"""
+        if self._rendered is not None and self._rendered[0] == base:
+            return self._rendered[1]
+        rendered = {}
+        for k, (texts, refs) in self._templates.items():
+            parts = [texts[0]]
+            for (kind, index), text in zip(refs, texts[1:]):
+                parts.append(str(index + base[kind]))
+                parts.append(text)
+            rendered[k] = ''.join(parts)
+        self._rendered = dict(base), rendered
+        return rendered
+
+
+class _Ref:
+    """A symbolic cross-reference to the index-th element of an array (or byte of the buffer) of a fragment"""
+
+    def __init__(self, kind: str, index: int):
+        self.kind = kind
+        self.index = index
+
+
+class _Offset:
+    """The symbolic base of the indices of a kind of reference, turning the remapped indices into `_Ref`s"""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+
+    def __radd__(self, index: int) -> _Ref:
+        return _Ref(self.kind, index)
+
+
+_REF_PATTERN = re.compile(r'"\\u0000(\w+):(\d+)"')
+"""How a `_Ref` is serialized (as a string that is not valid in a GLTF document)"""
+
+
+def _template(values: list) -> Tuple[List[str], List[Tuple[str, int]]]:
+    """Serialize the elements of an array with `_Ref`s, splitting the text around them"""
+    text = json.dumps(values, separators=(',', ':'), default=lambda ref: f'\0{ref.kind}:{ref.index}')[1:-1]
+    parts = _REF_PATTERN.split(text)
+    return parts[::3], [(kind, int(index)) for kind, index in zip(parts[1::3], parts[2::3])]
+
+
+def _glb_load(glb: bytes) -> Tuple[dict, Optional[bytes]]:
+    """Split a GLB blob into its JSON document and its binary chunk (if any)"""
+    magic, version, length = struct.unpack_from('<4sII', glb, 0)
+    if magic != _GLB_MAGIC or version != 2:
+        raise ValueError('Not a GLB 2.0 file')
+    doc, blob = None, None
+    offset = 12
+    while offset < length:
+        chunk_length, chunk_type = struct.unpack_from('<II', glb, offset)
+        chunk = glb[offset + 8:offset + 8 + chunk_length]
+        if chunk_type == _GLB_CHUNK_JSON:
+            doc = json.loads(chunk)
+        elif chunk_type == _GLB_CHUNK_BIN and blob is None:
+            blob = chunk
+        offset += 8 + chunk_length
+    if doc is None:
+        raise ValueError('GLB file without JSON chunk')
+    return doc, blob
+
+
+def _glb_load_single_buffer(glb: bytes) -> Tuple[dict, bytes]:
+    """Load a GLB blob, merging all of its (embedded) buffers into a single one"""
+    doc, bin_chunk = _glb_load(glb)
+    merged = b''
+    buffer_offsets = []
+    for i, buffer in enumerate(doc.get('buffers', [])):
+        uri = buffer.get('uri')
+        if uri is None and i == 0:
+            data = bin_chunk or b''
+        elif uri is not None and uri.startswith('data:'):
+            data = base64.b64decode(uri.split(',', 1)[1])
+        else:
+            raise ValueError(f'Cannot compose GLB with external buffer: {uri}')
+        merged += b'\0' * (-len(merged) % 4)
+        buffer_offsets.append(len(merged))
+        merged += data
+    for view in doc.get('bufferViews', []):
+        view['byteOffset'] = view.get('byteOffset', 0) + buffer_offsets[view['buffer']]
+        view['buffer'] = 0
+    doc.pop('buffers', None)
+    return doc, merged
+
+
+def _glb_pack(doc_bytes: bytes, blob: bytes) -> bytes:
+    """Join a serialized JSON document and its binary buffer into a GLB blob"""
+    doc_bytes += b' ' * (-len(doc_bytes) % 4)
+    blob += b'\0' * (-len(blob) % 4)
+    length = 12 + 8 + len(doc_bytes) + (8 + len(blob) if len(blob) > 0 else 0)
+    res = [struct.pack('<4sII', _GLB_MAGIC, 2, length), struct.pack('<II', len(doc_bytes), _GLB_CHUNK_JSON), doc_bytes]
+    if len(blob) > 0:
+        res += [struct.pack('<II', len(blob), _GLB_CHUNK_BIN), blob]
+    return b''.join(res)
+
+
+def _scene_roots(doc: dict, base: int) -> List[int]:
+    """Return the root nodes of the default scene of a document remapped to start at the given node index"""
+    scenes = doc.get('scenes', [])
+    if len(scenes) > 0:
+        return list(scenes[doc.get('scene', 0)].get('nodes', []))
+    # No scenes: every node that is not a child of another node is a root
+    nodes = doc.get('nodes', [])
+    children = set(c for n in nodes for c in n.get('children', []))
+    return [base + i for i in range(len(nodes)) if base + i not in children]
+
+
+def _remap_indices(doc: dict, base: Dict[str, int], blob_base: int) -> dict:
+    """Offset all the cross-references of a single-buffer document to append it to a composed document (in place)"""
+
+    def ref(obj: dict, key: str, kind: str):
+        if obj is not None and key in obj:
+            obj[key] += base[kind]
+
+    for node in doc.get('nodes', []):
+        if 'children' in node:
+            node['children'] = [c + base['nodes'] for c in node['children']]
+        ref(node, 'mesh', 'meshes')
+        ref(node, 'skin', 'skins')
+        ref(node, 'camera', 'cameras')
+    for mesh in doc.get('meshes', []):
+        for prim in mesh.get('primitives', []):
+            prim['attributes'] = {k: v + base['accessors'] for k, v in prim.get('attributes', {}).items()}
+            prim['targets'] = [{k: v + base['accessors'] for k, v in t.items()} for t in prim.get('targets', [])]
+            if len(prim['targets']) == 0:
+                del prim['targets']
+            ref(prim, 'indices', 'accessors')
+            ref(prim, 'material', 'materials')
+    for accessor in doc.get('accessors', []):
+        ref(accessor, 'bufferView', 'bufferViews')
+        ref(accessor.get('sparse', {}).get('indices'), 'bufferView', 'bufferViews')
+        ref(accessor.get('sparse', {}).get('values'), 'bufferView', 'bufferViews')
+    for view in doc.get('bufferViews', []):
+        view['byteOffset'] = view.get('byteOffset', 0) + blob_base
+    for material in doc.get('materials', []):
+        pbr = material.get('pbrMetallicRoughness', {})
+        for tex_info in (pbr.get('baseColorTexture'), pbr.get('metallicRoughnessTexture'),
+                         material.get('normalTexture'), material.get('occlusionTexture'),
+                         material.get('emissiveTexture')):
+            ref(tex_info, 'index', 'textures')
+    for texture in doc.get('textures', []):
+        ref(texture, 'source', 'images')
+        ref(texture, 'sampler', 'samplers')
+    for image in doc.get('images', []):
+        ref(image, 'bufferView', 'bufferViews')
+    for skin in doc.get('skins', []):
+        ref(skin, 'inverseBindMatrices', 'accessors')
+        ref(skin, 'skeleton', 'nodes')
+        skin['joints'] = [j + base['nodes'] for j in skin.get('joints', [])]
+    for animation in doc.get('animations', []):
+        for channel in animation.get('channels', []):
+            ref(channel.get('target'), 'node', 'nodes')
+        for sampler in animation.get('samplers', []):
+            ref(sampler, 'input', 'accessors')
+            ref(sampler, 'output', 'accessors')
+    for scene in doc.get('scenes', []):
+        scene['nodes'] = [n + base['nodes'] for n in scene.get('nodes', [])]
+    return doc
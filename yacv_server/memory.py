@@ -0,0 +1,199 @@
+"""Memory policy of the server: what to keep of each object after building it, and a budgeted LRU of built GLBs."""
+import atexit
+import collections
+import io
+import os
+import shutil
+import tempfile
+import threading
+from enum import Enum, auto
+from typing import Optional, Tuple, TYPE_CHECKING
+
+from yacv_server.mylogger import logger
+
+if TYPE_CHECKING:
+    from OCP.TopoDS import TopoDS_Shape
+
+
+class ShapeRetention(Enum):
+    """What to do with the OCCT shape of an object after building its GLB"""
+    KEEP = auto()
+    """Keep the shape in memory. The default."""
+    RELEASE = auto()
+    """Release the shape, so that only the GLB remains in memory. The GLB can no longer be evicted from the cache."""
+    SPILL = auto()
+    """Write the shape to a temporary binary BRep file and release it, reading it back if the GLB must be rebuilt."""
+
+
+def parse_size(size: Optional[str]) -> Optional[int]:
+    """Parses a size in bytes with an optional K, M or G suffix (powers of 1024), or None if not set"""
+    if size is None or size.strip() == '':
+        return None
+    size = size.strip().upper().rstrip('B').rstrip('I')
+    multiplier = 1
+    if size[-1:] in ('K', 'M', 'G'):
+        multiplier = 1024 ** ('KMG'.index(size[-1]) + 1)
+        size = size[:-1]
+    return int(float(size) * multiplier)
+
+
+def rss_bytes() -> Optional[int]:
+    """Returns the resident memory of this process in bytes, or None if not available on this platform"""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def shape_to_brep(shape: 'TopoDS_Shape') -> bytes:
+    """Serializes a shape (without triangulations) to binary BRep, e.g. to build it in another process"""
+    from OCP.BinTools import BinTools, BinTools_FormatVersion
+    buffer = io.BytesIO()
+    BinTools.Write_s(shape, buffer, False, False, BinTools_FormatVersion.BinTools_FormatVersion_CURRENT)
+    return buffer.getvalue()
+
+
+def brep_to_shape(data: bytes) -> 'TopoDS_Shape':
+    """Reads back a shape serialized with `shape_to_brep` (or the contents of a spilled shape)"""
+    from OCP.BinTools import BinTools
+    from OCP.TopoDS import TopoDS_Shape
+    shape = TopoDS_Shape()
+    BinTools.Read_s(shape, io.BytesIO(data))
+    return shape
+
+
+class ShapeSpill:
+    """Temporary directory of shapes written as binary BRep files"""
+
+    _dir: Optional[str]
+    _count: int
+    _lock: threading.Lock
+
+    def __init__(self):
+        self._dir = None
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def spill(self, shape: 'TopoDS_Shape') -> Optional[str]:
+        """Writes the shape (without triangulations) to a new file, returning its path or None on failure"""
+        from OCP.BinTools import BinTools, BinTools_FormatVersion
+        with self._lock:
+            if self._dir is None:
+                self._dir = tempfile.mkdtemp(prefix='yacv_spill_')
+                atexit.register(shutil.rmtree, self._dir, ignore_errors=True)
+            self._count += 1
+            path = os.path.join(self._dir, f'{self._count}.brep')
+        if not BinTools.Write_s(shape, path, False, False, BinTools_FormatVersion.BinTools_FormatVersion_CURRENT):
+            logger.warning('Could not spill shape to %s, keeping it in memory', path)
+            return None
+        return path
+
+    @staticmethod
+    def load(path: str) -> 'TopoDS_Shape':
+        """Reads back a spilled shape"""
+        from OCP.BinTools import BinTools
+        from OCP.TopoDS import TopoDS_Shape
+        shape = TopoDS_Shape()
+        if not BinTools.Read_s(shape, path):
+            raise IOError(f'Could not read spilled shape from {path}')
+        return shape
+
+    @staticmethod
+    def delete(path: str):
+        """Deletes a spilled shape that is no longer needed"""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class GLBCache:
+    """Thread-safe LRU of built GLBs by object name, evicting the least recently used ones that can be rebuilt once
+    the byte budget or the resident memory budget of the process is exceeded (see `enforce_budget`)."""
+
+    max_bytes: Optional[int]
+    """The maximum total size of the cached GLBs (unbounded if None)"""
+    max_rss: Optional[int]
+    """The maximum resident memory of the process before evicting GLBs (unbounded if None)"""
+    nbytes: int
+    """The total size of the cached GLBs"""
+    hits: int
+    misses: int
+    evictions: int
+    _entries: 'collections.OrderedDict[str, Tuple[str, bytes, bool]]'
+    """(hash, GLB, evictable) by name, least recently used first"""
+    _lock: threading.Lock
+
+    def __init__(self, max_bytes: Optional[int] = None, max_rss: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.max_rss = max_rss
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name: str, _hash: str) -> Optional[bytes]:
+        """Returns the cached GLB of this version of the object, if any"""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry[0] != _hash:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+            return entry[1]
+
+    def contains(self, name: str, _hash: str) -> bool:
+        """Whether this version of the object is cached (without counting a hit or a miss)"""
+        with self._lock:
+            entry = self._entries.get(name)
+            return entry is not None and entry[0] == _hash
+
+    def put(self, name: str, _hash: str, glb: bytes, evictable: bool = True):
+        """Caches the GLB of an object (replacing any previous version), evicting others if over budget. Set evictable
+        to False if it could not be rebuilt."""
+        with self._lock:
+            self._discard(name)
+            self._entries[name] = (_hash, glb, evictable)
+            self.nbytes += len(glb)
+        self.enforce_budget(keep=name)
+
+    def discard(self, name: str):
+        """Forgets the GLB of an object (e.g. when it is replaced or removed)"""
+        with self._lock:
+            self._discard(name)
+
+    def _discard(self, name: str):
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            self.nbytes -= len(entry[1])
+
+    def enforce_budget(self, keep: Optional[str] = None):
+        """Evicts the least recently used GLBs (except keep) until within budget or nothing else can be evicted.
+
+        The resident memory budget only evicts GLBs if that would bring the process within it: most of the memory is
+        usually shapes and other data that evicting GLBs cannot free, and emptying the cache would only rebuild them."""
+        if self.max_bytes is None and self.max_rss is None:
+            return
+        rss = rss_bytes() if self.max_rss is not None else None
+        with self._lock:
+            max_nbytes = self.max_bytes if self.max_bytes is not None else self.nbytes
+            if rss is not None and rss > self.max_rss:
+                evictable_nbytes = sum(len(glb) for name, (_hash, glb, evictable) in self._entries.items()
+                                       if evictable and name != keep)
+                if rss - evictable_nbytes <= self.max_rss:
+                    max_nbytes = min(max_nbytes, self.nbytes - (rss - self.max_rss))
+            for name in list(self._entries.keys()):
+                if self.nbytes <= max_nbytes:
+                    break
+                _hash, glb, evictable = self._entries[name]
+                if evictable and name != keep:
+                    self._discard(name)
+                    self.evictions += 1
+                    logger.debug('Evicted GLB of %s (%d bytes) from the cache', name, len(glb))
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,198 @@
+"""Lightweight performance metrics (counters, gauges and histograms) exported in the Prometheus text format."""
+import bisect
+import contextlib
+import threading
+import time
+from typing import Dict, Tuple, Callable, Optional, List, Any, Iterator
+
+from yacv_server.tracing import tracer
+
+Labels = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+"""Upper bounds of the histogram buckets in seconds (a +Inf bucket is always added)"""
+
+
+class Histogram:
+    """Cumulative histogram of observed values"""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """Returns the (upper bound, cumulative count) of each bucket"""
+        res, total = [], 0
+        for bound, count in zip([*map(_format_value, self.buckets), '+Inf'], self.counts):
+            total += count
+            res.append((bound, total))
+        return res
+
+
+class Metrics:
+    """A thread-safe registry of metrics, identified by name and labels"""
+
+    _lock: threading.Lock
+    _help: Dict[str, Tuple[str, str]]
+    """(type, help) of each metric name"""
+    _counters: Dict[Tuple[str, Labels], float]
+    _histograms: Dict[Tuple[str, Labels], Histogram]
+    _callbacks: Dict[Tuple[str, Labels], Callable[[], Optional[float]]]
+    """Metrics whose value is read when collected (e.g. the current number of subscribers)"""
+    _local: threading.local
+    """The phase timings being collected by each thread, if any (see timings())"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+        self._callbacks = {}
+
+    def describe(self, name: str, kind: str, help_text: str):
+        """Sets the type (counter, gauge or histogram) and help text of a metric"""
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        """Increments a counter"""
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str):
+        """Adds a value to a histogram"""
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def callback(self, name: str, fn: Callable[[], Optional[float]], **labels: str):
+        """Registers a function that returns the value of a metric (or None to skip it) when collected"""
+        with self._lock:
+            self._callbacks[(name, _labels(labels))] = fn
+
+    @contextlib.contextmanager
+    def phase(self, phase: str, **args: Any):
+        """Context manager that times a phase of the work into the yacv_phase_seconds histogram, the timings being
+        collected by this thread and the trace (with the extra args)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.observe('yacv_phase_seconds', end - start, phase=phase)
+            timings = getattr(self._local, 'timings', None)
+            if timings is not None:
+                timings[phase] = timings.get(phase, 0.0) + end - start
+            tracer.complete(phase, start, end, 'phase', **args)
+
+    @contextlib.contextmanager
+    def timings(self) -> Iterator[Dict[str, float]]:
+        """Context manager that collects the total seconds spent in each phase by this thread within its body"""
+        previous = getattr(self._local, 'timings', None)
+        self._local.timings = res = {}
+        try:
+            yield res
+        finally:
+            self._local.timings = previous
+
+    def _collect(self) -> Tuple[Dict[Tuple[str, Labels], float], Dict[Tuple[str, Labels], Histogram]]:
+        with self._lock:
+            values = dict(self._counters)
+            histograms = {key: _copy_histogram(h) for key, h in self._histograms.items()}
+            callbacks = list(self._callbacks.items())
+        for key, fn in callbacks:  # Outside the lock, as they may take other locks
+            value = fn()
+            if value is not None:
+                values[key] = value
+        return values, histograms
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns a snapshot of all metrics by series (e.g. 'yacv_phase_seconds{phase="hashcode"}'). Histograms are
+        summarized as a dictionary with their count, sum and cumulative buckets."""
+        values, histograms = self._collect()
+        res: Dict[str, Any] = {_series(name, labels): value for (name, labels), value in values.items()}
+        for (name, labels), histogram in histograms.items():
+            res[_series(name, labels)] = {'count': histogram.count, 'sum': histogram.sum,
+                                          'buckets': dict(histogram.cumulative())}
+        return dict(sorted(res.items()))
+
+    def render(self) -> str:
+        """Renders all metrics in the Prometheus text exposition format (version 0.0.4)"""
+        values, histograms = self._collect()
+        by_name: Dict[str, List[str]] = {}
+        for (name, labels), value in sorted(values.items()):
+            by_name.setdefault(name, []).append(f'{_series(name, labels)} {_format_value(value)}')
+        for (name, labels), histogram in sorted(histograms.items(), key=lambda item: item[0]):
+            lines = by_name.setdefault(name, [])
+            for bound, count in histogram.cumulative():
+                lines.append(f'{_series(name + "_bucket", labels + (("le", bound),))} {count}')
+            lines.append(f'{_series(name + "_sum", labels)} {_format_value(histogram.sum)}')
+            lines.append(f'{_series(name + "_count", labels)} {histogram.count}')
+        out = []
+        for name in sorted(by_name):
+            kind, help_text = self._help.get(name, ('untyped', ''))
+            if help_text:
+                out.append(f'# HELP {name} {help_text}')
+            out.append(f'# TYPE {name} {kind}')
+            out.extend(by_name[name])
+        return '\n'.join(out) + '\n'
+
+
+def server_timing(timings: Dict[str, float], total: Optional[float] = None) -> str:
+    """Formats phase timings in seconds as the value of a Server-Timing HTTP header"""
+    entries = [f'{phase};dur={seconds * 1000:.1f}' for phase, seconds in timings.items()]
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _series(name: str, labels: Labels) -> str:
+    if len(labels) == 0:
+        return name
+    escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return name + '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _copy_histogram(histogram: Histogram) -> Histogram:
+    res = Histogram(histogram.buckets)
+    res.counts = list(histogram.counts)
+    res.sum = histogram.sum
+    res.count = histogram.count
+    return res
+
+
+metrics = Metrics()
+"""The default registry, shared by all the modules of the server"""
+
+metrics.describe('yacv_phase_seconds', 'histogram', 'Time spent in each phase of showing and building objects')
+metrics.describe('yacv_shows_total', 'counter', 'Objects shown (including those later superseded)')
+metrics.describe('yacv_builds_total', 'counter', 'Objects tessellated and converted to GLB')
+metrics.describe('yacv_requests_total', 'counter', 'HTTP API requests by endpoint')
+metrics.describe('yacv_served_bytes_total', 'counter', 'Bytes of API responses sent by endpoint')
+metrics.describe('yacv_glb_cache_hits_total', 'counter', 'Requests of built objects served from the GLB cache')
+metrics.describe('yacv_glb_cache_misses_total', 'counter', 'Requests of built objects missing from the GLB cache')
+metrics.describe('yacv_glb_cache_evictions_total', 'counter', 'Built objects evicted from the GLB cache')
+metrics.describe('yacv_glb_cache_bytes', 'gauge', 'Total size of the GLB cache')
+metrics.describe('yacv_scene_objects', 'gauge', 'Objects currently in the scene')
+metrics.describe('yacv_update_subscribers', 'gauge', 'Connected update clients (SSE and WebSocket)')
+metrics.describe('yacv_resident_memory_bytes', 'gauge', 'Resident memory of the process')
@@ -0,0 +1,519 @@
+"""An asyncio-based alternative to ThreadingHTTPServer + HTTPHandler.
+
+All connections (including long-lived /api/updates streams) share a single event loop, while CPU-bound object builds
+run in a thread pool executor. Only the standard library is used.
+"""
+
+import asyncio
+import contextlib
+import mimetypes
+import os
+import posixpath
+import socket
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPMethod, HTTPStatus
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from yacv_server.metrics import metrics
+from yacv_server.myhttp import (
+    FRONTEND_BASE_PATH,
+    METRICS_API_PATH,
+    METRICS_CONTENT_TYPE,
+    OBJECT_STREAM_CONTENT_TYPE,
+    OBJECTS_API_PATH,
+    PROFILE_API_PATH,
+    SCENE_API_PATH,
+    SLOW_CLIENT_TIMEOUT,
+    UPDATES_API_PATH,
+    WS_API_PATH,
+    WS_OPCODE_BINARY,
+    WS_OPCODE_CLOSE,
+    WS_OPCODE_PING,
+    WS_OPCODE_PONG,
+    WS_OPCODE_TEXT,
+    format_updates,
+    parse_api_request,
+    parse_query_flag,
+    profile_response,
+    timed_export,
+    updates_json,
+    ws_accept_key,
+    ws_frame_header,
+    ws_frame_parser,
+    ws_glb_to_push,
+)
+from yacv_server.mylogger import logger
+
+_MAX_HEADERS_SIZE = 64 * 1024
+
+
+class AsyncHTTPServer:
+    """Serves the same API and frontend files as HTTPHandler, with the server API of socketserver"""
+
+    yacv: "yacv.YACV"
+    server_name: str
+    server_port: int
+
+    def __init__(self, server_address: Tuple[str, int], yacv: "yacv.YACV"):
+        self.yacv = yacv
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(thread_name_prefix="yacv_build")
+        self._connections: Set[asyncio.Task] = set()
+        self._shutdown_request = asyncio.Event()
+        self._stopped = threading.Event()
+        # Bind immediately (like socketserver) so that the port is known after construction
+        self._server = self.loop.run_until_complete(
+            asyncio.start_server(self._handle_connection, *server_address)
+        )
+        host, port = self._server.sockets[0].getsockname()[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+
+    def serve_forever(self):
+        """Runs the event loop until shutdown() is called"""
+        try:
+            self.loop.run_until_complete(self._serve_until_shutdown())
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.loop.close()
+            self._stopped.set()
+
+    def shutdown(self):
+        """Stops serve_forever() from any thread and waits for it to finish"""
+        self.loop.call_soon_threadsafe(self._shutdown_request.set)
+        self._stopped.wait()
+
+    async def _serve_until_shutdown(self):
+        await self._shutdown_request.wait()
+        self._server.close()
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        """Handles all the requests of a (keep-alive) connection"""
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                if len(head) > _MAX_HEADERS_SIZE:
+                    break
+                keep_alive = await _AsyncRequest(self, reader, writer, head).handle()
+        except (BrokenPipeError, ConnectionResetError):  # Client disconnected normally
+            pass
+        except asyncio.CancelledError:  # Server shutting down
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+
+class _AsyncRequest:
+    """A single HTTP request, mirroring the behavior of HTTPHandler"""
+
+    def __init__(
+        self,
+        server: AsyncHTTPServer,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        head: bytes,
+    ):
+        self.server = server
+        self.yacv = server.yacv
+        self.reader = reader
+        self.writer = writer
+        lines = head.decode("iso-8859-1").split("\r\n")
+        self.requestline = lines[0]
+        parts = self.requestline.split(" ")
+        self.method = parts[0] if len(parts) == 3 else ""
+        self.path = parts[1] if len(parts) == 3 else ""
+        self.version = parts[2] if len(parts) == 3 else ""
+        self.headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                self.headers[k.strip().lower()] = v.strip()
+        self.keep_alive = (
+            self.version == "HTTP/1.1"
+            and self.headers.get("connection", "").lower() != "close"
+        )
+
+    async def handle(self) -> bool:
+        """Handles the request, returning whether the connection can be reused"""
+        if self.method == HTTPMethod.OPTIONS:
+            await self.send(HTTPStatus.NO_CONTENT, {}, b"")
+            return self.keep_alive
+        if self.method not in (HTTPMethod.GET, HTTPMethod.HEAD):
+            await self.send_error(HTTPStatus.NOT_IMPLEMENTED, "Unsupported method")
+            return False
+        api, arg = parse_api_request(self.path)
+        if api is not None:
+            metrics.inc("yacv_requests_total", endpoint=api)
+        if api == UPDATES_API_PATH:
+            await self._api_updates(self.headers.get("last-event-id") or arg)
+            return False  # The stream is only finished when the connection is closed
+        elif api == OBJECTS_API_PATH:
+            full = parse_query_flag(self.path, "full")
+            if parse_query_flag(self.path, "stream"):
+                await self._api_object_stream(arg, full)
+            else:
+                await self._api_object(arg, full)
+        elif api == SCENE_API_PATH:
+            await self._api_scene()
+        elif api == WS_API_PATH:
+            await self._api_ws(arg, parse_query_flag(self.path, "glb"))
+            return False  # The connection now belongs to the WebSocket
+        elif api == METRICS_API_PATH:
+            await self.send(
+                HTTPStatus.OK,
+                {"Content-Type": METRICS_CONTENT_TYPE, "Cache-Control": "no-cache"},
+                metrics.render().encode("utf-8"),
+            )
+        elif api == PROFILE_API_PATH:
+            response = profile_response(
+                self.yacv, arg, parse_query_flag(self.path, "pstats")
+            )
+            if response is None:
+                await self.send_error(HTTPStatus.NOT_FOUND, f"No profile of {arg}")
+            else:
+                headers, body = response
+                await self.send(
+                    HTTPStatus.OK, {**headers, "Cache-Control": "no-cache"}, body
+                )
+        else:
+            await self._frontend_file()
+        return self.keep_alive
+
+    def log_request(self, status: HTTPStatus):
+        logger.debug('"%s" %s', self.requestline, status.value)
+
+    def _start_response(self, status: HTTPStatus, headers: Dict[str, str]):
+        self.log_request(status)
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+        headers = {
+            "Server": "yacv_server",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+            **headers,
+        }
+        if not self.keep_alive:
+            headers["Connection"] = "close"
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("iso-8859-1"))
+
+    async def send(self, status: HTTPStatus, headers: Dict[str, str], body: bytes):
+        """Sends a complete response (the body is skipped for HEAD requests)"""
+        self._start_response(status, {"Content-Length": str(len(body)), **headers})
+        if self.method != HTTPMethod.HEAD:
+            self.writer.write(body)
+        await self.writer.drain()
+
+    async def send_error(self, status: HTTPStatus, message: str):
+        body = f"Error {status.value}: {message}\n".encode("utf-8")
+        await self.send(status, {"Content-Type": "text/plain; charset=utf-8"}, body)
+
+    async def _api_updates(self, last_event_id: Optional[str] = None):
+        """Streams show_object events, like HTTPHandler._api_updates but without a dedicated thread"""
+        # Avoid accepting new connections while shutting down
+        if self.yacv.shutting_down.is_set() and self.yacv.at_least_one_client.is_set():
+            await self.send_error(
+                HTTPStatus.SERVICE_UNAVAILABLE, "Server is shutting down"
+            )
+            return
+
+        self.keep_alive = False
+        if self.method == HTTPMethod.HEAD:
+            await self.send(
+                HTTPStatus.OK,
+                {"Content-Type": "text/event-stream", "Cache-Control": "no-cache"},
+                b"",
+            )
+            return
+        self._start_response(
+            HTTPStatus.OK,
+            {
+                "Content-Type": "text/event-stream",
+                "Cache-Control": "no-cache",
+                "Transfer-Encoding": "chunked",
+            },
+        )
+
+        # Keep a shared read lock to know if any frontend is still working before shutting down
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.yacv.frontend_lock.r_acquire)
+        try:
+            self.yacv.at_least_one_client.set()
+            logger.debug("Updates client connected")
+
+            async def write_chunk(_chunk_data: str):
+                data = _chunk_data.encode("utf-8")
+                self.writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+                await asyncio.wait_for(self.writer.drain(), SLOW_CLIENT_TIMEOUT)
+                metrics.inc(
+                    "yacv_served_bytes_total", len(data), endpoint=UPDATES_API_PATH
+                )
+
+            await write_chunk("retry: 100\n\n")
+
+            subscription = self.yacv.show_events.asubscribe(
+                yield_timeout=1.0,  # Keep-alive interval
+                since=self.yacv.show_events.parse_event_id(last_event_id),
+                batched=True,
+            )
+            try:
+                async for seq_and_events in subscription:
+                    if seq_and_events is None:
+                        await write_chunk(":keep-alive\n\n")
+                    else:
+                        await write_chunk(format_updates(self.yacv, seq_and_events))
+            except asyncio.TimeoutError:
+                # Client too slow, it will reconnect and resume
+                logger.warning("Disconnected an updates client that stopped reading")
+            finally:
+                await subscription.aclose()
+        finally:
+            self.yacv.frontend_lock.r_release()
+            logger.debug("Updates client disconnected")
+
+    async def _api_ws(self, last_event_id: Optional[str], send_glb: bool):
+        """Handles a WebSocket connection like HTTPHandler._api_ws, with builds running in the executor"""
+        key = self.headers.get("sec-websocket-key")
+        if self.headers.get("upgrade", "").lower() != "websocket" or key is None:
+            self.keep_alive = False
+            await self.send_error(
+                HTTPStatus.BAD_REQUEST, "Expected a WebSocket upgrade"
+            )
+            return
+        # Avoid accepting new connections while shutting down
+        if self.yacv.shutting_down.is_set() and self.yacv.at_least_one_client.is_set():
+            await self.send_error(
+                HTTPStatus.SERVICE_UNAVAILABLE, "Server is shutting down"
+            )
+            return
+
+        self.keep_alive = True  # Do not send "Connection: close" in the handshake
+        self._start_response(
+            HTTPStatus.SWITCHING_PROTOCOLS,
+            {
+                "Upgrade": "websocket",
+                "Connection": "Upgrade",
+                "Sec-WebSocket-Accept": ws_accept_key(key),
+            },
+        )
+
+        async def send_frame(opcode: int, *payload: bytes):
+            # Each frame is written without awaiting in between, so frames never interleave
+            length = sum(map(len, payload))
+            self.writer.write(ws_frame_header(opcode, length))
+            for part in payload:
+                self.writer.write(part)
+            await asyncio.wait_for(self.writer.drain(), SLOW_CLIENT_TIMEOUT)
+            metrics.inc("yacv_served_bytes_total", length, endpoint=WS_API_PATH)
+
+        closed = asyncio.Event()
+
+        async def read_frames():
+            try:
+                while True:
+                    opcode, payload = await _ws_read_frame(self.reader.readexactly)
+                    if opcode == WS_OPCODE_PING:
+                        await send_frame(WS_OPCODE_PONG, payload)
+                    elif opcode == WS_OPCODE_CLOSE:
+                        await send_frame(WS_OPCODE_CLOSE, payload[:2])
+                        break
+            except (OSError, ValueError, asyncio.IncompleteReadError):
+                pass  # Client disconnected or misbehaving
+            except asyncio.TimeoutError:
+                pass  # Client too slow
+            finally:
+                closed.set()
+
+        # Keep a shared read lock to know if any frontend is still working before shutting down
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.yacv.frontend_lock.r_acquire)
+        reader_task = asyncio.create_task(read_frames())
+        try:
+            self.yacv.at_least_one_client.set()
+            logger.debug("WebSocket client connected")
+
+            subscription = self.yacv.show_events.asubscribe(
+                yield_timeout=1.0,  # Keep-alive interval
+                since=self.yacv.show_events.parse_event_id(last_event_id),
+                batched=True,
+            )
+            sent: Dict[str, str] = {}
+            try:
+                async for seq_and_events in subscription:
+                    if closed.is_set():
+                        break
+                    if seq_and_events is None:
+                        await send_frame(WS_OPCODE_PING)
+                        continue
+                    if send_glb:
+                        for _, event in seq_and_events:
+                            to_push = await loop.run_in_executor(
+                                self.server.executor,
+                                ws_glb_to_push,
+                                self.yacv,
+                                event,
+                                sent,
+                            )
+                            if to_push is not None:
+                                await send_frame(WS_OPCODE_BINARY, *to_push)
+                    event_id, to_send = updates_json(self.yacv, seq_and_events)
+                    message = f'{{"id": "{event_id}", "data": {to_send}}}'
+                    await send_frame(WS_OPCODE_TEXT, message.encode("utf-8"))
+            except asyncio.TimeoutError:
+                # Client too slow, it will reconnect and resume
+                logger.warning("Disconnected a WebSocket client that stopped reading")
+            finally:
+                await subscription.aclose()
+        finally:
+            reader_task.cancel()
+            self.yacv.frontend_lock.r_release()
+            logger.debug("WebSocket client disconnected")
+
+    async def _api_object(self, obj_name: str, full: bool = False):
+        """Returns the object file with the matching name, building it in the executor if necessary."""
+        loop = asyncio.get_running_loop()
+        _export, timing = await loop.run_in_executor(
+            self.server.executor, timed_export, self.yacv.export, obj_name, full
+        )
+        if _export is None:
+            await self.send_error(HTTPStatus.NOT_FOUND, f"Object {obj_name} not found")
+            return
+
+        exported_glb, _hash = _export
+        await self.send(
+            HTTPStatus.OK,
+            {
+                "Content-Type": "model/gltf-binary",
+                "Content-Disposition": f'attachment; filename="{obj_name}.glb"',
+                "E-Tag": f'"{_hash}"',
+                "Server-Timing": timing,
+                "Timing-Allow-Origin": "*",
+            },
+            exported_glb,
+        )
+        metrics.inc(
+            "yacv_served_bytes_total", len(exported_glb), endpoint=OBJECTS_API_PATH
+        )
+
+    async def _api_object_stream(self, obj_name: str, full: bool = False):
+        """Streams the object with the matching name like HTTPHandler._api_object_stream, building each GLB blob in
+        the executor"""
+        loop = asyncio.get_running_loop()
+        chunks = await loop.run_in_executor(
+            self.server.executor, self.yacv.export_stream, obj_name, full
+        )
+        if chunks is None:
+            await self.send_error(HTTPStatus.NOT_FOUND, f"Object {obj_name} not found")
+            return
+
+        self.keep_alive = False
+        headers = {
+            "Content-Type": OBJECT_STREAM_CONTENT_TYPE,
+            "Cache-Control": "no-cache",
+        }
+        if self.method == HTTPMethod.HEAD:
+            chunks.close()
+            await self.send(HTTPStatus.OK, headers, b"")
+            return
+        self._start_response(HTTPStatus.OK, {**headers, "Transfer-Encoding": "chunked"})
+        try:
+            while True:
+                glb = await loop.run_in_executor(
+                    self.server.executor, next, chunks, None
+                )
+                if glb is None:
+                    break
+                self.writer.write(b"%x\r\n%s\r\n" % (len(glb), glb))
+                await asyncio.wait_for(self.writer.drain(), SLOW_CLIENT_TIMEOUT)
+                metrics.inc(
+                    "yacv_served_bytes_total", len(glb), endpoint=OBJECTS_API_PATH
+                )
+            self.writer.write(b"0\r\n\r\n")
+            await asyncio.wait_for(self.writer.drain(), SLOW_CLIENT_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Disconnected an object stream client that stopped reading")
+        finally:
+            # If cancelled while building the next blob, it is closed when collected
+            with contextlib.suppress(ValueError):
+                chunks.close()
+
+    async def _api_scene(self):
+        """Returns all the objects composed into a single GLB file, building them in the executor if necessary."""
+        loop = asyncio.get_running_loop()
+        (exported_glb, _hash), timing = await loop.run_in_executor(
+            self.server.executor, timed_export, self.yacv.export_scene
+        )
+        await self.send(
+            HTTPStatus.OK,
+            {
+                "Content-Type": "model/gltf-binary",
+                "Content-Disposition": 'attachment; filename="scene.glb"',
+                "E-Tag": f'"{_hash}"',
+                "Server-Timing": timing,
+                "Timing-Allow-Origin": "*",
+            },
+            exported_glb,
+        )
+        metrics.inc(
+            "yacv_served_bytes_total", len(exported_glb), endpoint=SCENE_API_PATH
+        )
+
+    async def _frontend_file(self):
+        """Serves a static frontend file, with the same security checks as HTTPHandler.translate_path"""
+        if FRONTEND_BASE_PATH is None:
+            await self.send_error(HTTPStatus.NOT_FOUND, "Frontend not found")
+            return
+        path = self.path.split("?", 1)[0].split("#", 1)[0]
+        if path.endswith("/"):
+            path += "index.html"
+        path = posixpath.normpath(urllib.parse.unquote(path))
+        base = os.path.realpath(FRONTEND_BASE_PATH)
+        local_path = os.path.realpath(os.path.join(base, *path.split("/")))
+        if not local_path.startswith(base):
+            await self.send_error(
+                HTTPStatus.FORBIDDEN, "Path is not in the frontend directory"
+            )
+            return
+        if os.path.isdir(local_path):
+            local_path = os.path.join(local_path, "index.html")
+        if not os.path.isfile(local_path):
+            await self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return
+
+        body = await asyncio.get_running_loop().run_in_executor(
+            None, _read_file, local_path
+        )
+        content_type = mimetypes.guess_type(local_path)[0] or "application/octet-stream"
+        await self.send(HTTPStatus.OK, {"Content-Type": content_type}, body)
+
+
+async def _ws_read_frame(
+    read_exactly: Callable[[int], Awaitable[bytes]],
+) -> Tuple[int, bytes]:
+    """Like myhttp.ws_read_frame, but with an async read function"""
+    parser = ws_frame_parser()
+    try:
+        n = next(parser)
+        while True:
+            n = parser.send(await read_exactly(n))
+    except StopIteration as e:
+        return e.value
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
@@ -1,9 +1,17 @@
+import base64
+import hashlib
 import io
+import json
 import os
+import struct
+import threading
+import time
 import urllib.parse
 from http import HTTPMethod, HTTPStatus
 from http.server import SimpleHTTPRequestHandler
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple
 
+from yacv_server.metrics import metrics, server_timing
 from yacv_server.mylogger import logger
 
 # Find the frontend folder (optional, but recommended)
@@ -25,7 +33,201 @@ if not os.path.exists(FRONTEND_BASE_PATH) or not any(
 
 # Define the API paths (also available at the root path for simplicity)
 UPDATES_API_PATH = "/api/updates"
-OBJECTS_API_PATH = "/api/object"  # /{name}
+OBJECTS_API_PATH = "/api/object"  # /{name}, ?full=1 without max_triangles, ?stream=1
+# ?stream=1 sends the GLB blobs of an object one after another (each one has its length)
+OBJECT_STREAM_CONTENT_TYPE = "application/x-yacv-glb-stream"
+SCENE_API_PATH = "/api/scene"
+WS_API_PATH = "/api/ws"  # ?glb=1 to also push the built objects
+METRICS_API_PATH = "/api/metrics"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PROFILE_API_PATH = "/api/profile"  # /{name}, ?pstats=1 for the raw cProfile stats
+
+# Disconnect update clients that do not accept data for this long, they can resume later
+SLOW_CLIENT_TIMEOUT = float(os.getenv("YACV_SLOW_CLIENT_TIMEOUT", 30.0))
+
+
+def parse_api_request(request_path: str) -> Tuple[Optional[str], Optional[str]]:
+    """Returns the API path (or None for frontend files) and its argument (if any) of a request path with query"""
+    path_parts = request_path.split("?", 1)
+    if len(path_parts) == 1:
+        path_parts.append("")
+    [path, query_str] = path_parts
+    query = urllib.parse.parse_qs(query_str)
+    if path == UPDATES_API_PATH or path == "/" and query.get("api_updates") is not None:
+        last_event_id = query.get("last_event_id")  # Same as the Last-Event-ID header
+        return UPDATES_API_PATH, last_event_id.pop() if last_event_id else None
+    elif (
+        path.startswith(OBJECTS_API_PATH)
+        or path == "/"
+        and query.get("api_object") is not None
+    ):
+        if path.startswith(OBJECTS_API_PATH):
+            obj_name = urllib.parse.unquote(path[len(OBJECTS_API_PATH) + 1 :])
+        else:
+            obj_name = query.get("api_object").pop()
+        return OBJECTS_API_PATH, obj_name
+    elif path == SCENE_API_PATH or path == "/" and query.get("api_scene") is not None:
+        return SCENE_API_PATH, None
+    elif path == WS_API_PATH or path == "/" and query.get("api_ws") is not None:
+        last_event_id = query.get("last_event_id")
+        return WS_API_PATH, last_event_id.pop() if last_event_id else None
+    elif (
+        path == METRICS_API_PATH or path == "/" and query.get("api_metrics") is not None
+    ):
+        return METRICS_API_PATH, None
+    elif (
+        path.startswith(PROFILE_API_PATH + "/")
+        or path == "/"
+        and query.get("api_profile") is not None
+    ):
+        if path.startswith(PROFILE_API_PATH + "/"):
+            obj_name = urllib.parse.unquote(path[len(PROFILE_API_PATH) + 1 :])
+        else:
+            obj_name = query.get("api_profile").pop()
+        return PROFILE_API_PATH, obj_name
+    return None, None
+
+
+def parse_query_flag(request_path: str, name: str) -> bool:
+    """Returns whether a boolean query parameter is set (e.g. ?glb=1 or ?glb=true)"""
+    query = urllib.parse.parse_qs(
+        request_path.split("?", 1)[1] if "?" in request_path else ""
+    )
+    return query.get(name, ["false"])[-1].lower() in ("1", "true", "yes")
+
+
+def updates_json(
+    yacv: "yacv.YACV", seq_and_events: List[Tuple[int, any]]
+) -> Tuple[str, str]:
+    """Returns the event ID and JSON of show events received together.
+
+    A single event is sent as is, while several events (e.g. from a YACV.batch) are sent as
+    {"version": <sequence of the last event>, "batch": [<event>, ...]} to be applied at once.
+    """
+    seq = seq_and_events[-1][0]
+    event_id = yacv.show_events.event_id(seq)
+    for _, data in seq_and_events:
+        logger.debug("Sending info about %s: %s", data.name, data)
+    # noinspection PyUnresolvedReferences
+    events = [data.to_json() for _, data in seq_and_events]
+    if len(events) == 1:
+        return event_id, events[0]
+    return event_id, f'{{"version": {seq}, "batch": [{", ".join(events)}]}}'
+
+
+def format_updates(yacv: "yacv.YACV", seq_and_events: List[Tuple[int, any]]) -> str:
+    """Formats show events received together as a single SSE message (see updates_json)"""
+    event_id, to_send = updates_json(yacv, seq_and_events)
+    return f"id: {event_id}\ndata: {to_send}\n\n"
+
+
+def timed_export(fn: Callable[..., Any], *args: Any) -> Tuple[Any, str]:
+    """Calls an export function, also returning the Server-Timing header value with the time of each build phase"""
+    start = time.perf_counter()
+    with metrics.timings() as timings:
+        res = fn(*args)
+    return res, server_timing(timings, time.perf_counter() - start)
+
+
+def profile_response(
+    yacv: "yacv.YACV", obj_name: str, raw_stats: bool
+) -> Optional[Tuple[Dict[str, str], bytes]]:
+    """Returns the headers and body with the latest build profile of an object (or None if it was never profiled)"""
+    profile = yacv.profiler.get(obj_name)
+    if profile is None:
+        return None
+    if raw_stats:
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "Content-Disposition": f'attachment; filename="{obj_name}.prof"',
+        }
+        return headers, profile.stats
+    headers = {"Content-Type": "text/plain; charset=utf-8"}
+    return headers, profile.report.encode("utf-8")
+
+
+# Minimal WebSocket (RFC 6455) support for the /api/ws endpoint, without dependencies
+WS_OPCODE_TEXT = 0x1
+WS_OPCODE_BINARY = 0x2
+WS_OPCODE_CLOSE = 0x8
+WS_OPCODE_PING = 0x9
+WS_OPCODE_PONG = 0xA
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_WS_MAX_CLIENT_PAYLOAD = 64 * 1024  # Clients only send small control frames
+
+
+def ws_accept_key(key: str) -> str:
+    """Returns the Sec-WebSocket-Accept header value for a Sec-WebSocket-Key"""
+    digest = hashlib.sha1((key.strip() + _WS_GUID).encode("ascii")).digest()
+    return base64.b64encode(digest).decode("ascii")
+
+
+def ws_frame_header(opcode: int, length: int) -> bytes:
+    """Returns the header of a final, unmasked (server to client) frame with a payload of the given length"""
+    if length < 126:
+        return struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        return struct.pack("!BBH", 0x80 | opcode, 126, length)
+    return struct.pack("!BBQ", 0x80 | opcode, 127, length)
+
+
+def ws_frame_parser() -> Generator[int, bytes, Tuple[int, bytes]]:
+    """Parses a (client to server) frame without doing any I/O, so that it works for sync and async sockets.
+
+    It yields the number of bytes to read next, which must be sent back, and returns (opcode, unmasked payload).
+    Fragments are returned as separate frames (continuations have opcode 0).
+    """
+    b0, b1 = yield 2
+    length = b1 & 0x7F
+    if b0 & 0x08 and (length > 125 or not b0 & 0x80):
+        raise ValueError("WebSocket control frames must be final and short")
+    if length == 126:
+        (length,) = struct.unpack("!H", (yield 2))
+    elif length == 127:
+        (length,) = struct.unpack("!Q", (yield 8))
+    if length > _WS_MAX_CLIENT_PAYLOAD:
+        raise ValueError(f"WebSocket frame too large: {length} bytes")
+    mask = (yield 4) if b1 & 0x80 else None
+    payload = (yield length) if length > 0 else b""
+    if mask is not None:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return b0 & 0x0F, payload
+
+
+def ws_read_frame(read_exactly: Callable[[int], bytes]) -> Tuple[int, bytes]:
+    """Reads a (client to server) frame with a blocking read function, returning (opcode, payload)"""
+    parser = ws_frame_parser()
+    try:
+        n = next(parser)
+        while True:
+            n = parser.send(read_exactly(n))
+    except StopIteration as e:
+        return e.value
+
+
+def ws_glb_to_push(
+    yacv: "yacv.YACV", event: any, sent: Dict[str, str]
+) -> Optional[Tuple[bytes, bytes]]:
+    """Builds the object of a show event to push it to a WebSocket client, returning (header, glb) or None if the
+    client already has it or it is stale (a newer event will follow).
+
+    Binary messages are a big-endian uint32 with the length of the JSON header {"name": ..., "hash": ...}, followed
+    by the header and the GLB. They are sent before the update event that references them.
+    """
+    if event.is_remove is not False:
+        sent.pop(event.name, None)
+        return None
+    if sent.get(event.name) == event.hash:
+        return None
+    entry = yacv.scene.get(event.name)
+    if entry is None or entry.hash != event.hash:
+        return None  # Do not build superseded objects
+    _export = yacv.export(event.name)
+    if _export is None or _export[1] != event.hash:
+        return None
+    sent[event.name] = event.hash
+    header = json.dumps({"name": event.name, "hash": event.hash}).encode("utf-8")
+    return struct.pack("!I", len(header)) + header, _export[0]
 
 
 class HTTPHandler(SimpleHTTPRequestHandler):
@@ -58,35 +260,35 @@ class HTTPHandler(SimpleHTTPRequestHandler):
         return path
 
     def send_head(self):
-        path_parts = self.path.split("?", 1)
-        if len(path_parts) == 1:
-            path_parts.append("")
-        [path, query_str] = path_parts
-        query = urllib.parse.parse_qs(query_str)
-        if (
-            path == UPDATES_API_PATH
-            or path == "/"
-            and query.get("api_updates") is not None
-        ):
-            return self._api_updates()
-        elif (
-            path.startswith(OBJECTS_API_PATH)
-            or path == "/"
-            and query.get("api_object") is not None
-        ):
-            if path.startswith(OBJECTS_API_PATH):
-                obj_name = self.path[len(OBJECTS_API_PATH) + 1 :]
-            else:
-                obj_name = query.get("api_object").pop()
-            return self._api_object(obj_name)
-        elif path.endswith("/"):  # Frontend index.html
+        api, arg = parse_api_request(self.path)
+        if api is not None:
+            metrics.inc("yacv_requests_total", endpoint=api)
+        if api == UPDATES_API_PATH:
+            return self._api_updates(self.headers.get("Last-Event-ID") or arg)
+        elif api == OBJECTS_API_PATH:
+            full = parse_query_flag(self.path, "full")
+            if parse_query_flag(self.path, "stream"):
+                return self._api_object_stream(arg, full)
+            return self._api_object(arg, full)
+        elif api == SCENE_API_PATH:
+            return self._api_scene()
+        elif api == WS_API_PATH:
+            return self._api_ws(arg, parse_query_flag(self.path, "glb"))
+        elif api == METRICS_API_PATH:
+            return self._api_metrics()
+        elif api == PROFILE_API_PATH:
+            return self._api_profile(arg)
+        elif self.path.split("?", 1)[0].endswith("/"):  # Frontend index.html
             self.path += "index.html"
             return super().send_head()
         else:  # Normal frontend file
             return super().send_head()
 
-    def _api_updates(self):
-        """Handles a publish-only websocket connection that send show_object events along with their hashes and URLs"""
+    def _api_updates(self, last_event_id: Optional[str] = None):
+        """Handles a publish-only websocket connection that send show_object events along with their hashes and URLs.
+
+        If the client provides the ID of the last event it received, only the events after it are sent (if possible).
+        """
 
         self.send_response(HTTPStatus.OK)
         self.send_header("Content-Type", "text/event-stream")
@@ -121,35 +323,42 @@ class HTTPHandler(SimpleHTTPRequestHandler):
                 self.wfile.write(_chunk_data.encode("utf-8"))
                 self.wfile.write(b"\r\n")
                 self.wfile.flush()
+                metrics.inc(
+                    "yacv_served_bytes_total",
+                    len(_chunk_data),
+                    endpoint=UPDATES_API_PATH,
+                )
 
             write_chunk("retry: 100\n\n")
+            self.connection.settimeout(SLOW_CLIENT_TIMEOUT)  # Only writes from now on
 
             subscription = self.yacv.show_events.subscribe(
-                yield_timeout=1.0
-            )  # Keep-alive interval
+                yield_timeout=1.0,  # Keep-alive interval
+                since=self.yacv.show_events.parse_event_id(last_event_id),
+                batched=True,
+            )
             try:
-                for data in subscription:
-                    if data is None:
+                for seq_and_events in subscription:
+                    if seq_and_events is None:
                         write_chunk(":keep-alive\n\n")
                     else:
-                        logger.debug("Sending info about %s: %s", data.name, data)
-                        # noinspection PyUnresolvedReferences
-                        to_send = data.to_json()
-                        write_chunk(f"data: {to_send}\n\n")
+                        write_chunk(format_updates(self.yacv, seq_and_events))
             except (
                 BrokenPipeError,
                 ConnectionResetError,
             ):  # Client disconnected normally
                 pass
+            except TimeoutError:  # Client too slow, it will reconnect and resume
+                logger.warning("Disconnected an updates client that stopped reading")
             finally:
                 subscription.close()
 
         logger.debug("Updates client disconnected")
 
-    def _api_object(self, obj_name: str):
+    def _api_object(self, obj_name: str, full: bool = False):
         """Returns the object file with the matching name, building it if necessary."""
         # Export the object (or fail if not found)
-        _export = self.yacv.export(obj_name)
+        _export, timing = timed_export(self.yacv.export, obj_name, full)
         if _export is None:
             self.send_error(HTTPStatus.NOT_FOUND, f"Object {obj_name} not found")
             return io.BytesIO()
@@ -164,6 +373,199 @@ class HTTPHandler(SimpleHTTPRequestHandler):
             "Content-Disposition", f'attachment; filename="{obj_name}.glb"'
         )
         self.send_header("E-Tag", f'"{_hash}"')
+        self.send_header("Server-Timing", timing)
+        self.send_header("Timing-Allow-Origin", "*")
         self.end_headers()
         self.wfile.write(exported_glb)
+        metrics.inc(
+            "yacv_served_bytes_total", len(exported_glb), endpoint=OBJECTS_API_PATH
+        )
+        return None
+
+    def _api_object_stream(self, obj_name: str, full: bool = False):
+        """Streams the object with the matching name as GLB blobs, sending each one as soon as it is built."""
+        chunks = self.yacv.export_stream(obj_name, full)
+        if chunks is None:
+            self.send_error(HTTPStatus.NOT_FOUND, f"Object {obj_name} not found")
+            return io.BytesIO()
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", OBJECT_STREAM_CONTENT_TYPE)
+        self.send_header("Cache-Control", "no-cache")
+        if self.requestline.startswith(HTTPMethod.HEAD):
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            chunks.close()
+            return None
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        self.connection.settimeout(SLOW_CLIENT_TIMEOUT)  # Only writes from now on
+        try:
+            for glb in chunks:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(glb), glb))
+                self.wfile.flush()
+                metrics.inc(
+                    "yacv_served_bytes_total", len(glb), endpoint=OBJECTS_API_PATH
+                )
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):  # Client disconnected
+            pass
+        except TimeoutError:
+            logger.warning("Disconnected an object stream client that stopped reading")
+        finally:
+            chunks.close()
+        return None
+
+    def _api_scene(self):
+        """Returns all the objects composed into a single GLB file, building them if necessary."""
+        (exported_glb, _hash), timing = timed_export(self.yacv.export_scene)
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "model/gltf-binary")
+        self.send_header("Content-Length", str(len(exported_glb)))
+        self.send_header("Content-Disposition", 'attachment; filename="scene.glb"')
+        self.send_header("E-Tag", f'"{_hash}"')
+        self.send_header("Server-Timing", timing)
+        self.send_header("Timing-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(exported_glb)
+        metrics.inc(
+            "yacv_served_bytes_total", len(exported_glb), endpoint=SCENE_API_PATH
+        )
+        return None
+
+    def _api_metrics(self):
+        """Returns the performance metrics in the Prometheus text format"""
+        body = metrics.render().encode("utf-8")
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", METRICS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        return io.BytesIO(body)
+
+    def _api_profile(self, obj_name: str):
+        """Returns the latest build profile of the object with the matching name"""
+        response = profile_response(
+            self.yacv, obj_name, parse_query_flag(self.path, "pstats")
+        )
+        if response is None:
+            self.send_error(HTTPStatus.NOT_FOUND, f"No profile of {obj_name}")
+            return io.BytesIO()
+        headers, body = response
+        self.send_response(HTTPStatus.OK)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        return io.BytesIO(body)
+
+    def _api_ws(self, last_event_id: Optional[str], send_glb: bool):
+        """Handles a WebSocket connection that sends the same events as _api_updates (as {"id": ..., "data": ...} text
+        messages) and, if send_glb is set, pushes the built objects as binary messages before the events that use them.
+
+        Objects are built and sent one at a time by this thread, so a slow client only delays its own updates, and
+        objects superseded in the meantime are skipped instead of queued.
+        """
+        key = self.headers.get("Sec-WebSocket-Key")
+        if self.headers.get("Upgrade", "").lower() != "websocket" or key is None:
+            self.send_error(HTTPStatus.BAD_REQUEST, "Expected a WebSocket upgrade")
+            return None
+
+        # Keep a shared read lock to know if any frontend is still working before shutting down
+        with self.yacv.frontend_lock.r_locked():
+            # Avoid accepting new connections while shutting down
+            if (
+                self.yacv.shutting_down.is_set()
+                and self.yacv.at_least_one_client.is_set()
+            ):
+                self.send_error(
+                    HTTPStatus.SERVICE_UNAVAILABLE, "Server is shutting down"
+                )
+                return None
+            self.send_response(HTTPStatus.SWITCHING_PROTOCOLS)
+            self.send_header("Upgrade", "websocket")
+            self.send_header("Connection", "Upgrade")
+            self.send_header("Sec-WebSocket-Accept", ws_accept_key(key))
+            self.end_headers()
+            self.close_connection = True
+            self.yacv.at_least_one_client.set()
+            logger.debug("WebSocket client connected")
+
+            write_lock = threading.Lock()
+            closed = threading.Event()
+
+            def send_frame(opcode: int, *payload: bytes):
+                length = sum(map(len, payload))
+                with write_lock:
+                    self.wfile.write(ws_frame_header(opcode, length))
+                    for part in payload:
+                        self.wfile.write(part)
+                    self.wfile.flush()
+                metrics.inc("yacv_served_bytes_total", length, endpoint=WS_API_PATH)
+
+            def recv_exactly(n: int) -> bytes:
+                data = b""
+                while len(data) < n:
+                    try:
+                        chunk = self.connection.recv(n - len(data))
+                    except TimeoutError:  # Only writes are limited by the timeout
+                        continue
+                    if not chunk:
+                        raise ConnectionResetError("WebSocket client disconnected")
+                    data += chunk
+                return data
+
+            def read_frames():
+                try:
+                    while not closed.is_set():
+                        opcode, payload = ws_read_frame(recv_exactly)
+                        if opcode == WS_OPCODE_PING:
+                            send_frame(WS_OPCODE_PONG, payload)
+                        elif opcode == WS_OPCODE_CLOSE:
+                            send_frame(WS_OPCODE_CLOSE, payload[:2])
+                            break
+                except (OSError, ValueError):  # Client disconnected or misbehaving
+                    pass
+                finally:
+                    closed.set()
+
+            self.connection.settimeout(SLOW_CLIENT_TIMEOUT)
+            threading.Thread(target=read_frames, name="yacv_ws", daemon=True).start()
+
+            subscription = self.yacv.show_events.subscribe(
+                yield_timeout=1.0,  # Keep-alive interval
+                since=self.yacv.show_events.parse_event_id(last_event_id),
+                batched=True,
+            )
+            sent: Dict[str, str] = {}
+            try:
+                for seq_and_events in subscription:
+                    if closed.is_set():
+                        break
+                    if seq_and_events is None:
+                        send_frame(WS_OPCODE_PING)
+                        continue
+                    if send_glb:
+                        for _, event in seq_and_events:
+                            to_push = ws_glb_to_push(self.yacv, event, sent)
+                            if to_push is not None:
+                                send_frame(WS_OPCODE_BINARY, *to_push)
+                    event_id, to_send = updates_json(self.yacv, seq_and_events)
+                    message = f'{{"id": "{event_id}", "data": {to_send}}}'
+                    send_frame(WS_OPCODE_TEXT, message.encode("utf-8"))
+            except (
+                BrokenPipeError,
+                ConnectionResetError,
+            ):  # Client disconnected normally
+                pass
+            except TimeoutError:  # Client too slow, it will reconnect and resume
+                logger.warning("Disconnected a WebSocket client that stopped reading")
+            finally:
+                subscription.close()
+                closed.set()
+
+        logger.debug("WebSocket client disconnected")
         return None
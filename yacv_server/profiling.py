@@ -0,0 +1,138 @@
+"""Opt-in profiling of object builds with cProfile (CPU time) and tracemalloc (Python allocations)."""
+import contextlib
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from dataclasses import dataclass
+from typing import Optional, Dict, Set
+
+from yacv_server.mylogger import logger
+
+
+@dataclass
+class BuildProfile:
+    """The profile of a single build of an object"""
+    name: str
+    hash: str
+    seconds: float
+    peak_bytes: int
+    """The peak memory traced by tracemalloc during the build. Only Python allocations are traced, not those of OCCT."""
+    stats: bytes
+    """The raw cProfile stats, in the format of `pstats.Stats.dump_stats` (e.g. for snakeviz or `python -m pstats`)"""
+    report: str
+    """Human-readable summary with the top allocation sites and the top functions by cumulative time"""
+
+
+class BuildProfiler:
+    """Profiles the builds of the requested objects (or of all of them), keeping the latest profile of each name"""
+
+    profile_all: bool
+    """Whether to profile all builds, not only the requested ones"""
+    directory: Optional[str]
+    """If set, the .prof stats and .txt report of each profile are also written to this directory"""
+    top: int
+    """How many functions and allocation sites to include in the reports"""
+    _requested: Set[str]
+    """Names of the objects whose next build must be profiled"""
+    _profiles: Dict[str, BuildProfile]
+    _lock: threading.Lock
+
+    def __init__(self, profile_all: bool = False, directory: Optional[str] = None, top: int = 30):
+        self.profile_all = profile_all
+        self.directory = directory
+        self.top = top
+        self._requested = set()
+        self._profiles = {}
+        self._lock = threading.Lock()
+
+    def request(self, name: str):
+        """Profiles the next build of the object with this name"""
+        with self._lock:
+            self._requested.add(name)
+
+    def get(self, name: str) -> Optional[BuildProfile]:
+        """Returns the latest profile of the object with this name, if any"""
+        with self._lock:
+            return self._profiles.get(name)
+
+    @contextlib.contextmanager
+    def profile(self, name: str, _hash: str):
+        """Context manager that profiles the build of an object within its body, if requested"""
+        with self._lock:
+            if not self.profile_all and name not in self._requested:
+                profiling = False
+            else:
+                self._requested.discard(name)
+                profiling = True
+        if not profiling:
+            yield
+            return
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+            before = None
+        else:  # Someone else is tracing, so only report the difference
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:  # Another profiler is active in this thread
+            logger.warning('Cannot profile the build of %s: %s', name, e)
+            profiler = None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+            self._save(name, _hash, seconds, peak_bytes, profiler, snapshot, before)
+
+    def _save(self, name: str, _hash: str, seconds: float, peak_bytes: int, profiler: Optional[cProfile.Profile],
+              snapshot: tracemalloc.Snapshot, before: Optional[tracemalloc.Snapshot]):
+        report = io.StringIO()
+        report.write(f'Build of {name} ({_hash}) took {seconds:.3f} seconds, '
+                     f'peak traced Python memory {peak_bytes / 1024 / 1024:.1f} MiB\n\n')
+
+        report.write(f'Top {self.top} allocation sites of all threads (still allocated at the end of the build):\n')
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+        if before is None:
+            allocations = snapshot.statistics('lineno')
+        else:
+            allocations = snapshot.compare_to(before, 'lineno')
+        for stat in allocations[:self.top]:
+            report.write(f'  {stat}\n')
+        report.write('\n')
+
+        stats = b''
+        if profiler is not None:
+            profiler.create_stats()
+            stats = marshal.dumps(profiler.stats)
+            pstats.Stats(profiler, stream=report).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+
+        profile = BuildProfile(name=name, hash=_hash, seconds=seconds, peak_bytes=peak_bytes, stats=stats,
+                               report=report.getvalue())
+        with self._lock:
+            self._profiles[name] = profile
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            base_path = os.path.join(self.directory, urllib.parse.quote(name, safe=''))
+            with open(base_path + '.prof', 'wb') as f:
+                f.write(profile.stats)
+            with open(base_path + '.txt', 'w') as f:
+                f.write(profile.report)
+            logger.info('Saved the profile of %s to %s.{prof,txt}', name, base_path)
+        else:
+            logger.info('Profiled the build of %s in %.3f seconds', name, seconds)
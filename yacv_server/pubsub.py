@@ -1,87 +1,346 @@
-import queue
+import asyncio
+import collections
 import threading
-from typing import List, TypeVar, Generic, Generator
+import uuid
+from typing import List, TypeVar, Generic, Generator, AsyncGenerator, Deque, Dict, Optional, Tuple, Callable, Hashable
 
 from yacv_server.mylogger import logger
 
 T = TypeVar('T')
 
 _end_of_queue = object()
+_deleted = object()
+
+
+class _Entry:
+    """A slot of the ring buffer: an event and its sequence number (the event is _deleted once removed)"""
+    __slots__ = ('seq', 'event')
+
+    def __init__(self, seq: int, event):
+        self.seq = seq
+        self.event = event
+
+
+class _Subscriber:
+    """The pending events of a subscriber, safe to fill from any thread.
+
+    Pending events with the same compaction key are coalesced (only the latest one is delivered), and the subscriber
+    is marked as lagging once too many distinct events are still pending when new ones are published."""
+
+    def __init__(self, key: Callable[[T], Hashable], max_pending: Optional[int], replay: List[Tuple[int, T]],
+                 notify: Callable[[], None]):
+        self._key = key
+        self._max_pending = max_pending
+        self._replay = collections.deque(replay)
+        self._pending: collections.OrderedDict[Hashable, Tuple[int, T]] = collections.OrderedDict()
+        self._last_seq = replay[-1][0] if len(replay) > 0 else 0
+        self._lock = threading.Lock()
+        self._notify = notify
+        self.ended = False
+        self.lagging = False
+
+    def put(self, seq: int, event: T):
+        """Adds an event (never blocks)"""
+        self.put_many([(seq, event)])
+
+    def put_many(self, events: List[Tuple[int, T]]):
+        """Adds several (sequence, event) pairs at once, so that pop_all never returns only some of them"""
+        with self._lock:
+            if self.lagging:  # Disconnecting
+                return
+            was_empty = len(self._pending) == 0
+            added = set()
+            for seq, event in events:
+                if seq <= self._last_seq:  # Already replayed
+                    continue
+                self._last_seq = seq
+                key = self._key(event)
+                self._pending.pop(key, None)  # Coalesce the superseded event
+                self._pending[key] = (seq, event)
+                added.add(key)
+            # Only the events that were already pending count, so that a whole batch fits however big it is
+            if self._max_pending is not None and len(self._pending) - len(added) > self._max_pending:
+                self.lagging = True
+                self._pending.clear()
+            elif not was_empty:
+                return  # The consumer will not wait before popping the next event
+        self._notify()
+
+    def end(self):
+        """Marks the end of the events, after all pending ones"""
+        with self._lock:
+            self.ended = True
+        self._notify()
+
+    def pop(self) -> Optional[Tuple[int, T]]:
+        """Returns the next (sequence, event), None if there is none yet or _end_of_queue if there will be no more"""
+        with self._lock:
+            if self.lagging:
+                return _end_of_queue
+            while len(self._replay) > 0:
+                seq, event = self._replay.popleft()
+                newer = self._pending.get(self._key(event))
+                if newer is None or newer[0] <= seq:  # Skip replayed events that are already superseded
+                    return seq, event
+            if len(self._pending) > 0:
+                return self._pending.popitem(last=False)[1]
+            return _end_of_queue if self.ended else None
+
+    def pop_all(self) -> Optional[List[Tuple[int, T]]]:
+        """Like pop, but returns all the available (sequence, event) pairs at once"""
+        with self._lock:
+            if self.lagging:
+                return _end_of_queue
+            res = []
+            while len(self._replay) > 0:
+                seq, event = self._replay.popleft()
+                newer = self._pending.get(self._key(event))
+                if newer is None or newer[0] <= seq:  # Skip replayed events that are already superseded
+                    res.append((seq, event))
+            res.extend(self._pending.values())
+            self._pending.clear()
+            if len(res) > 0:
+                return res
+            return _end_of_queue if self.ended else None
 
 
 class BufferedPubSub(Generic[T]):
-    """A simple implementation of publish-subscribe pattern using threading and buffering all previous events"""
+    """A simple implementation of publish-subscribe pattern using threading and a ring buffer of previous events.
+
+    Each published event gets a monotonically increasing sequence number, so that subscribers can resume from the last
+    event they received instead of replaying the whole buffer. With a compaction key, the buffer only keeps the latest
+    event per key, so its size is bounded by the number of live keys instead of by the number of published events."""
 
-    _buffer: List[T]
+    _buffer: Deque[_Entry]
+    """Ring buffer of entries ordered by sequence number. Deleted entries are skipped and compacted lazily."""
+    _entries: Dict[Hashable, _Entry]
+    """Live entries by compaction key of their event, for O(1) deletes and replacements"""
+    _key: Callable[[T], Hashable]
     _buffer_lock: threading.Lock
-    _subscribers: List[queue.Queue[T]]
+    _publish_lock: threading.Lock
+    """Serializes the delivery of events to subscribers, which happens outside of the buffer lock"""
+    _subscribers: List[_Subscriber]
     _subscribers_lock: threading.Lock
-    max_buffer_size: int
+    _next_seq: int
+    _dropped_seq: int
+    """Sequence number of the last live event dropped without being replaced (e.g. to respect max_buffer_size)"""
+    max_buffer_size: Optional[int]
+    max_pending: Optional[int]
+    """The maximum number of distinct events still pending when a subscriber receives new ones, before disconnecting it
+    for lagging behind (a single batch is always delivered whole)"""
+    epoch: str
+    """Random identifier of this instance, so that sequence numbers of a previous instance are not trusted"""
 
-    def __init__(self, max_buffer_size: int = 100):
-        self._buffer = []
+    def __init__(self, max_buffer_size: Optional[int] = None, key: Optional[Callable[[T], Hashable]] = None,
+                 max_pending: Optional[int] = 1000):
+        """
+        :param max_buffer_size: The maximum number of buffered events, dropping the oldest ones (unbounded if None).
+        :param key: The compaction key of each event: publishing an event replaces any buffered event with the same
+            key, and pending events of a subscriber with the same key are coalesced. If None, each event object is
+            only replaced when published again.
+        :param max_pending: The maximum number of distinct events of a subscriber (excluding the replayed buffer)
+            still pending when new ones are published, before it is disconnected for lagging behind (unbounded if
+            None). A single publish_many is always delivered whole, however big.
+        """
+        self._buffer = collections.deque()
+        self._entries = {}
+        self._key = key or id
         self._buffer_lock = threading.Lock()
+        self._publish_lock = threading.Lock()
         self._subscribers = []
         self._subscribers_lock = threading.Lock()
+        self._next_seq = 1
+        self._dropped_seq = 0
         self.max_buffer_size = max_buffer_size
+        self.max_pending = max_pending
+        self.epoch = uuid.uuid4().hex[:8]
 
-    def publish(self, event: T):
-        """Publishes an event without blocking (synchronous API does not require locking)"""
-        with self._buffer_lock:
-            self._buffer.append(event)
-            if len(self._buffer) > self.max_buffer_size:
-                self._buffer.pop(0)
-            for q in self._subscribers:
-                q.put(event)
+    def publish(self, event: T) -> int:
+        """Publishes an event without blocking (synchronous API does not require locking), returning its sequence"""
+        with self._publish_lock:
+            with self._buffer_lock:
+                seq = self._append(event)
+                with self._subscribers_lock:
+                    subscribers = self._subscribers[:]
+            # Deliver outside the buffer lock (the publish lock keeps the order), which never blocks
+            for subscriber in subscribers:
+                subscriber.put(seq, event)
+        return seq
 
-    def _subscribe(self, include_buffered: bool = True, include_future: bool = True) -> queue.Queue[T]:
-        """Subscribes to events"""
-        q = queue.Queue()
-        with self._subscribers_lock:
-            self._subscribers.append(q)
-        logger.debug(f"Subscribed to %s (%d subscribers)", self, len(self._subscribers))
-        if include_buffered:
+    def publish_many(self, events: List[T]) -> List[int]:
+        """Publishes several events atomically with consecutive sequence numbers, returning them.
+
+        Batched subscribers receive them together (see subscribe), never only some of them."""
+        with self._publish_lock:
             with self._buffer_lock:
-                for event in self._buffer:
-                    q.put(event)
+                seq_and_events = [(self._append(event), event) for event in events]
+                with self._subscribers_lock:
+                    subscribers = self._subscribers[:]
+            for subscriber in subscribers:
+                subscriber.put_many(seq_and_events)
+        return [seq for seq, _ in seq_and_events]
+
+    def _append(self, event: T) -> int:
+        """Appends an event to the buffer, returning its sequence number (requires lock)"""
+        seq = self._next_seq
+        self._next_seq += 1
+        entry = _Entry(seq, event)
+        self._buffer.append(entry)
+        key = self._key(event)
+        old_entry = self._entries.get(key)
+        if old_entry is not None:  # Only keep the latest event for each key
+            old_entry.event = _deleted
+        self._entries[key] = entry
+        while self.max_buffer_size is not None and len(self._entries) > self.max_buffer_size:
+            oldest = self._buffer.popleft()
+            if oldest.event is not _deleted:
+                del self._entries[self._key(oldest.event)]
+                self._dropped_seq = oldest.seq
+        self._compact()
+        return seq
+
+    def _compact(self):
+        """Drops deleted entries once they are the majority of the ring buffer (amortized O(1), requires lock)"""
+        if len(self._buffer) > 2 * len(self._entries) + 16:
+            self._buffer = collections.deque(e for e in self._buffer if e.event is not _deleted)
+
+    def _replay(self, since: Optional[int]) -> List[Tuple[int, T]]:
+        """Returns the buffered (sequence, event) pairs after the given sequence (all if None or too old, requires
+        lock)"""
+        if since is None or since < self._dropped_seq or since >= self._next_seq:
+            return [(e.seq, e.event) for e in self._buffer if e.event is not _deleted]
+        res = []
+        for e in reversed(self._buffer):  # Only walk the missed events
+            if e.seq <= since:
+                break
+            if e.event is not _deleted:
+                res.append((e.seq, e.event))
+        res.reverse()
+        return res
+
+    def _subscribe(self, include_buffered: bool, include_future: bool, since: Optional[int],
+                   notify: Callable[[], None]) -> _Subscriber:
+        """Subscribes to events"""
+        # Hold the buffer lock to avoid missing or duplicating events published concurrently
+        with self._buffer_lock:
+            subscriber = _Subscriber(self._key, self.max_pending, self._replay(since) if include_buffered else [],
+                                     notify)
             if not include_future:
-                q.put(_end_of_queue)
-        return q
+                subscriber.end()
+            else:
+                with self._subscribers_lock:
+                    self._subscribers.append(subscriber)
+        logger.debug(f"Subscribed to %s (%d subscribers)", self, len(self._subscribers))
+        return subscriber
 
-    def _unsubscribe(self, q: queue.Queue[T]):
+    def _unsubscribe(self, subscriber: _Subscriber):
         """Unsubscribes from events"""
         with self._subscribers_lock:
-            self._subscribers.remove(q)
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+        if subscriber.lagging:
+            logger.warning('Disconnected a subscriber of %s that was lagging behind', self)
         logger.debug(f"Unsubscribed from %s (%d subscribers)", self, len(self._subscribers))
 
     def subscribe(self, include_buffered: bool = True, include_future: bool = True,
-                  yield_timeout: float | None = 0.0) -> Generator[T, None, None]:
-        """Subscribes to events as a generator that yields events and automatically unsubscribes"""
-        q = self._subscribe(include_buffered, include_future)
+                  yield_timeout: float | None = 0.0, since: Optional[int] = None, with_seq: bool = False,
+                  batched: bool = False) -> Generator[T | Tuple[int, T] | List[Tuple[int, T]], None, None]:
+        """Subscribes to events as a generator that yields events and automatically unsubscribes.
+
+        If since is given, only the buffered events after that sequence number are replayed (when still available).
+        If with_seq is set, (sequence, event) pairs are yielded instead of events. If batched is set, lists of all the
+        (sequence, event) pairs available at once are yielded instead, which keeps events published together by
+        publish_many in the same list. None is yielded after waiting for yield_timeout seconds without events. The
+        generator ends if the subscriber lags too far behind."""
+        ready = threading.Event()
+        subscriber = self._subscribe(include_buffered, include_future, since, ready.set)
+        pop = subscriber.pop_all if batched else subscriber.pop
         try:
             while True:
-                try:
-                    v = q.get(timeout=yield_timeout)
-                except queue.Empty:
-                    v = None
+                ready.clear()
+                v = pop()
+                if v is None and (yield_timeout is None or yield_timeout > 0) and ready.wait(yield_timeout):
+                    continue
                 # include_future is incompatible with None values as they are used to signal the end of the stream
                 if v is _end_of_queue:
                     break
-                yield v
+                yield v if with_seq or batched or v is None else v[1]
+        finally:  # When aclose() is called
+            self._unsubscribe(subscriber)
+
+    async def asubscribe(self, include_buffered: bool = True, include_future: bool = True,
+                         yield_timeout: float | None = 0.0, since: Optional[int] = None, with_seq: bool = False,
+                         batched: bool = False) -> AsyncGenerator[T | Tuple[int, T] | List[Tuple[int, T]], None]:
+        """Like subscribe, but for asyncio code: events are delivered to the running event loop without blocking it"""
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+
+        def notify():
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:  # Event loop closed, the subscriber is gone
+                pass
+
+        subscriber = self._subscribe(include_buffered, include_future, since, notify)
+        pop = subscriber.pop_all if batched else subscriber.pop
+        try:
+            while True:
+                ready.clear()
+                v = pop()
+                if v is None and (yield_timeout is None or yield_timeout > 0):
+                    try:
+                        await asyncio.wait_for(ready.wait(), timeout=yield_timeout)
+                        continue
+                    except asyncio.TimeoutError:
+                        pass
+                if v is _end_of_queue:
+                    break
+                yield v if with_seq or batched or v is None else v[1]
         finally:  # When aclose() is called
-            self._unsubscribe(q)
+            self._unsubscribe(subscriber)
+
+    def subscriber_count(self) -> int:
+        """Returns the number of active subscribers"""
+        with self._subscribers_lock:
+            return len(self._subscribers)
+
+    def event_id(self, seq: int) -> str:
+        """Formats a sequence number as an opaque event ID (e.g. for the SSE id: field)"""
+        return f'{self.epoch}-{seq}'
+
+    def parse_event_id(self, event_id: Optional[str]) -> Optional[int]:
+        """Parses an event ID generated by event_id, returning None if it does not belong to this instance"""
+        if event_id is None:
+            return None
+        epoch, _, seq = event_id.strip().partition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
 
     def buffer(self) -> List[T]:
         """Returns a shallow copy of the list of buffered events"""
         with self._buffer_lock:
-            return self._buffer[:]
+            return [e.event for e in self._buffer if e.event is not _deleted]
+
+    def delete(self, event: T, drop: bool = False):
+        """Deletes an event from the buffer.
 
-    def delete(self, event: T):
-        """Deletes an event from the buffer"""
+        Set drop if the event is not superseded by a later one, so that subscribers resuming from before it get a full
+        replay instead of silently missing it."""
         with self._buffer_lock:
-            self._buffer.remove(event)
+            key = self._key(event)
+            entry = self._entries.get(key)
+            if entry is None or entry.event is not event:
+                raise ValueError(f'Event not in buffer: {event}')
+            del self._entries[key]
+            entry.event = _deleted
+            if drop:
+                self._dropped_seq = max(self._dropped_seq, entry.seq)
+            self._compact()
 
     def clear(self):
         """Clears the buffer"""
         with self._buffer_lock:
             self._buffer.clear()
+            self._entries.clear()
+            self._dropped_seq = self._next_seq - 1
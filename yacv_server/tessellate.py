@@ -1,7 +1,12 @@
-from typing import List, Dict, Tuple, Optional
+import math
+from typing import List, Dict, Tuple, Optional, Iterator
 
 from OCP.BRep import BRep_Tool
 from OCP.BRepAdaptor import BRepAdaptor_Curve
+from OCP.BRepBndLib import BRepBndLib
+from OCP.BRepMesh import BRepMesh_IncrementalMesh
+from OCP.BRepTools import BRepTools
+from OCP.Bnd import Bnd_Box
 from OCP.GCPnts import GCPnts_TangentialDeflection
 from OCP.BRepLib import BRepLib_ToolTriangulatedShape
 from OCP.TopAbs import TopAbs_Orientation
@@ -12,19 +17,55 @@ from pygltflib import GLTF2
 
 from yacv_server.cad import CADCoreLike, ColorTuple
 from yacv_server.gltf import GLTFMgr
+from yacv_server.metrics import metrics
 from yacv_server.mylogger import logger
 
+RELATIVE_TO = ('object', 'face')
+"""What the size of a relative tolerance is taken from: the whole object, or each face and edge"""
+
+_MAX_MESH_ATTEMPTS = 5
+"""How many times the faces of an object are meshed to fit it into its triangle budget"""
+
+_MAX_ANGULAR_TOLERANCE = 1.0
+"""The coarsest angular tolerance used to fit an object into its triangle budget (radians)"""
+
 
 def tessellate(
         cad_like: CADCoreLike, color_faces: ColorTuple, color_edges: ColorTuple, color_vertices: ColorTuple,
         color_obj: Optional[ColorTuple] = None, tolerance: float = 0.1, angular_tolerance: float = 0.1,
         faces: bool = True, edges: bool = True, vertices: bool = True, texture: Optional[Tuple[bytes, str]] = None,
+        relative_tolerance: Optional[float] = None, relative_to: str = 'object', max_triangles: Optional[int] = None,
 ) -> GLTF2:
-    """Tessellate a whole shape into a list of triangle vertices and a list of triangle indices."""
-    if texture is None:
-        mgr = GLTFMgr()
-    else:
-        mgr = GLTFMgr(texture)
+    """Tessellate a whole shape into a list of triangle vertices and a list of triangle indices.
+
+    By default, the tolerance is relative to the size of each edge (OCCT's relative mode) and the angular tolerance
+    bounds the triangles of curved faces, so that an object has about as many triangles at any scale. If
+    relative_tolerance is set, the linear deflection is instead that fraction of the bounding box diagonal of the object
+    (or of each face and edge, see `RELATIVE_TO`), and the tolerance is ignored. If the faces have more than
+    max_triangles, they are meshed again with coarser tolerances, and then decimated (see `yacv_server.decimate`) if
+    they still do not fit."""
+    return next(tessellate_chunks(cad_like, color_faces, color_edges, color_vertices, color_obj, tolerance,
+                                  angular_tolerance, faces, edges, vertices, texture, relative_tolerance, relative_to,
+                                  max_triangles))
+
+
+def tessellate_chunks(
+        cad_like: CADCoreLike, color_faces: ColorTuple, color_edges: ColorTuple, color_vertices: ColorTuple,
+        color_obj: Optional[ColorTuple] = None, tolerance: float = 0.1, angular_tolerance: float = 0.1,
+        faces: bool = True, edges: bool = True, vertices: bool = True, texture: Optional[Tuple[bytes, str]] = None,
+        relative_tolerance: Optional[float] = None, relative_to: str = 'object', max_triangles: Optional[int] = None,
+        chunk_triangles: Optional[int] = None,
+) -> Iterator[GLTF2]:
+    """Like `tessellate`, but splits the faces into GLTFs of about chunk_triangles each (a single one if None), which
+    are built as soon as their faces are ready. The edges and vertices are in the last one.
+
+    Without max_triangles, the faces of each chunk are only meshed when it is built, so the first chunk is ready long
+    before the whole shape is tessellated. With it, all faces are meshed first to fit the budget, and each chunk is
+    decimated to its share of it."""
+    if relative_to not in RELATIVE_TO:
+        raise ValueError(f'Unsupported relative_to={relative_to!r}, expected one of {", ".join(RELATIVE_TO)}')
+    mgr = _new_mgr(texture)
+    total_triangles = None  # Only known if all faces are meshed before building the first chunk
 
     if isinstance(cad_like, TopLoc_Location):
         mgr.add_location(Location(cad_like))
@@ -35,46 +76,140 @@ def tessellate(
         # Perform tessellation tasks
         edge_to_faces: Dict[str, List[TopoDS_Face]] = {}
         vertex_to_faces: Dict[str, List[TopoDS_Face]] = {}
+        object_deflection = None
+        if relative_tolerance is not None and relative_to == 'object':
+            object_deflection = _relative_deflection(cad_like, relative_tolerance)
         if faces and hasattr(shape, 'faces'):
-            shape_faces = shape.faces()
-            for face in shape_faces:
-                _tessellate_face(mgr, face.wrapped, color_obj or color_faces, tolerance, angular_tolerance)
-                if edges:
-                    for edge in face.edges():
-                        edge_to_faces[edge.wrapped] = edge_to_faces.get(edge.wrapped, []) + [face.wrapped]
-                if vertices:
-                    for vertex in face.vertices():
-                        vertex_to_faces[vertex.wrapped] = vertex_to_faces.get(vertex.wrapped, []) + [face.wrapped]
+            with metrics.phase('tessellate_faces'):
+                shape_faces = shape.faces()
+                deflections = [
+                    object_deflection or _relative_deflection(face.wrapped, relative_tolerance)
+                    for face in shape_faces
+                ] if relative_tolerance is not None else [tolerance] * len(shape_faces)
+                if chunk_triangles is None or max_triangles is not None:
+                    angular_tolerance, total_triangles = _mesh_faces(
+                        [face.wrapped for face in shape_faces], deflections, angular_tolerance,
+                        relative_tolerance is None, max_triangles)
+            next_face = 0
+            while next_face < len(shape_faces):
+                with metrics.phase('tessellate_faces'):
+                    while next_face < len(shape_faces) and (
+                            chunk_triangles is None or len(mgr.face_indices) // 3 < chunk_triangles):
+                        face = shape_faces[next_face]
+                        if total_triangles is None:
+                            _mesh_faces([face.wrapped], [deflections[next_face]], angular_tolerance,
+                                        relative_tolerance is None, None)
+                        next_face += 1
+                        _tessellate_face(mgr, face.wrapped, color_obj or color_faces)
+                        if edges:
+                            for edge in face.edges():
+                                edge_to_faces[edge.wrapped] = edge_to_faces.get(edge.wrapped, []) + [face.wrapped]
+                        if vertices:
+                            for vertex in face.vertices():
+                                vertex_to_faces[vertex.wrapped] = \
+                                    vertex_to_faces.get(vertex.wrapped, []) + [face.wrapped]
+                if next_face < len(shape_faces):  # Not the last chunk
+                    yield _build_chunk(mgr, max_triangles, total_triangles)
+                    mgr = _new_mgr(texture)
             if len(shape_faces) > 0: color_obj = None  # Don't color edges/vertices if faces are colored
         if edges and hasattr(shape, 'edges'):
-            shape_edges = shape.edges()
-            for edge in shape_edges:
-                _tessellate_edge(mgr, edge.wrapped, edge_to_faces.get(edge.wrapped, []), color_obj or color_edges,
-                                 angular_tolerance, angular_tolerance)
+            with metrics.phase('tessellate_edges'):
+                shape_edges = shape.edges()
+                for edge in shape_edges:
+                    if relative_tolerance is None:
+                        curvature_deflection = angular_tolerance
+                    else:
+                        curvature_deflection = object_deflection or \
+                                               _relative_deflection(edge.wrapped, relative_tolerance)
+                    _tessellate_edge(mgr, edge.wrapped, edge_to_faces.get(edge.wrapped, []), color_obj or color_edges,
+                                     angular_tolerance, curvature_deflection)
             if len(shape_edges) > 0: color_obj = None  # Don't color vertices if edges are colored
         if vertices and hasattr(shape, 'vertices'):
-            for vertex in shape.vertices():
-                _tessellate_vertex(mgr, vertex.wrapped, vertex_to_faces.get(vertex.wrapped, []),
-                                   color_obj or color_vertices)
+            with metrics.phase('tessellate_vertices'):
+                for vertex in shape.vertices():
+                    _tessellate_vertex(mgr, vertex.wrapped, vertex_to_faces.get(vertex.wrapped, []),
+                                       color_obj or color_vertices)
 
     else:
         raise TypeError(f"Unsupported type: {type(cad_like)}: {cad_like}")
 
-    return mgr.build()
+    yield _build_chunk(mgr, max_triangles, total_triangles)
+
+
+def _new_mgr(texture: Optional[Tuple[bytes, str]]) -> GLTFMgr:
+    if texture is None:
+        return GLTFMgr()
+    else:
+        return GLTFMgr(texture)
+
+
+def _build_chunk(mgr: GLTFMgr, max_triangles: Optional[int], total_triangles: Optional[int]) -> GLTF2:
+    """Decimates the faces of a chunk to its share of max_triangles if the object is over budget, and builds it"""
+    triangles = len(mgr.face_indices) // 3
+    if max_triangles is not None and total_triangles:
+        budget = triangles * max_triangles // total_triangles
+        if triangles > budget:
+            with metrics.phase('decimate'):
+                mgr.decimate(budget)
+    with metrics.phase('gltf_build'):
+        return mgr.build()
+
+
+def _relative_deflection(ocp_shape: TopoDS_Shape, relative_tolerance: float) -> float:
+    """The linear deflection that is the given fraction of the bounding box diagonal of a shape"""
+    box = Bnd_Box()
+    BRepBndLib.Add_s(ocp_shape, box, False)  # Cheap (not optimal), as the tolerance does not need to be exact
+    if box.IsVoid():
+        return 1e-3
+    return max(math.sqrt(box.SquareExtent()) * relative_tolerance, 1e-6)
+
+
+def _mesh_faces(
+        ocp_faces: List[TopoDS_Face],
+        deflections: List[float],
+        angular_tolerance: float,
+        edge_relative: bool,
+        max_triangles: Optional[int],
+) -> Tuple[float, int]:
+    """Meshes each face with its linear deflection (relative to the size of its edges if edge_relative), coarsening
+    them until the faces have at most max_triangles in total. Returns the final angular tolerance and the number of
+    triangles."""
+    triangles = previous_triangles = 0
+    for attempt in range(_MAX_MESH_ATTEMPTS):
+        triangles = 0
+        for ocp_face, deflection in zip(ocp_faces, deflections):
+            if attempt > 0 or not edge_relative:
+                BRepTools.Clean_s(ocp_face)  # Otherwise, a finer triangulation from a previous build would be kept
+            if edge_relative:
+                Compound(ocp_face).mesh(deflection, angular_tolerance)
+            else:
+                BRepMesh_IncrementalMesh(ocp_face, deflection, False, angular_tolerance, True)
+            # noinspection PyArgumentList
+            poly = BRep_Tool.Triangulation_s(ocp_face, TopLoc_Location())
+            triangles += poly.NbTriangles() if poly is not None else 0
+        if max_triangles is None or triangles <= max_triangles:
+            return angular_tolerance, triangles
+        if attempt > 0 and triangles >= previous_triangles:
+            break  # Cannot get any coarser (e.g. planar faces)
+        previous_triangles = triangles
+        # Triangles are about inversely proportional to the linear deflection and to the squared angular tolerance
+        coarser = triangles / max_triangles * 1.1
+        deflections = [deflection * coarser for deflection in deflections]
+        angular_tolerance = min(angular_tolerance * math.sqrt(coarser), _MAX_ANGULAR_TOLERANCE)
+    logger.debug('Could not mesh %d faces into max_triangles=%d (%d triangles)', len(ocp_faces), max_triangles,
+                 triangles)
+    return angular_tolerance, triangles
 
 
 def _tessellate_face(
         mgr: GLTFMgr,
         ocp_face: TopoDS_Face,
         color: ColorTuple,
-        tolerance: float = 1e-3,
-        angular_tolerance: float = 0.1,
 ):
     face = Compound(ocp_face)
-    # face.mesh(tolerance, angular_tolerance)
-    tri_mesh = face.tessellate(tolerance, angular_tolerance)
+    loc = TopLoc_Location()
     # noinspection PyArgumentList
-    poly = BRep_Tool.Triangulation_s(face.wrapped, TopLoc_Location())
+    poly = BRep_Tool.Triangulation_s(face.wrapped, loc)
     if poly is None:
         logger.warn("No triangulation found for face")
         return GLTF2()
@@ -93,8 +228,17 @@ def _tessellate_face(
         for v in (poly.UVNode(i) for i in range(1, poly.NbNodes() + 1))
     ]
 
-    vertices = tri_mesh[0]
-    indices = tri_mesh[1]
+    # Get the vertices and triangles of the mesh computed by _mesh_faces
+    trsf = loc.Transformation()
+    vertices = [
+        Vector(v.X(), v.Y(), v.Z())
+        for v in (poly.Node(i).Transformed(trsf) for i in range(1, poly.NbNodes() + 1))
+    ]
+    indices = [
+        (t.Value(1) - 1, t.Value(3) - 1, t.Value(2) - 1) if reversed_face else
+        (t.Value(1) - 1, t.Value(2) - 1, t.Value(3) - 1)
+        for t in poly.Triangles()
+    ]
     mgr.add_face(vertices, normals, indices, uv, color)
     return None
 
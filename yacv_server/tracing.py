@@ -0,0 +1,77 @@
+"""Optional recording of spans across threads in the Chrome trace event format (chrome://tracing or Perfetto)."""
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Optional, List, Dict, Any, Set
+
+from yacv_server.mylogger import logger
+
+
+class Tracer:
+    """Thread-safe recorder of complete ("X") trace events, saved to a JSON file on exit"""
+
+    path: Optional[str]
+    """The file to save the trace to, or None if tracing is disabled"""
+    _events: List[Dict[str, Any]]
+    _named_threads: Set[int]
+    _lock: threading.Lock
+    _pid: int
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or None
+        self._events = []
+        self._named_threads = set()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        if self.path is not None:
+            logger.info('Tracing to %s', self.path)
+            atexit.register(self.save)
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def complete(self, name: str, start: float, end: float, cat: str = 'yacv', **args: Any):
+        """Records a span from start to end (in time.perf_counter() seconds), if tracing is enabled"""
+        if self.path is None:
+            return
+        thread = threading.current_thread()
+        event = {'name': name, 'cat': cat, 'ph': 'X', 'ts': start * 1e6, 'dur': (end - start) * 1e6,
+                 'pid': self._pid, 'tid': thread.ident}
+        if args:
+            event['args'] = args
+        with self._lock:
+            if thread.ident not in self._named_threads:
+                self._named_threads.add(thread.ident)
+                self._events.append({'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': thread.ident,
+                                     'args': {'name': thread.name}})
+            self._events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name: str, cat: str = 'yacv', **args: Any):
+        """Context manager that records a span covering its body, if tracing is enabled"""
+        if self.path is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.complete(name, start, time.perf_counter(), cat, **args)
+
+    def save(self):
+        """Writes all the spans recorded so far to the trace file"""
+        if self.path is None:
+            return
+        with self._lock:
+            events = list(self._events)
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        logger.info('Saved %d trace events to %s', len(events), self.path)
+
+
+tracer = Tracer(os.getenv('YACV_TRACE'))
+"""The default tracer, enabled by setting YACV_TRACE to the path of the JSON file to write"""
@@ -0,0 +1,8 @@
+import importlib.metadata
+
+
+def get_version() -> str:
+    try:
+        return importlib.metadata.version("yacv_server")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
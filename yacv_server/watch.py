@@ -0,0 +1,118 @@
+"""Hot-reloading of model scripts: `python -m yacv_server watch script.py`.
+
+The server runs in this process for as long as the watch lasts, while each version of the script runs in a fresh worker
+process (see `yacv_server.workers`) that already imported the CAD modules. The worker only builds the objects whose hash
+changed, and this process publishes the differences with the live scene as a single batch.
+"""
+import os
+import runpy
+import sys
+import threading
+import time
+from typing import Optional, Dict, List, Tuple
+
+from yacv_server.mylogger import logger
+from yacv_server.workers import WorkerPool
+
+WorkerResult = List[Tuple[str, str, Optional[bytes]]]
+"""(name, hash, GLB or None if unchanged) of each object shown by the script"""
+
+
+def _run_script(script: str, args: List[str], live_hashes: Dict[str, str]) -> WorkerResult:
+    """Runs the script in a worker process, returning the objects that it showed (only building the changed ones)"""
+    from yacv_server import yacv
+    sys.argv = [script, *args]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    try:
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            raise RuntimeError(f'{script} exited with code {e.code}') from e
+    yacv.flush()
+    result: WorkerResult = []
+    for name in yacv.shown_object_names():
+        _hash = yacv.scene[name].hash
+        if live_hashes.get(name) == _hash:
+            result.append((name, _hash, None))
+        else:
+            result.append((name, _hash, yacv.export(name)[0]))
+    return result
+
+
+class WarmRunner:
+    """Runs a script in pre-warmed worker processes, publishing the changed objects to the server"""
+
+    spares: int
+    """How many idle workers to keep ready, with the CAD modules already imported"""
+    _pool: WorkerPool
+    """Runs each version of the script in a fresh worker, as scripts leave global state behind"""
+    _hashes: Dict[str, str]
+    """The hash (as computed by the workers) of each object published by the watch"""
+
+    def __init__(self, spares: int = 1):
+        self.spares = max(1, spares)
+        self._pool = WorkerPool(1, warm=self.spares, preload=['yacv_server.tessellate'], single_use=True)
+        self._hashes = {}
+
+    def run(self, script: str, args: List[str]) -> Optional[WorkerResult]:
+        """Runs the script in a warm worker, returning what it showed or None if it failed"""
+        try:
+            return self._pool.submit(_run_script, script, args, dict(self._hashes)).result()
+        except (RuntimeError, EOFError) as e:
+            logger.error('Error running %s, keeping the previous objects:\n%s', script, e)
+            return None
+
+    def publish(self, result: WorkerResult):
+        """Applies the objects shown by a run to the live scene as a single batch"""
+        from yacv_server import yacv
+        new_names = {name for name, _, _ in result}
+        changed = [name for name, _, glb in result if glb is not None]
+        removed = [name for name in self._hashes if name not in new_names]
+        with yacv.batch():
+            for name in removed:
+                yacv.remove(name)
+                del self._hashes[name]
+            for name, _hash, glb in result:
+                if glb is not None:
+                    yacv.show(glb, names=name, auto_clear=False)
+                    self._hashes[name] = _hash
+        logger.info('Published %d changed and %d removed objects (%d unchanged)', len(changed), len(removed),
+                    len(result) - len(changed))
+
+    def close(self):
+        self._pool.close()
+
+
+def _mtimes(paths: List[str]) -> Dict[str, Optional[int]]:
+    res = {}
+    for path in paths:
+        try:
+            res[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            res[path] = None
+    return res
+
+
+def watch(script: str, args: List[str], paths: List[str], spares: int = 1, interval: float = 0.3):
+    """Runs the script whenever it (or any of the other paths) changes, until interrupted"""
+    runner = WarmRunner(spares)
+    # Also import the CAD modules used to publish the objects here, meanwhile
+    threading.Thread(target=__import__, args=('yacv_server.cad',), name='yacv_preload', daemon=True).start()
+    paths = [script, *paths]
+    seen: Dict[str, Optional[int]] = {}
+    try:
+        while True:
+            mtimes = _mtimes(paths)
+            if mtimes != seen:
+                seen = mtimes
+                logger.info('Running %s...', script)
+                start = time.time()
+                result = runner.run(script, args)
+                if result is not None:
+                    runner.publish(result)
+                    logger.info('Reloaded %s in %.3f seconds', script, time.time() - start)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.close()
@@ -0,0 +1,150 @@
+"""Pool of worker processes for CPU-bound CAD work, since OCCT holds the GIL while meshing (threads do not help).
+
+The workers are plain `python -c` interpreters instead of multiprocessing ones: spawned multiprocessing workers re-run
+the __main__ module of the parent (usually a model script without an `if __name__ == '__main__':` guard), and forking a
+process with server threads and OCCT is unsafe. Each call is pickled (so the function must be importable from a module)
+and sent with its length through the stdin of a worker, which replies through its stdout. The workers never start a
+server and are reused for the next calls until the pool closes, unless each call leaves global state behind (like the
+model scripts of `yacv_server.watch`), in which case each worker only runs one call and spare ones are kept warm.
+"""
+import importlib
+import os
+import pickle
+import struct
+import subprocess
+import sys
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, BinaryIO, Any, Sequence
+
+_HEADER = struct.Struct('>Q')
+
+
+def _send(f: BinaryIO, message: Any):
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    f.write(_HEADER.pack(len(data)))
+    f.write(data)
+    f.flush()
+
+
+def _receive(f: BinaryIO) -> bytes:
+    header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise EOFError('The worker process exited')
+    size, = _HEADER.unpack(header)
+    data = f.read(size)
+    if len(data) < size:
+        raise EOFError('The worker process exited')
+    return data
+
+
+class WorkerPool:
+    """Runs functions in up to `workers` processes, started on demand and reused for the next calls"""
+
+    workers: int
+    warm: int
+    """How many idle workers to keep started for the next calls, even before the first one"""
+    preload: Sequence[str]
+    """The modules that the workers import as soon as they start, while waiting for their first call"""
+    single_use: bool
+    """Whether each worker is stopped after its call instead of reused"""
+    _executor: ThreadPoolExecutor
+    """Threads waiting for the replies of the workers (one per busy worker)"""
+    _idle: List[subprocess.Popen]
+    """The started workers waiting for a call, the oldest (most likely done preloading) first"""
+    _lock: threading.Lock
+
+    def __init__(self, workers: int, warm: int = 0, preload: Sequence[str] = (), single_use: bool = False):
+        self.workers = max(1, workers)
+        self.warm = warm
+        self.preload = preload
+        self.single_use = single_use
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='yacv_worker')
+        self._idle = []
+        self._lock = threading.Lock()
+        self._fill()
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Calls fn(*args) in a worker process, returning the future of its result"""
+        return self._executor.submit(self._call, fn, args)
+
+    def _call(self, fn: Callable, args: tuple) -> Any:
+        with self._lock:
+            process = self._idle.pop(0) if self._idle else None
+        self._fill()  # Warm up the next one while this one runs
+        if process is None:
+            process = self._start()
+        try:
+            _send(process.stdin, (fn, args))
+            status, result = pickle.loads(_receive(process.stdout))
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        if self.single_use:
+            self._stop(process)
+        else:
+            with self._lock:
+                self._idle.append(process)
+        if status != 'ok':
+            raise RuntimeError(f'{fn.__qualname__} failed in a worker process:\n{result}')
+        return result
+
+    def _fill(self):
+        with self._lock:
+            while len(self._idle) < self.warm:
+                self._idle.append(self._start())
+
+    def _start(self) -> subprocess.Popen:
+        # Make sure that the workers import this same yacv_server, and that they do not start another server
+        package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        python_path = os.pathsep.join(filter(None, [package_parent, os.getenv('PYTHONPATH')]))
+        env = {**os.environ, 'PYTHONPATH': python_path, 'YACV_DISABLE_SERVER': '1'}
+        return subprocess.Popen([sys.executable, '-c', 'from yacv_server.workers import _serve; _serve()',
+                                 *self.preload], stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+
+    @staticmethod
+    def _stop(process: subprocess.Popen):
+        process.stdin.close()  # The worker exits when its stdin is closed
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+
+    def close(self):
+        """Cancels the pending calls, waits for the running ones and stops the workers"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for process in idle:
+            self._stop(process)
+
+    def __enter__(self) -> 'WorkerPool':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _serve():
+    """Entry point of the worker processes: runs the calls received through stdin until it is closed"""
+    # Keep anything printed by the called functions (even from C++) out of the replies, by sending it to stderr
+    stdin, stdout = sys.stdin.buffer, os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    for module in sys.argv[1:]:  # WorkerPool.preload
+        importlib.import_module(module)
+    while True:
+        try:
+            message = _receive(stdin)
+        except (EOFError, KeyboardInterrupt):  # Closed by the pool, or the parent process is being interrupted
+            return
+        try:
+            fn, args = pickle.loads(message)
+            reply = ('ok', fn(*args))
+        except Exception:
+            reply = ('error', traceback.format_exc())
+        _send(stdout, reply)
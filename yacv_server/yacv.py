@@ -1,37 +1,45 @@
+from __future__ import annotations
+
 import atexit
 import base64
+import concurrent.futures
+import contextlib
 import copy
+import hashlib
 import inspect
+import json
 import os
 import signal
 import sys
 import threading
 import time
-from dataclasses import dataclass
+import weakref
+from dataclasses import dataclass, fields
 from enum import Enum, auto
 from http.server import ThreadingHTTPServer
 from io import BytesIO
 from threading import Thread
-from typing import Optional, Dict, Union, Callable, List, Tuple
-
-from OCP.TopLoc import TopLoc_Location
-from OCP.TopoDS import TopoDS_Shape
-from PIL import Image
-# noinspection PyProtectedMember
-from build123d import Shape, Axis, Location, Vector
-from dataclasses_json import dataclass_json
-
-from yacv_server.cad import _hashcode, get_color, ColorTuple
-from yacv_server.cad import get_shape, grab_all_cad, CADCoreLike, CADLike
-from yacv_server.gltf import get_version
+from typing import Optional, Dict, Union, Callable, List, Tuple, Iterator, TYPE_CHECKING
+
+from yacv_server.convert import CADFileCache
+from yacv_server.exporting import ExportWriter
+from yacv_server.memory import ShapeRetention, ShapeSpill, GLBCache, parse_size, rss_bytes, shape_to_brep, brep_to_shape
+from yacv_server.metrics import metrics
+from yacv_server.myasynchttp import AsyncHTTPServer
 from yacv_server.myhttp import HTTPHandler
 from yacv_server.mylogger import logger
+from yacv_server.profiling import BuildProfiler
 from yacv_server.pubsub import BufferedPubSub
 from yacv_server.rwlock import RWLock
-from yacv_server.tessellate import tessellate
+from yacv_server.tracing import tracer
+from yacv_server.version import get_version
+from yacv_server.workers import WorkerPool
+
+if TYPE_CHECKING:  # The CAD modules are slow to import, so they are only loaded when first used
+    from yacv_server.cad import CADCoreLike, CADLike, ColorTuple
+    from yacv_server.gltf import GLBSceneComposer
 
 
-@dataclass_json
 @dataclass
 class UpdatesApiData:
     """Data sent to the client through the updates API"""
@@ -42,8 +50,22 @@ class UpdatesApiData:
     is_remove: Optional[bool]
     """Whether to remove the object from the scene. If None, this is a shutdown request"""
 
+    def to_dict(self) -> Dict[str, any]:
+        return {field.name: getattr(self, field.name) for field in fields(UpdatesApiData)}
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+
+YACVSupported = Union[bytes, 'CADCoreLike']
+
+_FULL_BUILD_SUFFIX = '\0full'
+"""Appended to the name of an object to cache its build without max_triangles"""
 
-YACVSupported = Union[bytes, CADCoreLike]
+
+def _full_build_hash(event: UpdatesApiFullData) -> str:
+    """The hash of the build without max_triangles of a show event"""
+    return hashlib.md5(f'{event.hash}/full'.encode(), usedforsecurity=False).hexdigest()
 
 
 class UpdatesApiFullData(UpdatesApiData):
@@ -60,9 +82,19 @@ class UpdatesApiFullData(UpdatesApiData):
         self.obj = obj
         self.kwargs = kwargs
 
-    def to_json(self) -> str:
-        # noinspection PyUnresolvedReferences
-        return super().to_json()
+
+@dataclass
+class SceneEntry:
+    """The latest state of a named object in the scene"""
+    event: UpdatesApiFullData
+    """The latest show event of the object (its obj is None once released after building, see YACV.shape_retention)"""
+    brep_path: Optional[str] = None
+    """The binary BRep file of the spilled shape, if any"""
+
+    @property
+    def hash(self) -> str:
+        """Hash of the latest version of the object"""
+        return self.event.hash
 
 
 class YACVProtocol(Enum):
@@ -70,7 +102,18 @@ class YACVProtocol(Enum):
     HTTP = auto()
     """The recommended protocol for any platform that can run a web server."""
     STDERR = auto()
-    """Prints the updates one by one to stderr (first metadata, then base64 of glb file) using a special prefix. Required for Pyodide support."""
+    """Prints the updates one by one to stderr (first metadata, then base64 of glb file) using a special prefix. Required for Pyodide support.
+    
+    See `YACV.stderr_protocol` for the revisions of the format."""
+
+
+class YACVServerCore(Enum):
+    """Enum of web server implementations for the HTTP protocol"""
+    THREADING = auto()
+    """One thread per connection, based on the standard ThreadingHTTPServer. The default."""
+    ASYNCIO = auto()
+    """A single asyncio event loop for all connections, with object builds running in an executor. Recommended for
+    many concurrent viewers, as each open /api/updates stream no longer holds a dedicated thread."""
 
 
 class YACV:
@@ -79,20 +122,113 @@ class YACV:
     # Startup
     protocol: YACVProtocol
     """The protocol used by the server. Defaults to HTTP, but can be set to STDERR for Pyodide support."""
+    server_core: YACVServerCore
+    """The web server implementation. Defaults to THREADING, but can be set to ASYNCIO with YACV_SERVER_CORE=asyncio."""
     server_thread: Optional[Thread]
-    """The main thread running the server (will spawn other threads for each request)"""
-    server: Optional[ThreadingHTTPServer]
+    """The main thread running the server (will spawn other threads for each request in THREADING mode)"""
+    server: Optional[Union[ThreadingHTTPServer, AsyncHTTPServer]]
     """The server object"""
     startup_complete: threading.Event
     """Event to signal when the server has started"""
 
     # Running
     show_events: BufferedPubSub[UpdatesApiFullData]
-    """PubSub for show events (objects to be shown in/removed from the scene)"""
-    build_events: Dict[str, BufferedPubSub[bytes]]
-    """PubSub for build events (objects that were built)"""
+    """PubSub for show events (objects to be shown in/removed from the scene). Only the latest event of each name is
+    kept, so late-joining clients receive the whole scene no matter how many objects were shown.
+    
+    Clients with more than YACV_MAX_PENDING_EVENTS=<count> (default: 10000) distinct objects pending to be sent are
+    disconnected for lagging behind, and will resume from their last received event when reconnecting."""
+    scene: Dict[str, SceneEntry]
+    """Name-indexed state of the objects currently in the scene, kept next to the show_events log"""
+    scene_lock: threading.RLock
+    """Lock to keep the scene and the show_events log consistent (held for the whole duration of a `batch`)"""
+    _batch: threading.local
+    """The events collected by the current `batch` of each thread, if any, and whether it is in a show"""
+    _show_order: threading.Condition
+    """Lets each `show` prepare its objects without the scene lock, but publish them in call order"""
+    _show_tickets: int
+    """The number of shows that started preparing their objects"""
+    _shows_published: int
+    """The number of shows that were published (or failed), in order"""
+    _remove_events: Dict[str, UpdatesApiFullData]
+    """The remove events still in the show_events log, oldest first"""
+    max_remove_events: int
+    """The maximum number of remove events to keep in the show_events log for reconnecting clients, so that memory
+    usage is bounded by the live objects and not by the number of names ever shown.
+    
+    It can be set with the YACV_MAX_REMOVE_EVENTS=<count> environment variable (default: 1000)."""
     build_events_lock: threading.Lock
     """Lock to ensure that objects are only built once"""
+    glb_cache: GLBCache
+    """LRU of the built objects. Re-showing an object with the same hash reuses its GLB.
+    
+    By default it keeps all the built objects, but it can evict the least recently used ones (to rebuild them on
+    demand) once the total size of the GLBs exceeds YACV_GLB_CACHE_BUDGET=<size> or the resident memory of the
+    process exceeds YACV_RSS_BUDGET=<size> (only if evicting GLBs can bring it within budget), where <size> is in bytes
+    with an optional K, M or G suffix."""
+    shape_retention: ShapeRetention
+    """What to keep of the OCCT shape of each object after building it: KEEP (default), RELEASE or SPILL to disk.
+    
+    It can be set with the YACV_RELEASE_SHAPES=<keep|release|spill> environment variable."""
+    _spill: ShapeSpill
+    scene_composer: Optional[GLBSceneComposer]
+    """Composes the built objects into a single GLB scene, reusing the previous composition when possible (created on
+    the first scene export)"""
+    debounce_ms: float
+    """Coalescing window for `show` calls, in milliseconds (0 to disable, the default). Within a window, only the latest
+    object of each name is preprocessed, hashed and published, so superseded intermediate states of parametric sweeps
+    or animations are never built. The window starts with the first delayed `show` call and is not extended by the next
+    ones, so that continuous updates are still published at least once per window.
+
+    It can be set with the YACV_DEBOUNCE_MS=<ms> environment variable or overridden with `show(..., debounce=<ms>)`."""
+    _pending_shows: Dict[str, Tuple[YACVSupported, Dict[str, any]]]
+    """The latest delayed (object, kwargs) of each name, waiting for the coalescing window to end"""
+    _pending_clear: Optional[set]
+    """If set, the names to keep when clearing the scene before publishing the delayed objects (from auto_clear)"""
+    _pending_lock: threading.Lock
+    _pending_timer: Optional[threading.Timer]
+    lod: List[Union[float, Tuple[float, float]]]
+    """The tolerances (or (tolerance, angular_tolerance) pairs) of the coarse previews of each shape, coarsest first.
+    While serving over HTTP, the first preview is published instead of the shape, so that the frontend shows something
+    quickly, and a background thread builds each next level and publishes it once ready. Empty by default (no previews).
+
+    It can be set with the YACV_LOD=<tolerance>[:<angular_tolerance>],... environment variable (e.g. YACV_LOD=2:0.5)
+    or overridden with `show(..., lod=[...])`. Static exports wait for the final level of every object."""
+    _refine_jobs: Dict[str, List[UpdatesApiFullData]]
+    """The finer levels of detail of each object left to build and publish, the final one last"""
+    _refining: Optional[str]
+    """The object whose finer levels of detail are being built"""
+    _refine_cond: threading.Condition
+    _refine_thread: Optional[Thread]
+    profiler: BuildProfiler
+    """Profiles builds with cProfile and tracemalloc, serving the latest profile of each object at /api/profile/{name}
+    (add ?pstats=1 for the raw stats). Use `show(..., profile=True)` to profile the next build of some objects, or set
+    the YACV_PROFILE environment variable to profile all of them. If YACV_PROFILE_DIR=<dir> is set, all builds are
+    profiled and the <name>.prof stats and <name>.txt reports are also written to that directory."""
+    cad_files: CADFileCache
+    """Disk cache of the STEP/BREP files shown by path, keyed by path, modification time and size. It keeps the imported
+    shape as binary BRep and each build as GLB, so that showing an unchanged file again neither parses nor tessellates
+    it. It is kept in YACV_CACHE_DIR=<dir> (default: ~/.cache/yacv_server), and an empty value disables it."""
+
+    # STDERR protocol
+    stderr_protocol: int
+    """The revision of the STDERR protocol, set with the YACV_STDERR_PROTOCOL=<revision> environment variable.
+    
+    - 1 (default): each update is a single `yacv_server://model/<json><base64 glb>` line, always rebuilding the object.
+    - 2: the `yacv_server://model/<json>` line has no GLB. If the frontend already has this hash of the object, the JSON
+      has `"cached": true` and the object is not even built. Otherwise, the JSON has the `"size"` of the GLB and the
+      number of `"chunks"` that follow it as `yacv_server://chunk/<hash>/<index>/<count>/<base64 part>` lines, so that
+      the frontend can decode them as they arrive instead of holding a giant string."""
+    stderr_chunk_size: int
+    """The maximum length of the base64 data of each chunk line of the STDERR protocol revision 2.
+    
+    It can be set with the YACV_STDERR_CHUNK_SIZE=<chars> environment variable (default: 1048576)."""
+    stream_chunk_triangles: int
+    """About how many triangles each GLB blob of a streamed object has (see `export_stream`).
+
+    It can be set with the YACV_STREAM_CHUNK_TRIANGLES=<triangles> environment variable (default: 50000)."""
+    _stderr_sent: Dict[str, str]
+    """The hash of each object already printed to stderr (protocol revision 2)"""
 
     # Shutdown
     at_least_one_client: threading.Event
@@ -141,19 +277,60 @@ class YACV:
         """Initializes the YACV server"""
         raw_protocol = os.getenv('YACV_PROTOCOL', 'http' if sys.platform != 'emscripten' else 'stderr').upper()
         self.protocol = YACVProtocol[raw_protocol] if raw_protocol in YACVProtocol.__members__ else YACVProtocol.HTTP
+        raw_server_core = os.getenv('YACV_SERVER_CORE', 'threading').upper()
+        self.server_core = YACVServerCore[raw_server_core] if raw_server_core in YACVServerCore.__members__ \
+            else YACVServerCore.THREADING
         self.server_thread = None
         self.server = None
         self.startup_complete = threading.Event()
-        self.show_events = BufferedPubSub()
-        self.build_events = {}
+        self.show_events = BufferedPubSub(key=lambda event: event.name,
+                                          max_pending=int(os.getenv('YACV_MAX_PENDING_EVENTS', 10000)))
+        self.scene = {}
+        self.scene_lock = threading.RLock()
+        self._batch = threading.local()
+        self._show_order = threading.Condition()
+        self._show_tickets = 0
+        self._shows_published = 0
+        self._remove_events = {}
+        self.max_remove_events = int(os.getenv('YACV_MAX_REMOVE_EVENTS', 1000))
         self.build_events_lock = threading.Lock()
+        self.glb_cache = GLBCache(max_bytes=parse_size(os.getenv('YACV_GLB_CACHE_BUDGET')),
+                                  max_rss=parse_size(os.getenv('YACV_RSS_BUDGET')))
+        raw_shape_retention = os.getenv('YACV_RELEASE_SHAPES', 'keep').upper()
+        self.shape_retention = ShapeRetention[raw_shape_retention] \
+            if raw_shape_retention in ShapeRetention.__members__ else ShapeRetention.KEEP
+        self._spill = ShapeSpill()
+        with _instances_lock:
+            _instances.add(self)  # Its gauges are added to the metrics, and it is flushed at exit
+        self.scene_composer = None
+        self.debounce_ms = float(os.getenv('YACV_DEBOUNCE_MS', 0))
+        self._pending_shows = {}
+        self._pending_clear = None
+        self._pending_lock = threading.Lock()
+        self._pending_timer = None
+        self.lod = _read_lod(os.getenv('YACV_LOD', ''))
+        self._refine_jobs = {}
+        self._refining = None
+        self._refine_cond = threading.Condition()
+        self._refine_thread = None
+        profile_dir = os.getenv('YACV_PROFILE_DIR')
+        self.profiler = BuildProfiler(profile_all=os.getenv('YACV_PROFILE') is not None or profile_dir is not None,
+                                      directory=profile_dir)
+        cache_dir = os.getenv('YACV_CACHE_DIR', os.path.join(
+            os.getenv('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache')), 'yacv_server'))
+        self.cad_files = CADFileCache(cache_dir or None)
+        self.stderr_protocol = int(os.getenv('YACV_STDERR_PROTOCOL', 1))
+        self.stderr_chunk_size = int(os.getenv('YACV_STDERR_CHUNK_SIZE', 1024 * 1024))
+        self.stream_chunk_triangles = int(os.getenv('YACV_STREAM_CHUNK_TRIANGLES', 50000))
+        self._stderr_sent = {}
         self.at_least_one_client = threading.Event()
         self.shutting_down = threading.Event()
         self.frontend_lock = RWLock()
-        self.texture = _read_texture_uri(os.getenv("YACV_TEXTURE"))
-        self.color_faces = _read_color(os.getenv("YACV_COLOR_FACES", "#ffbf00"))  # Default yellow
-        self.color_edges = _read_color(os.getenv("YACV_COLOR_EDGES", "#1a1aff"))  # Default blue
-        self.color_vertices = _read_color(os.getenv("YACV_COLOR_VERTICES", "#1a1a1a"))  # Default dark gray
+        style = _default_style()
+        self.texture = style['texture']
+        self.color_faces = style['color_faces']
+        self.color_edges = style['color_edges']
+        self.color_vertices = style['color_vertices']
         logger.info('Using yacv-server v%s', get_version())
 
     def start(self):
@@ -175,6 +352,7 @@ class YACV:
     # noinspection PyUnusedLocal
     def stop(self, *args):
         """Stops the web server"""
+        self.flush()  # Publish any delayed objects before informing the frontend
         if self.protocol == YACVProtocol.STDERR: return  # No server to stop, just print to stderr
         # The remainder is for the HTTP protocol only
         if self.server_thread is None:
@@ -213,23 +391,79 @@ class YACV:
                 sys.exit(0)  # Exit with success
 
     _yacvServerModelPrefix = "yacv_server://model/"
+    _yacvServerChunkPrefix = "yacv_server://chunk/"
 
     def _run_server(self):
         """Runs the web server"""
-        logger.info('Starting server in %s mode...', self.protocol.name)
-        self.server = ThreadingHTTPServer(
-            (os.getenv('YACV_HOST', 'localhost'), int(os.getenv('YACV_PORT', 32323))),
-            lambda a, b, c: HTTPHandler(a, b, c, yacv=self))
+        logger.info('Starting server in %s mode (%s core)...', self.protocol.name, self.server_core.name)
+        server_address = (os.getenv('YACV_HOST', 'localhost'), int(os.getenv('YACV_PORT', 32323)))
+        if self.server_core == YACVServerCore.ASYNCIO:
+            self.server = AsyncHTTPServer(server_address, yacv=self)
+        else:
+            self.server = ThreadingHTTPServer(server_address, lambda a, b, c: HTTPHandler(a, b, c, yacv=self))
         # noinspection HttpUrlsUsage
         logger.info(f'Serving at http://{self.server.server_name}:{self.server.server_port}')
         self.startup_complete.set()
         self.server.serve_forever()
 
     def _show_event(self, event: UpdatesApiFullData):
-        """Handles a show event by publishing it to the show events buffer (and special handling for stderr protocol)."""
-        self.show_events.publish(event)
-        # If the protocol is STDERR, we need to print the event to stderr
+        """Handles a show event by updating the scene and publishing it to the show events buffer, at the end of the
+        current `batch` if any."""
+        with self.batch():
+            if event.is_remove is not None:  # Not a shutdown request
+                old_entry = self.scene.pop(event.name, None)
+                unchanged = old_entry is not None and not event.is_remove and event.hash == old_entry.hash
+                if old_entry is not None and not unchanged:
+                    if old_entry.brep_path is not None:
+                        self._spill.delete(old_entry.brep_path)
+                    self.glb_cache.discard(event.name)
+                    self.glb_cache.discard(event.name + _FULL_BUILD_SUFFIX)
+                if not event.is_remove:
+                    entry = SceneEntry(event)
+                    if unchanged:  # Keep reusing the same build and spilled shape, so the new shape is not needed
+                        entry.brep_path = old_entry.brep_path
+                        if self.glb_cache.contains(event.name, event.hash):
+                            self._release_shape(entry)
+                    self.scene[event.name] = entry
+            self._batch.events.append(event)
+
+    def _publish_events(self, events: List[UpdatesApiFullData]) -> List[UpdatesApiFullData]:
+        """Publishes events to the show events buffer at once, returning the published ones (see `_print_events`)."""
+        if len(events) == 0:
+            return events
+        if len(events) > 1:  # Only the latest event of each name is relevant
+            latest_events = {}
+            for event in events:
+                latest_events.pop(event.name, None)
+                latest_events[event.name] = event
+            events = list(latest_events.values())
+
+        with self.scene_lock:
+            # The log only keeps the latest event of each name, so publishing replaces the previous one
+            for event in events:
+                if event.is_remove is not None:  # Not a shutdown request
+                    self._remove_events.pop(event.name, None)
+                    if event.is_remove:
+                        self._remove_events[event.name] = event
+            if len(events) == 1:
+                self.show_events.publish(events[0])
+            else:
+                self.show_events.publish_many(events)
+            while len(self._remove_events) > self.max_remove_events:
+                oldest_remove_event = self._remove_events.pop(next(iter(self._remove_events)))
+                self.show_events.delete(oldest_remove_event, drop=True)
+        return events
+
+    def _print_events(self, events: List[UpdatesApiFullData]):
+        """Prints the published events to stderr if the protocol is STDERR, which builds the objects, so it must not
+        hold the scene lock (builds take it while holding the build lock)"""
         if self.protocol == YACVProtocol.STDERR:
+            for event in events:
+                self._print_event(event)
+
+    def _print_event(self, event: UpdatesApiFullData):
+        """Prints an event to stderr, following the STDERR protocol revision (see `YACV.stderr_protocol`)"""
+        if self.stderr_protocol < 2:
             msg = f'{self._yacvServerModelPrefix}{event.to_json()}'
             if not event.is_remove:
                 # Always build the object even if the interface already has it (optimization disabled for Pyodide)
@@ -240,6 +474,59 @@ class YACV:
                 glb = glb_and_hash[0]
                 msg += f'{base64.b64encode(glb).decode("utf-8")}'
             print(msg, file=sys.stderr, flush=True)
+            return
+
+        metadata = event.to_dict()
+        if event.is_remove is not False:
+            self._stderr_sent.pop(event.name, None)
+        elif self._stderr_sent.get(event.name) == event.hash:
+            metadata['cached'] = True  # The frontend already has it, do not even build it
+        else:
+            glb_and_hash = self.export(event.name)
+            if glb_and_hash is None:
+                logger.warning('Object %s not found, ignoring it...', event.name)
+                return
+            glb = memoryview(glb_and_hash[0])  # Avoid copies when slicing
+            step = max(self.stderr_chunk_size // 4 * 3, 3)  # Whole base64 groups, so that each chunk decodes alone
+            chunks = (len(glb) + step - 1) // step
+            metadata.update(size=len(glb), chunks=chunks)
+            print(f'{self._yacvServerModelPrefix}{json.dumps(metadata)}', file=sys.stderr, flush=True)
+            for i in range(chunks):
+                data = base64.b64encode(glb[i * step:(i + 1) * step]).decode('utf-8')
+                print(f'{self._yacvServerChunkPrefix}{event.hash}/{i}/{chunks}/{data}', file=sys.stderr, flush=True)
+            self._stderr_sent[event.name] = event.hash
+            return
+        print(f'{self._yacvServerModelPrefix}{json.dumps(metadata)}', file=sys.stderr, flush=True)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Context manager to apply all the shows and removes within it as a single transaction.
+
+        The changes are published together when the outermost batch exits, so that the frontend receives them as a
+        single message and can update the whole scene at once. Other threads wait for the batch to finish before
+        changing the scene. `show` always uses a batch, so that auto_clear and the new objects are applied at once
+        (within a batch, it also preprocesses its objects while holding the scene lock).
+
+        Example::
+
+            with yacv.batch():
+                yacv.remove('old')
+                yacv.show(part, names='new', auto_clear=False)
+        """
+        if getattr(self._batch, 'events', None) is not None:  # Nested: the outermost batch publishes everything
+            yield
+            return
+        events = []
+        try:
+            with self.scene_lock:
+                self._batch.events = []
+                try:
+                    yield
+                finally:
+                    events, self._batch.events = self._batch.events, None
+                    events = self._publish_events(events)
+        finally:
+            self._print_events(events)  # After releasing the scene lock
 
     def show(self, *objs: List[YACVSupported], names: Optional[Union[str, List[str]]] = None, **kwargs):
         """
@@ -250,14 +537,26 @@ class YACV:
         - texture: The texture to use for the faces of the object (see `YACV.texture` for more info)
         - color: The default color to use for the objects (can be overridden by the `color` attribute of each object)
         - tolerance: The tolerance for tessellating the object (default: 0.1)
-        - angular_tolerance: The angular tolerance for tessellating the object (default: 0.1)
+        - angular_tolerance: The angular tolerance for tessellating the object (default: 0.1, or 0.5 with
+          relative_tolerance)
+        - relative_tolerance: If set, tessellate with this fraction of the bounding box diagonal as the tolerance (e.g.
+          0.001), so that the triangles follow the size of the object instead of its units
+        - relative_to: Whether the relative_tolerance follows the size of the whole 'object' (default) or of each 'face'
+        - max_triangles: The maximum number of triangles of the faces of the object, tessellating them again with
+          coarser tolerances and then decimating them if needed (the full mesh is still served with `export(...,
+          full=True)`, at /api/object/{name}?full=1)
         - faces: Whether to tessellate and show the faces of the object (default: True)
         - edges: Whether to tessellate and show the edges of the object (default: True)
         - vertices: Whether to tessellate and show the vertices of the object (default: True)
-
-        :param objs: The CAD objects to show. Can be CAD-like objects (solids, locations, etc.) or bytes (GLTF) objects.
-        :param names: The names of the objects. If None, the variable names will be used (if possible). The number of
-            names must match the number of objects. An object of the same name will be replaced in the frontend.
+        - lod: The tolerances of the coarse previews to publish before the object (see `YACV.lod` for more info)
+        - debounce: The coalescing window in milliseconds (see `YACV.debounce_ms` for more info)
+        - profile: Whether to profile the next build of the objects, even if already built (see `YACV.profiler`)
+
+        :param objs: The CAD objects to show. Can be CAD-like objects (solids, locations, etc.), bytes (GLTF) objects or
+            paths to STEP/BREP files (see `YACV.cad_files`).
+        :param names: The names of the objects. If None, the variable names (or file names) will be used (if possible).
+            The number of names must match the number of objects. An object of the same name will be replaced in the
+            frontend.
         :param kwargs: Additional options for the show_object event.
         """
         # Prepare the arguments
@@ -268,21 +567,73 @@ class YACV:
         assert len(names) == len(objs), 'Number of names must match the number of objects'
         for color_name in ('color_faces', 'color_edges', 'color_vertices'):
             if color_name in kwargs:
+                from yacv_server.cad import get_color
                 kwargs[color_name] = get_color(kwargs[color_name]) or _read_color(kwargs[color_name])
+        debounce_ms = kwargs.pop('debounce', self.debounce_ms)
+        if kwargs.pop('profile', False):
+            for name in names:
+                self.profiler.request(name)
+                self.glb_cache.discard(name)  # Rebuild it even if it did not change
 
-        # Handle auto clearing of previous objects
-        if kwargs.get('auto_clear', True):
-            self.clear(except_names=names)
+        if debounce_ms > 0 and self._show_later(objs, names, kwargs, debounce_ms):
+            return
+        with self._pending_lock:
+            for name in names:  # Superseded by this call
+                self._pending_shows.pop(name, None)
+
+        with self._in_show_order() as wait_turn:
+            # Preprocess the objects without blocking the scene
+            prepared = [self._prepare_show(obj, name, kwargs) for obj, name in zip(objs, names)]
+            wait_turn()
+            with self.batch():
+                # Handle auto clearing of previous objects
+                if kwargs.get('auto_clear', True):
+                    self.clear(except_names=names)
+
+                # Publish the show event (replacing any previous object with the same name)
+                for name, events in zip(names, prepared):
+                    self._publish_show(name, events)
 
-        # Remove a previous object event with the same name
-        for old_event in self.show_events.buffer():
-            if old_event.name in names:
-                self.show_events.delete(old_event)
-                if old_event.name in self.build_events:
-                    del self.build_events[old_event.name]
+        logger.info('show %s took %.3f seconds', names, time.time() - start)
 
-        # Publish the show event
-        for obj, name in zip(objs, names):
+    @contextlib.contextmanager
+    def _in_show_order(self):
+        """Lets a show prepare its objects concurrently with other shows, yielding a function that waits until the
+        previous shows are published, so that the scene still follows the order of the calls"""
+        if getattr(self._batch, 'events', None) is not None or getattr(self._batch, 'show_turn', False):
+            yield lambda: None  # Within a batch (which holds the scene lock) or another show, so already in turn
+            return
+        with self._show_order:
+            ticket = self._show_tickets
+            self._show_tickets += 1
+
+        def wait_turn():
+            with self._show_order:
+                while self._shows_published < ticket:
+                    self._show_order.wait()
+
+        self._batch.show_turn = True
+        try:
+            yield wait_turn
+        finally:
+            wait_turn()  # Even if it failed, the next shows wait for it
+            self._batch.show_turn = False
+            with self._show_order:
+                self._shows_published += 1
+                self._show_order.notify_all()
+
+    def _publish_show(self, name: str, events: List[UpdatesApiFullData]):
+        """Publishes the first prepared event of an object, and queues the finer levels of detail, if any"""
+        self._show_event(events[0])
+        if len(events) > 1:
+            self._refine_later(name, events[1:])
+
+    def _prepare_show(self, obj: YACVSupported, name: str, kwargs: Dict[str, any]) -> List[UpdatesApiFullData]:
+        """Preprocesses and hashes a single object, returning the events to publish it (see `_publish_show`)"""
+        if isinstance(obj, (str, os.PathLike)):
+            return [self._prepare_cad_file(os.fspath(obj), name, kwargs)]
+        from yacv_server.cad import _hashcode, get_color
+        with tracer.span('show', object=name):
             obj_color = get_color(obj)
             # Some properties may be lost in preprocessing, so save them in kwargs
             _kwargs = kwargs.copy()
@@ -290,126 +641,512 @@ class YACV:
                 _kwargs['color_obj'] = obj_color  # Only applies to highest-dimensional objects
             _kwargs['texture'] = _read_texture_uri(getattr(obj, 'yacv_texture', None) or kwargs.get('texture', None))
             if not isinstance(obj, bytes):
-                obj = _preprocess_cad(obj, **_kwargs)
-            _hash = _hashcode(obj, **_kwargs)
+                with metrics.phase('preprocess_cad'):
+                    obj = _preprocess_cad(obj, **_kwargs)
+            with metrics.phase('hashcode'):
+                _hash = _hashcode(obj, **_kwargs)
+            metrics.inc('yacv_shows_total')
             event = UpdatesApiFullData(name=name, _hash=_hash, obj=obj, kwargs=_kwargs or {})
-            self._show_event(event)
-
-        logger.info('show %s took %.3f seconds', names, time.time() - start)
+            return self._lod_previews(event) + [event]
+
+    def _lod_previews(self, event: UpdatesApiFullData) -> List[UpdatesApiFullData]:
+        """The coarse versions of a shape to publish before it, if any (see `YACV.lod`)"""
+        from OCP.TopoDS import TopoDS_Shape
+        lod = event.kwargs.get('lod', self.lod)
+        if not lod or not isinstance(event.obj, TopoDS_Shape) or self.server_thread is None:
+            return []  # Nobody is watching the progress (e.g. static exports or the STDERR protocol)
+        previews = []
+        for level in lod:
+            tolerance, angular_tolerance = level if isinstance(level, (tuple, list)) \
+                else (level, event.kwargs.get('angular_tolerance', 0.1))
+            kwargs = {**event.kwargs, 'tolerance': tolerance, 'angular_tolerance': angular_tolerance,
+                      'relative_tolerance': None}  # Levels are absolute tolerances
+            _hash = hashlib.md5(f'{event.hash}/{tolerance}/{angular_tolerance}'.encode(), usedforsecurity=False)
+            previews.append(UpdatesApiFullData(obj=event.obj, name=event.name, _hash=_hash.hexdigest(), kwargs=kwargs))
+        return previews
+
+    def _refine_later(self, name: str, events: List[UpdatesApiFullData]):
+        """Queues the finer levels of detail of an object for the background thread, replacing any previous ones"""
+        with self._refine_cond:
+            self._refine_jobs.pop(name, None)
+            self._refine_jobs[name] = events
+            if self._refine_thread is None:
+                self._refine_thread = Thread(target=self._refine_loop, name='yacv_refine', daemon=True)
+                self._refine_thread.start()
+            self._refine_cond.notify_all()
+
+    def _refine_loop(self):
+        while True:
+            with self._refine_cond:
+                while not self._refine_jobs:
+                    self._refine_cond.wait()
+                name = next(iter(self._refine_jobs))
+                events = self._refine_jobs.pop(name)
+                self._refining = name
+            try:
+                self._refine(name, events)
+            except Exception:
+                logger.exception('Could not refine object %s', name)
+            with self._refine_cond:
+                self._refining = None
+                self._refine_cond.notify_all()
+
+    def _refine(self, name: str, events: List[UpdatesApiFullData]):
+        """Builds and publishes each finer level of detail of an object, unless it was replaced or removed meanwhile"""
+        with self.scene_lock:
+            entry = self.scene.get(name)
+        if entry is None:
+            return
+        published = entry.event
+        self.export(name)  # The frontend is waiting for the coarsest level, so build it first
+        for event in events:
+            start = time.time()
+            tolerance = event.kwargs.get('tolerance', 0.1)
+            with tracer.span('refine', object=name, tolerance=tolerance):
+                with self.build_events_lock:  # Meshing modifies the shape, which is shared with the other levels
+                    glb_bytes = self._build(name, event, event.obj)
+            with self.batch():  # Published (and printed) once cached, after releasing the scene lock
+                entry = self.scene.get(name)
+                if entry is None or entry.event is not published:
+                    return
+                self._show_event(event)
+                self._cache_build(name, self.scene[name], glb_bytes)  # Before any client can request it
+            published = event
+            logger.info('refine(%s) to tolerance %s took %.3f seconds, %s', name, tolerance, time.time() - start,
+                        sizeof_fmt(len(glb_bytes)))
+
+    def wait_refined(self):
+        """Waits until every shown object reached its final level of detail (see `YACV.lod`)"""
+        with self._refine_cond:
+            while self._refine_jobs or self._refining is not None:
+                self._refine_cond.wait()
+
+    def _prepare_cad_file(self, path: str, name: str, kwargs: Dict[str, any]) -> UpdatesApiFullData:
+        """Imports (or reads from the cache) a STEP/BREP file, returning the event to publish it"""
+        with tracer.span('show', object=name, path=path):
+            _kwargs = kwargs.copy()
+            _kwargs['texture'] = _read_texture_uri(kwargs.get('texture', None))
+            with metrics.phase('hashcode'):
+                _hash = self.cad_files.hash(path, self._tessellate_options(_kwargs))
+            obj = self.cad_files.get_glb(path, _hash)
+            if obj is None:
+                with metrics.phase('import_cad_file'):
+                    imported, obj_color = self.cad_files.load(path)
+                if obj_color is not None:
+                    _kwargs['color_obj'] = obj_color
+                with metrics.phase('preprocess_cad'):
+                    obj = _preprocess_cad(imported, **_kwargs)
+            _kwargs['cad_file'] = path  # To cache the build
+            metrics.inc('yacv_shows_total')
+            return UpdatesApiFullData(name=name, _hash=_hash, obj=obj, kwargs=_kwargs)
+
+    def _show_later(self, objs: Tuple[YACVSupported, ...], names: List[str], kwargs: Dict[str, any],
+                    debounce_ms: float) -> bool:
+        """Delays the objects until the end of the coalescing window, replacing any delayed object with the same name.
+        Returns False if they could not be delayed (e.g. no threads in Pyodide) and must be shown now."""
+        with self._pending_lock:
+            if kwargs.get('auto_clear', True):
+                # The delayed objects that would be cleared by this call are superseded
+                for name in [name for name in self._pending_shows if name not in names]:
+                    del self._pending_shows[name]
+                self._pending_clear = set(names)
+            elif self._pending_clear is not None:
+                self._pending_clear.update(names)
+            for obj, name in zip(objs, names):
+                self._pending_shows.pop(name, None)  # Keep the order of the latest calls
+                self._pending_shows[name] = (obj, kwargs)
+            if self._pending_timer is None:
+                self._pending_timer = threading.Timer(debounce_ms / 1000.0, self.flush)
+                self._pending_timer.daemon = True
+                try:
+                    self._pending_timer.start()
+                except RuntimeError:  # Can't start new thread
+                    self._pending_timer = None
+                    self._pending_shows.clear()
+                    self._pending_clear = None
+                    return False
+        logger.debug('show %s delayed by up to %.0f ms', names, debounce_ms)
+        return True
+
+    def flush(self):
+        """Publishes the objects delayed by the coalescing window of `show` right away (see `YACV.debounce_ms`)"""
+        start = time.time()
+        with self._in_show_order() as wait_turn:  # Also publishes the delayed objects in order
+            with self._pending_lock:
+                if self._pending_timer is not None:
+                    self._pending_timer.cancel()
+                    self._pending_timer = None
+                pending_shows, self._pending_shows = self._pending_shows, {}
+                pending_clear, self._pending_clear = self._pending_clear, None
+            if len(pending_shows) == 0 and pending_clear is None:
+                return
+            prepared = [self._prepare_show(obj, name, kwargs) for name, (obj, kwargs) in pending_shows.items()]
+            wait_turn()
+            with self.batch():
+                if pending_clear is not None:
+                    self.clear(except_names=list(pending_clear))
+                for name, events in zip(pending_shows, prepared):
+                    self._publish_show(name, events)
+        logger.info('show %s (delayed) took %.3f seconds', list(pending_shows.keys()), time.time() - start)
 
     def show_cad_all(self, **kwargs):
         """Publishes all CAD objects in the current scope to the server. See `show` for more details."""
+        from yacv_server.cad import grab_all_cad
         all_cad = list(grab_all_cad())  # List for reproducible iteration order
         self.show(*[cad for _, cad in all_cad], names=[name for name, _ in all_cad], **kwargs)
 
     def remove(self, name: str):
         """Removes a previously-shown object from the scene"""
-        show_events = self._show_events(name)
-        if len(show_events) > 0:
-            # Ensure only the new remove event remains for this name
-            for old_show_event in show_events:
-                self.show_events.delete(old_show_event)
-
-            # Delete any cached object builds
-            with self.build_events_lock:
-                if name in self.build_events:
-                    del self.build_events[name]
-
-            # Publish the remove event
-            show_event = copy.copy(show_events[-1])
-            show_event.is_remove = True
-            self._show_event(show_event)
+        with self._pending_lock:
+            self._pending_shows.pop(name, None)  # Do not show it later either
+        with self.batch():
+            entry = self.scene.get(name)
+            if entry is not None:
+                # Publish the remove event (this also deletes the show event and any cached object build)
+                show_event = copy.copy(entry.event)
+                show_event.is_remove = True
+                show_event.obj = None  # Do not keep the object alive just to notify its removal
+                show_event.kwargs = None
+                self._show_event(show_event)
 
     def clear(self, except_names: List[str] = None):
         """Clears all previously-shown objects from the scene"""
-        if except_names is None:
-            except_names = []
-        for event in self.show_events.buffer():
-            if event.name not in except_names:
-                self.remove(event.name)
+        except_names = set(except_names or [])
+        with self._pending_lock:
+            for name in [name for name in self._pending_shows if name not in except_names]:
+                del self._pending_shows[name]
+        with self.batch():
+            for name in [name for name in self.scene if name not in except_names]:
+                self.remove(name)
 
     def shown_object_names(self, apply_removes: bool = True) -> List[str]:
         """Returns the names of all objects that have been shown"""
-        res = set()
-        for obj in self.show_events.buffer():
-            if not obj.is_remove or not apply_removes:
-                res.add(obj.name)
-            else:
-                res.discard(obj.name)
-        return list(res)
+        with self.scene_lock:
+            if apply_removes:
+                return list(self.scene.keys())
+            return list(self._remove_events.keys()) + list(self.scene.keys())
 
     def _show_events(self, name: str, apply_removes: bool = True) -> List[UpdatesApiFullData]:
         """Returns the show events with the given name"""
-        res = []
-        for event in self.show_events.buffer():
-            if event.name == name:
-                if not event.is_remove or not apply_removes:
-                    res.append(event)
-                else:
-                    # Also remove the previous events
-                    for old_event in res:
-                        if old_event.name == event.name:
-                            res.remove(old_event)
-        return res
-
-    def export(self, name: str) -> Optional[Tuple[bytes, str]]:
-        """Export the given previously-shown object to a single GLB blob, building it if necessary."""
+        with self.scene_lock:
+            entry = self.scene.get(name)
+            res = [entry.event] if entry is not None else []
+            if not apply_removes and name in self._remove_events:
+                res.insert(0, self._remove_events[name])
+            return res
+
+    def export(self, name: str, full: bool = False) -> Optional[Tuple[bytes, str]]:
+        """Export the given previously-shown object to a single GLB blob, building it if necessary. If full, an object
+        shown with max_triangles is built without that limit (served at /api/object/{name}?full=1)."""
+        with tracer.span('export', object=name):
+            if full:
+                return self._export_full(name)
+            return self._export(name)
+
+    def _export_full(self, name: str) -> Optional[Tuple[bytes, str]]:
+        with self.scene_lock:
+            entry = self.scene.get(name)
+        if entry is None or entry.event.kwargs is None or entry.event.kwargs.get('max_triangles') is None or \
+                isinstance(entry.event.obj, bytes):
+            return self._export(name)  # Already full, or already a GLTF that cannot be tessellated again
+        event = entry.event
+        _hash = _full_build_hash(event)
+        with self.build_events_lock:
+            glb_bytes = self.glb_cache.get(name + _FULL_BUILD_SUFFIX, _hash)
+            if glb_bytes is not None:
+                return glb_bytes, _hash
+            obj = event.obj
+            if obj is None and entry.brep_path is not None:
+                obj = ShapeSpill.load(entry.brep_path)
+            if obj is not None:
+                full_event = UpdatesApiFullData(obj=obj, name=name, _hash=_hash,
+                                                kwargs={**event.kwargs, 'max_triangles': None})
+                glb_bytes = self._build(name, full_event, obj)
+                self.glb_cache.put(name + _FULL_BUILD_SUFFIX, _hash, glb_bytes)
+                return glb_bytes, _hash
+        logger.warning('The shape of %s was released after building it, so it cannot be built in full', name)
+        return self._export(name)  # Outside the build lock, which it takes
+
+    def _flush_pending(self, name: str):
+        """Publishes the delayed objects right away if the given one is among them (see `flush`)"""
+        with self._pending_lock:
+            pending = name in self._pending_shows
+        if pending:
+            self.flush()
+
+    def export_stream(self, name: str, full: bool = False) -> Optional[Iterator[bytes]]:
+        """Like `export`, but yields the object as several GLB blobs (see `tessellate_chunks`), each one as soon as it
+        is built, so that huge objects start showing long before they are fully tessellated. Objects that are already
+        built are a single blob, and streamed builds are not cached (served at /api/object/{name}?stream=1)."""
+        self._flush_pending(name)
+        with self.scene_lock:
+            entry = self.scene.get(name)
+        if entry is None:
+            logger.warning('Object %s not found', name)
+            return None
+        event = entry.event
+        if isinstance(event.obj, bytes):  # Already a GLTF
+            return (glb_bytes for glb_bytes in [event.obj])
+
+        kwargs, cache_name, _hash = event.kwargs, name, event.hash
+        if full and kwargs.get('max_triangles') is not None:
+            kwargs = {**kwargs, 'max_triangles': None}
+            cache_name, _hash = name + _FULL_BUILD_SUFFIX, _full_build_hash(event)
+        glb_bytes = self.glb_cache.get(cache_name, _hash)
+        obj = event.obj
+        if glb_bytes is None and obj is None and entry.brep_path is not None:  # Evicted after spilling the shape
+            obj = ShapeSpill.load(entry.brep_path)
+        if glb_bytes is None and obj is None:  # Released after building it, so only the (re)built GLB is left
+            exported = self.export(name, full)
+            glb_bytes = exported[0] if exported is not None else None
+        if glb_bytes is not None:
+            return (glb_bytes for glb_bytes in [glb_bytes])
+        return self._build_stream(name, obj, kwargs)
+
+    def _build_stream(self, name: str, obj: CADCoreLike, kwargs: Dict[str, any]) -> Iterator[bytes]:
+        """Tessellates a shape into GLB blobs of about `stream_chunk_triangles` each"""
+        from yacv_server.tessellate import tessellate_chunks
+        start = time.time()
+        size = 0
+        chunks = tessellate_chunks(obj, chunk_triangles=self.stream_chunk_triangles, **self._tessellate_options(kwargs))
+        try:
+            while True:
+                with self.build_events_lock:  # Meshing modifies the shape, which another build may be tessellating
+                    gltf = next(chunks, None)
+                if gltf is None:
+                    break
+                with metrics.phase('glb_serialize'):
+                    glb_bytes = b''.join(gltf.save_to_bytes())
+                size += len(glb_bytes)
+                yield glb_bytes
+        finally:
+            chunks.close()
+        metrics.inc('yacv_builds_total')
+        logger.info('export_stream(%s) took %.3f seconds, %s', name, time.time() - start, sizeof_fmt(size))
+
+    def _export(self, name: str) -> Optional[Tuple[bytes, str]]:
         start = time.time()
+        self._flush_pending(name)
 
         # Check that the object to build exists and grab it if it does
-        events = self._show_events(name)
-        if len(events) == 0:
+        with self.scene_lock:
+            entry = self.scene.get(name)
+        if entry is None:
             logger.warning('Object %s not found', name)
             return None
-        event = events[-1]
+        event = entry.event
+
+        obj = event.obj
+        if isinstance(obj, bytes):  # Already a GLTF
+            return obj, event.hash
 
         # Use the lock to ensure that we don't build the object twice
         with self.build_events_lock:
-            # If there are no object events for this name, we need to build the object
-            if name not in self.build_events:
-                logger.debug('Building object %s with hash %s', name, event.hash)
-
-                # Prepare the pubsub for the object
-                publish_to = BufferedPubSub[bytes]()
-                self.build_events[name] = publish_to
-
-                # Build and publish the object (once)
-                if isinstance(event.obj, bytes):  # Already a GLTF
-                    publish_to.publish(event.obj)
-                else:  # CAD object to tessellate and convert to GLTF
-                    gltf = tessellate(
-                        event.obj,
-                        color_faces=event.kwargs.get('color_faces', self.color_faces),
-                        color_edges=event.kwargs.get('color_edges', self.color_edges),
-                        color_vertices=event.kwargs.get('color_vertices', self.color_vertices),
-                        color_obj=event.kwargs.get('color_obj', None),
-                        tolerance=event.kwargs.get('tolerance', 0.1),
-                        angular_tolerance=event.kwargs.get('angular_tolerance', 0.1),
-                        faces=event.kwargs.get('faces', True), edges=event.kwargs.get('edges', True),
-                        vertices=event.kwargs.get('vertices', True),
-                        texture=event.kwargs.get('texture', self.texture))
-                    glb_list_of_bytes = gltf.save_to_bytes()
-                    glb_bytes = b''.join(glb_list_of_bytes)
-                    publish_to.publish(glb_bytes)
-                    logger.info('export(%s) took %.3f seconds, %s', name, time.time() - start,
-                                sizeof_fmt(len(glb_bytes)))
-
-            # In either case return the elements of a subscription to the async generator
-            subscription = self.build_events[name].subscribe()
-            try:
-                return next(subscription), event.hash
-            finally:
-                # noinspection PyInconsistentReturns
-                subscription.close()
+            glb_bytes = self.glb_cache.get(name, event.hash)
+            if glb_bytes is not None:
+                return glb_bytes, event.hash
+
+            # If there is no build for this version of the object, we need to build it
+            if obj is None and entry.brep_path is not None:  # Evicted after spilling the shape
+                obj = ShapeSpill.load(entry.brep_path)
+            glb_bytes = self._build(name, event, obj)
+            logger.info('export(%s) took %.3f seconds, %s', name, time.time() - start, sizeof_fmt(len(glb_bytes)))
+            self._cache_build(name, entry, glb_bytes)
+            return glb_bytes, event.hash
+
+    def _build(self, name: str, event: UpdatesApiFullData, obj: CADCoreLike) -> bytes:
+        """Tessellates the shape of a show event into a GLB"""
+        from yacv_server.tessellate import tessellate
+        logger.debug('Building object %s with hash %s', name, event.hash)
+        with self.profiler.profile(name, event.hash):
+            gltf = tessellate(obj, **self._tessellate_options(event.kwargs))
+            with metrics.phase('glb_serialize'):
+                glb_list_of_bytes = gltf.save_to_bytes()
+                glb_bytes = b''.join(glb_list_of_bytes)
+        metrics.inc('yacv_builds_total')
+        return glb_bytes
+
+    def _tessellate_options(self, kwargs: Dict[str, any]) -> Dict[str, any]:
+        """The options to tessellate an object shown with the given kwargs"""
+        return _tessellate_options(kwargs, dict(color_faces=self.color_faces, color_edges=self.color_edges,
+                                                color_vertices=self.color_vertices, texture=self.texture))
+
+    def _cache_build(self, name: str, entry: SceneEntry, glb_bytes: bytes):
+        """Caches the build (unless the object changed meanwhile) and applies the memory policy"""
+        with self.scene_lock:
+            if self.scene.get(name) is entry:
+                self._release_shape(entry)
+                self.glb_cache.put(name, entry.hash, glb_bytes,
+                                   evictable=entry.event.obj is not None or entry.brep_path is not None)
+        if 'cad_file' in entry.event.kwargs:
+            self.cad_files.put_glb(entry.event.kwargs['cad_file'], entry.hash, glb_bytes)
+
+    def _release_shape(self, entry: SceneEntry):
+        """Releases the shape of a built object from memory, if requested by the shape retention policy"""
+        from OCP.TopoDS import TopoDS_Shape
+        if self.shape_retention == ShapeRetention.KEEP or not isinstance(entry.event.obj, TopoDS_Shape):
+            return
+        if self.shape_retention == ShapeRetention.SPILL and entry.brep_path is None:
+            entry.brep_path = self._spill.spill(entry.event.obj)
+            if entry.brep_path is None:
+                return  # Keep it in memory if it could not be spilled
+        entry.event.obj = None
+
+    def export_scene(self) -> Tuple[bytes, str]:
+        """Export all previously-shown objects to a single GLB blob with one node per object, building them if
+        necessary. The composition is cached and only the changed objects are merged again."""
+        start = time.time()
+        self.flush()
+        self.wait_refined()
+        with self.build_events_lock:
+            if self.scene_composer is None:
+                from yacv_server.gltf import GLBSceneComposer
+                self.scene_composer = GLBSceneComposer()
+        objects = []
+        for name in sorted(self.shown_object_names()):
+            _export = self.export(name)
+            if _export is not None:
+                objects.append((name, _export[1], _export[0]))
+        with metrics.phase('scene_compose'):
+            glb, _hash = self.scene_composer.compose(objects)
+        logger.info('export_scene() took %.3f seconds, %s', time.time() - start, sizeof_fmt(len(glb)))
+        return glb, _hash
+
+    def stats(self) -> Dict[str, any]:
+        """Returns a snapshot of the performance metrics of the server, also available in the Prometheus text format at
+        /api/metrics. This includes the time spent in each phase of showing and building objects, the GLB cache usage,
+        the bytes served and the number of connected clients. The metrics are those of the whole process, adding up
+        all the YACV instances (usually only the global one)."""
+        return metrics.stats()
 
     def export_all(self, folder: str,
-                   export_filter: Callable[[str, Optional[CADCoreLike]], bool] = lambda name, obj: True):
-        """Export all previously-shown objects to GLB files in the given folder"""
-        os.makedirs(folder, exist_ok=True)
-        for name in self.shown_object_names():
-            if export_filter(name, self._show_events(name)[-1].obj):
-                with open(os.path.join(folder, f'{name}.glb'), 'wb') as f:
-                    f.write(self.export(name)[0])
+                   export_filter: Callable[[str, Optional[CADCoreLike]], bool] = lambda name, obj: True,
+                   workers: Optional[int] = None):
+        """Export all previously-shown objects to GLB files in the given folder, along with a manifest.json of their
+        names, hashes and sizes for static hosting. If the folder ends with .zip, .tar, .tar.gz or .tgz, the files are
+        streamed into a single archive instead. The object passed to the filter is None if its shape was already
+        released from memory (see `YACV.shape_retention`).
+
+        The objects are built by up to `workers` processes in parallel, as OCCT does not release the GIL while meshing,
+        and each file is written as soon as its object is ready. It defaults to YACV_EXPORT_WORKERS=<count> or 1 to
+        build them in this process, and 0 means one per CPU."""
+        start = time.time()
+        if workers is None:
+            workers = int(os.getenv('YACV_EXPORT_WORKERS', 1))
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+        self.flush()
+        self.wait_refined()
+        with self.scene_lock:
+            entries = list(self.scene.items())
+        entries = [(name, entry) for name, entry in entries if export_filter(name, entry.event.obj)]
+
+        # Only the shapes that were not built yet are worth sending to other processes
+        to_build = []
+        if workers > 1:
+            from OCP.TopoDS import TopoDS_Shape
+            to_build = [(name, entry) for name, entry in entries
+                        if (isinstance(entry.event.obj, TopoDS_Shape) or entry.brep_path is not None)
+                        and not self.glb_cache.contains(name, entry.hash)]
+            if len(to_build) < 2:  # Not worth starting a worker
+                to_build = []
+        build_names = {name for name, _ in to_build}
+
+        with ExportWriter(folder) as writer, WorkerPool(min(workers, len(to_build))) as pool:
+            futures = {}
+            for name, entry in to_build:
+                brep, options = self._brep_of(entry), self._tessellate_options(entry.event.kwargs)
+                futures[pool.submit(_build_glb, brep, options)] = (name, entry)
+            for name, entry in entries:  # Meanwhile, write the objects that are cheap or already built
+                if name not in build_names:
+                    _export = self.export(name)
+                    if _export is not None:
+                        writer.write(name, _export[1], _export[0])
+            for future in concurrent.futures.as_completed(futures):
+                name, entry = futures[future]
+                glb = future.result()
+                metrics.inc('yacv_builds_total')
+                self._cache_build(name, entry, glb)
+                writer.write(name, entry.hash, glb)
+        logger.info('export_all(%s) took %.3f seconds, %d objects (%d built by %d worker processes)', folder,
+                    time.time() - start, len(entries), len(to_build), min(workers, len(to_build)))
+
+    @staticmethod
+    def _brep_of(entry: SceneEntry) -> bytes:
+        """The serialized shape of an object, to build it in another process"""
+        obj = entry.event.obj
+        if obj is None:  # Released after spilling the shape
+            with open(entry.brep_path, 'rb') as f:
+                return f.read()
+        return shape_to_brep(obj)
+
+
+_instances: weakref.WeakSet[YACV] = weakref.WeakSet()
+"""The live YACV instances, whose gauges are added up in the process-wide metrics"""
+
+_instances_lock = threading.Lock()
+
+
+def _live_instances() -> List[YACV]:
+    with _instances_lock:
+        return list(_instances)
+
+
+def _instances_total(value: Callable[[YACV], float]) -> Callable[[], float]:
+    """A metrics callback that adds up the given value of all the live YACV instances"""
+    return lambda: sum(value(instance) for instance in _live_instances())
+
+
+@atexit.register
+def _flush_instances():
+    """Do not lose the delayed objects of short scripts (see `YACV.flush`)"""
+    for instance in _live_instances():
+        instance.flush()
+
+
+metrics.callback('yacv_glb_cache_hits_total', _instances_total(lambda instance: instance.glb_cache.hits))
+metrics.callback('yacv_glb_cache_misses_total', _instances_total(lambda instance: instance.glb_cache.misses))
+metrics.callback('yacv_glb_cache_evictions_total', _instances_total(lambda instance: instance.glb_cache.evictions))
+metrics.callback('yacv_glb_cache_bytes', _instances_total(lambda instance: instance.glb_cache.nbytes))
+metrics.callback('yacv_scene_objects', _instances_total(lambda instance: len(instance.scene)))
+metrics.callback('yacv_update_subscribers', _instances_total(lambda instance: instance.show_events.subscriber_count()))
+metrics.callback('yacv_resident_memory_bytes', rss_bytes)
+
+
+def _default_style() -> Dict[str, any]:
+    """The default colors and texture of the shown objects, from the YACV_COLOR_FACES, YACV_COLOR_EDGES,
+    YACV_COLOR_VERTICES and YACV_TEXTURE environment variables"""
+    return dict(
+        color_faces=_read_color(os.getenv("YACV_COLOR_FACES", "#ffbf00")),  # Default yellow
+        color_edges=_read_color(os.getenv("YACV_COLOR_EDGES", "#1a1aff")),  # Default blue
+        color_vertices=_read_color(os.getenv("YACV_COLOR_VERTICES", "#1a1a1a")),  # Default dark gray
+        texture=_read_texture_uri(os.getenv("YACV_TEXTURE")),
+    )
+
+
+def _tessellate_options(kwargs: Dict[str, any], defaults: Dict[str, any]) -> Dict[str, any]:
+    """The options of `tessellate` for an object shown with the given kwargs, falling back to the given colors and
+    texture (see `_default_style`)"""
+    return dict(
+        color_faces=kwargs.get('color_faces', defaults['color_faces']),
+        color_edges=kwargs.get('color_edges', defaults['color_edges']),
+        color_vertices=kwargs.get('color_vertices', defaults['color_vertices']),
+        color_obj=kwargs.get('color_obj', None),
+        tolerance=kwargs.get('tolerance', 0.1),
+        # Let small curved features get coarser than big ones when the tolerance follows the size of the object
+        angular_tolerance=kwargs.get('angular_tolerance', 0.1 if kwargs.get('relative_tolerance') is None else 0.5),
+        relative_tolerance=kwargs.get('relative_tolerance', None),
+        relative_to=kwargs.get('relative_to', 'object'),
+        max_triangles=kwargs.get('max_triangles', None),
+        faces=kwargs.get('faces', True), edges=kwargs.get('edges', True),
+        vertices=kwargs.get('vertices', True),
+        texture=kwargs.get('texture', defaults['texture']))
+
+
+def _build_glb(brep: bytes, options: Dict[str, any]) -> bytes:
+    """Builds the GLB of a serialized shape, in the worker processes of `YACV.export_all`"""
+    from yacv_server.tessellate import tessellate
+    return b''.join(tessellate(brep_to_shape(brep), **options).save_to_bytes())
 
 
 def _read_texture_uri(uri: str) -> Optional[Tuple[bytes, str]]:
@@ -419,6 +1156,7 @@ def _read_texture_uri(uri: str) -> Optional[Tuple[bytes, str]]:
         path = uri[len("file:"):]
         with open(path, 'rb') as f:
             data = f.read()
+        from PIL import Image
         buf = BytesIO(data)
         img = Image.open(buf)
         mtype = img.get_format_mimetype()
@@ -432,6 +1170,18 @@ def _read_texture_uri(uri: str) -> Optional[Tuple[bytes, str]]:
     return None
 
 
+def _read_lod(lod: str) -> List[Union[float, Tuple[float, float]]]:
+    """Parses a comma-separated list of <tolerance>[:<angular_tolerance>] levels of detail"""
+    levels = []
+    for level in filter(None, (level.strip() for level in lod.split(','))):
+        if ':' in level:
+            tolerance, angular_tolerance = level.split(':', 1)
+            levels.append((float(tolerance), float(angular_tolerance)))
+        else:
+            levels.append(float(level))
+    return levels
+
+
 def _read_color(color: str) -> Optional[ColorTuple]:
     """Reads a color from a string in the format #RRGGBB or #RRGGBBAA"""
     if color is None:
@@ -447,8 +1197,15 @@ def _read_color(color: str) -> Optional[ColorTuple]:
 
 # noinspection PyUnusedLocal
 def _preprocess_cad(obj: CADLike, **kwargs) -> CADCoreLike:
+    from OCP.TopLoc import TopLoc_Location
+    from OCP.TopoDS import TopoDS_Shape
+    # noinspection PyProtectedMember
+    from build123d import Shape, Axis, Location, Vector
+    from yacv_server.cad import get_shape
+
     # Get the shape of a CAD-like object
-    obj = get_shape(obj)
+    with metrics.phase('get_shape'):
+        obj = get_shape(obj)
 
     # Convert Z-up (OCCT convention) to Y-up (GLTF convention)
     if isinstance(obj, TopoDS_Shape):
@@ -470,6 +1227,10 @@ _obj_name_counts = {}
 def _find_var_name(obj: any, avoid_levels: int = 2) -> str:
     """A hacky way to get a stable name for an object that may change over time"""
 
+    # CAD files are named after the file
+    if isinstance(obj, (str, os.PathLike)):
+        return os.path.splitext(os.path.basename(obj))[0]
+
     # Build123d objects have a "label" property, CadQuery Assembly's have "name"
     for f in ('label', 'name'):
         if hasattr(obj, f):
@@ -478,11 +1239,17 @@ def _find_var_name(obj: any, avoid_levels: int = 2) -> str:
                 return v;
 
     # Otherwise walk up our stack to see if there's a local variable that points to it
+    from yacv_server.cad import get_shape
+    # NOTE: Walking the frames directly is much faster than inspect.stack(), which also reads the source code lines
     obj_shape = get_shape(obj, error=False) or obj
-    for frame in inspect.stack()[avoid_levels:]:
-        for key, value in frame.frame.f_locals.items():
+    frame = inspect.currentframe()
+    for _ in range(avoid_levels):
+        frame = frame.f_back if frame is not None else None
+    while frame is not None:
+        for key, value in frame.f_locals.items():
             if get_shape(value, error=False) is obj_shape:
                 return key
+        frame = frame.f_back
 
     # Last resort, name it for its type with a disambiguating number
     global _obj_name_counts